@@ -0,0 +1,137 @@
+import argparse
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from etl import (DB_PATH, LOAD_MODES, extract_data, extract_date_from_filename, load_window, transform_dataframe,
+                 transform_value_to_date, write_dataframe)
+from manifest import changed_files, content_hash, record_file
+from migrations import apply_migrations
+
+
+def find_retail_files(directory):
+    """Return the CSV files of a directory whose name holds a date that `extract_date_from_filename` understands.
+
+    Args:
+        directory: Directory where the retail files are dropped.
+
+    Returns:
+        List of file paths, sorted by the date of their name.
+    """
+    files = []
+    for entry in os.scandir(directory):
+        if not entry.is_file() or not entry.name.endswith('.csv'):
+            continue
+        try:
+            date_str = extract_date_from_filename(entry.name)
+        except ValueError:
+            continue
+        day, month, year = date_str.split('_')
+        files.append(((year, month, day, entry.name), entry.path))
+    return [path for _, path in sorted(files)]
+
+
+def extract_and_transform(filename):
+    """Run the extract and transform steps of one file; executed in a worker process.
+
+    Returns:
+        Tuple (filename, transformed DataFrame, content hash of the file, seconds spent).
+    """
+    start = time.perf_counter()
+    digest = content_hash(filename)
+    transaction_date = transform_value_to_date(extract_date_from_filename(os.path.basename(filename)))
+    df = transform_dataframe(extract_data(filename), transaction_date)
+    return filename, df, digest, time.perf_counter() - start
+
+
+def load_files(filenames, db_path, mode='upsert', workers=None, skip_unchanged=True, pragmas=None):
+    """Extract and transform files in parallel worker processes and load them through a single writer.
+
+    Only the main process writes to the database, so the workers never compete for the SQLite
+    write lock. At most two files per worker are waiting to be loaded, which bounds the memory
+    used when the workers are faster than the writer. A file that fails is reported and skipped.
+
+    Every loaded file is recorded in the ingested_files manifest in the transaction that loads it,
+    and files that are unchanged since their last load are skipped without being parsed.
+
+    Args:
+        filenames: Paths of the CSV files to load.
+        db_path: Path to the SQLite database.
+        mode: 'append' or 'upsert', see `etl.load_data`.
+        workers: Number of worker processes, defaults to the number of CPUs.
+        skip_unchanged: Skip the files recorded in the manifest with the same size, mtime or content.
+        pragmas: Pragmas of the load window, defaults to etl.LOAD_PRAGMAS, see `etl.load_window`.
+
+    Returns:
+        List of one dictionary per file with its 'file', 'rows', 'inserted', 'duplicates', 'rejected',
+        'transform_seconds', 'load_seconds' and 'error', in the order the files were loaded.
+    """
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"The database file '{db_path}' does not exist.")
+    workers = workers or os.cpu_count()
+    report = []
+    with (ProcessPoolExecutor(max_workers=workers) as pool, sqlite3.connect(db_path) as conn,
+          load_window(conn, pragmas)):
+        apply_migrations(conn)
+        if skip_unchanged:
+            filenames = changed_files(conn, filenames)
+        pending_files = list(reversed(filenames))
+        running = {}
+        while pending_files or running:
+            while pending_files and len(running) < 2 * workers:
+                filename = pending_files.pop()
+                running[pool.submit(extract_and_transform, filename)] = filename
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                filename = running.pop(future)
+                entry = {'file': filename, 'rows': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0,
+                         'transform_seconds': 0.0, 'load_seconds': 0.0, 'error': None}
+                try:
+                    _, df, digest, entry['transform_seconds'] = future.result()
+                    start = time.perf_counter()
+                    entry.update(write_dataframe(conn, df, mode))
+                    record_file(conn, filename, len(df), digest)
+                    conn.commit()
+                    entry['rows'] = len(df)
+                    entry['load_seconds'] = time.perf_counter() - start
+                except Exception as e:
+                    conn.rollback()
+                    entry['error'] = str(e)
+                report.append(entry)
+    return report
+
+
+def print_report(report, wall_seconds):
+    """Print the per-file and total throughput of a batch."""
+    print(f"{'file':<32} | {'rows':>9} | {'inserted':>9} | {'transform (s)':>13} | {'load (s)':>8} | {'rows/sec':>9}")
+    print("-" * 96)
+    for entry in report:
+        name = os.path.basename(entry['file'])
+        if entry['error']:
+            print(f"{name:<32} | failed: {entry['error']}")
+            continue
+        seconds = entry['transform_seconds'] + entry['load_seconds']
+        print(f"{name:<32} | {entry['rows']:>9} | {entry['inserted']:>9} | {entry['transform_seconds']:>13.2f} | "
+              f"{entry['load_seconds']:>8.2f} | {entry['rows'] / seconds if seconds else 0:>9.0f}")
+    total_rows = sum(entry['rows'] for entry in report)
+    print("-" * 96)
+    print(f"{len(report)} files, {total_rows} rows in {wall_seconds:.2f} seconds "
+          f"({total_rows / wall_seconds if wall_seconds else 0:.0f} rows/sec).")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load every retail_DD_MM_YYYY.csv file of a directory.")
+    parser.add_argument('directory', help="Directory holding the CSV files")
+    parser.add_argument('--db', default=DB_PATH, help="Path to the SQLite database")
+    parser.add_argument('--mode', choices=LOAD_MODES, default='upsert')
+    parser.add_argument('--workers', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--force', action='store_true', help="Reload the files that are already in the manifest")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    filenames = find_retail_files(args.directory)
+    report = load_files(filenames, args.db, args.mode, args.workers, skip_unchanged=not args.force)
+    print_report(report, time.perf_counter() - start)
+    if len(report) < len(filenames):
+        print(f"{len(filenames) - len(report)} unchanged files were skipped.")
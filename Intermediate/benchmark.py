@@ -0,0 +1,727 @@
+import argparse
+import asyncio
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+import pandas as pd
+
+import batch_etl
+import data_exploration
+import etl
+import migrations
+import partitions
+import query_cache
+import query_service
+import snapshot
+import watch_etl
+
+PRODUCTS = {
+    'Amazon Echo Dot': 49.99,
+    'Apple iPhone 14': 799.99,
+    'Fitbit Charge 5': 89.99,
+    'Nike Running Shoes': 79.99,
+    'Patagonia Jacket': 159.99,
+    'Samsung Galaxy S22': 699.99,
+    'Sony WH-1000XM4': 279.99,
+    'Instant Pot Duo': 89.95,
+}
+
+
+def generate_retail_csv(path, rows, seed=0):
+    """Write a synthetic CSV file in the retail_DD_MM_YYYY.csv schema.
+
+    Args:
+        path: Destination path of the CSV file.
+        rows: Number of transactions to generate.
+        seed: Seed of the random generator, for reproducible files.
+    """
+    rng = random.Random(seed)
+    names = list(PRODUCTS)
+    with open(path, 'w') as f:
+        f.write("id,category,description,quantity,amount_excl_tax,amount_inc_tax\n")
+        for _ in range(rows):
+            name = rng.choice(names)
+            quantity = rng.randint(1, 5)
+            amount_excl_tax = round(PRODUCTS[name] * quantity, 2)
+            amount_inc_tax = round(amount_excl_tax * (1 + etl.TAX_RATE), 2)
+            f.write(f"{uuid.UUID(int=rng.getrandbits(128), version=4)},{rng.choice(('SELL', 'BUY'))},"
+                    f"{name},{quantity},{amount_excl_tax},{amount_inc_tax}\n")
+
+
+def create_empty_database(path):
+    """Create an empty SQLite database with the same transactions schema as retail.db."""
+    with sqlite3.connect(etl.DB_PATH) as source, sqlite3.connect(path) as target:
+        (schema,) = source.execute(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'transactions'").fetchone()
+        target.execute(schema)
+
+
+def populate_database(path, rows, days=365):
+    """Fill the transactions table of `path` with synthetic rows spread over `days` days, directly in SQL."""
+    names = list(PRODUCTS)
+    name_case = " ".join(f"WHEN {i} THEN '{name}'" for i, name in enumerate(names))
+    price_case = " ".join(f"WHEN {i} THEN {price}" for i, price in enumerate(PRODUCTS.values()))
+    with sqlite3.connect(path) as conn:
+        conn.execute(f"""
+            INSERT INTO transactions (id, transaction_date, category, name, quantity, amount_excl_tax, amount_inc_tax)
+            WITH RECURSIVE seq(n) AS (SELECT 0 UNION ALL SELECT n + 1 FROM seq WHERE n + 1 < ?),
+            draws AS (SELECT n, abs(random()) % {len(names)} AS product, 1 + abs(random()) % 5 AS quantity FROM seq)
+            SELECT lower(hex(randomblob(16))),
+                   date('2022-01-01', '+' || (n % ?) || ' days'),
+                   CASE n % 2 WHEN 0 THEN 'SELL' ELSE 'BUY' END,
+                   CASE product {name_case} END,
+                   quantity,
+                   round((CASE product {price_case} END) * quantity, 2),
+                   round((CASE product {price_case} END) * quantity * {1 + etl.TAX_RATE}, 2)
+            FROM draws
+        """, (rows, days))
+
+
+def migrate_database(path):
+    """Apply the schema migrations to `path`, as the first load does, before the read paths query it."""
+    with sqlite3.connect(path) as conn:
+        migrations.apply_migrations(conn)
+
+
+def _peak_rss_mb():
+    """Return the peak resident set size of the current process in MiB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_single_shot(filename, db_path):
+    start = time.perf_counter()
+    df = etl.extract_data(filename)
+    transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+    df = etl.transform_dataframe(df, transaction_date)
+    etl.load_data(df, db_path)
+    return len(df), time.perf_counter() - start, _peak_rss_mb()
+
+
+def _run_streaming(filename, db_path, chunksize=etl.CHUNK_SIZE):
+    start = time.perf_counter()
+    transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+    chunks = etl.extract_data_in_chunks(filename, chunksize)
+    result = etl.load_data_in_chunks(chunks, transaction_date, db_path)
+    return result['inserted'], time.perf_counter() - start, _peak_rss_mb()
+
+
+def run_isolated(func, *args):
+    """Run `func(*args)` in a fresh process so that its peak RSS is measured on its own."""
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+def benchmark_streaming(sizes, chunksize=etl.CHUNK_SIZE):
+    """Compare peak memory and throughput of the single-shot and streaming load paths."""
+    print(f"{'rows':>10} | {'mode':<11} | {'seconds':>8} | {'rows/sec':>10} | {'peak RSS MiB':>12}")
+    print("-" * 64)
+    for rows in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, 'retail_15_01_2022.csv')
+            generate_retail_csv(filename, rows)
+            modes = [('single-shot', _run_single_shot, ()), ('streaming', _run_streaming, (chunksize,))]
+            for mode, func, extra in modes:
+                db_path = os.path.join(workdir, f'{mode}.db')
+                create_empty_database(db_path)
+                loaded, seconds, peak_rss = run_isolated(func, filename, db_path, *extra)
+                print(f"{loaded:>10} | {mode:<11} | {seconds:>8.2f} | {loaded / seconds:>10.0f} | {peak_rss:>12.1f}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def benchmark_upsert(sizes):
+    """Time a first upsert load of a file against a reload of the same, already loaded, file."""
+    print(f"{'rows':>10} | {'load':<8} | {'seconds':>8} | {'inserted':>10} | {'duplicates':>10}")
+    print("-" * 58)
+    for rows in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, 'retail_15_01_2022.csv')
+            generate_retail_csv(filename, rows)
+            db_path = os.path.join(workdir, 'upsert.db')
+            create_empty_database(db_path)
+            transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+            df = etl.transform_dataframe(etl.extract_data(filename), transaction_date)
+            for load in ('first', 'reload'):
+                start = time.perf_counter()
+                result = etl.load_data(df, db_path, mode='upsert')
+                seconds = time.perf_counter() - start
+                print(f"{rows:>10} | {load:<8} | {seconds:>8.2f} | {result['inserted']:>10} | {result['duplicates']:>10}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def benchmark_bulk_load(sizes):
+    """Compare the rows/sec of DataFrame.to_sql with the bulk writer of etl.load_data, with and without
+    its load window pragmas and with the indexes rebuilt after the insert."""
+    print(f"{'rows':>10} | {'write path':<30} | {'seconds':>8} | {'rows/sec':>10}")
+    print("-" * 68)
+    for rows in sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(workdir, 'retail_15_01_2022.csv')
+            generate_retail_csv(filename, rows)
+            transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+            df = etl.transform_dataframe(etl.extract_data(filename), transaction_date)
+            # to_sql would store the dates as timestamps, which the typed table rejects
+            to_sql_df = df.assign(transaction_date=pd.to_datetime(df['transaction_date']).dt.strftime('%Y-%m-%d'))
+
+            def to_sql(db_path):
+                with sqlite3.connect(db_path) as conn:
+                    to_sql_df.to_sql('transactions', conn, if_exists='append', index=False)
+
+            write_paths = {
+                'DataFrame.to_sql': to_sql,
+                'bulk writer, default pragmas': lambda db_path: etl.load_data(df, db_path, pragmas={}),
+                'bulk writer, load pragmas': lambda db_path: etl.load_data(df, db_path),
+                'bulk writer, rebuilt indexes': lambda db_path: etl.load_data(df, db_path, rebuild_indexes=True),
+            }
+            for name, write in write_paths.items():
+                db_path = os.path.join(workdir, 'bulk.db')
+                _fresh_database(db_path)
+                with sqlite3.connect(db_path) as conn:
+                    migrations.apply_migrations(conn)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    start = time.perf_counter()
+                    write(db_path)
+                    seconds = time.perf_counter() - start
+                print(f"{rows:>10} | {name:<30} | {seconds:>8.2f} | {rows / seconds:>10.0f}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def _time_queries(db_path, balance_table='daily_balances', date='2022-01-14', product_name='Amazon Echo Dot'):
+    """Return the duration in seconds of each data_exploration query.
+
+    With `balance_table='transactions'` the balance queries aggregate the raw table,
+    as they did before the daily_balances summary existed.
+    """
+    queries = {
+        'get_number_of_transactions': (data_exploration.NUMBER_OF_TRANSACTIONS_QUERY.format(table='transactions'),
+                                       (date,)),
+        'get_total_sell_transactions': (data_exploration.TOTAL_SELL_TRANSACTIONS_QUERY, ()),
+        'get_balance_by_date': (data_exploration.BALANCE_BY_DATE_QUERY, (product_name,)),
+        'get_cumulative_balance': (data_exploration.CUMULATIVE_BALANCE_QUERY, ()),
+        'get_product_balances': data_exploration._product_balances_query(
+            data_exploration.PRODUCT_BALANCES_QUERY, [product_name], [("transaction_date >= ?", date)]),
+    }
+    timings = {}
+    with sqlite3.connect(db_path) as conn:
+        for name, (query, params) in queries.items():
+            start = time.perf_counter()
+            conn.execute(query.replace('daily_balances', balance_table), params).fetchall()
+            timings[name] = time.perf_counter() - start
+    return timings
+
+
+def benchmark_query_plans(rows):
+    """Time the exploration queries before and after the schema migrations, and show their query plans."""
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(workdir, 'plans.db')
+        create_empty_database(db_path)
+        populate_database(db_path, rows)
+        before = _time_queries(db_path, balance_table='transactions')
+
+        with sqlite3.connect(db_path) as conn:
+            start = time.perf_counter()
+            migrations.apply_migrations(conn)
+            print(f"Migrated {rows} rows in {time.perf_counter() - start:.2f} seconds.\n")
+            plans = data_exploration.explain_query_plans(conn.cursor())
+        after = _time_queries(db_path)
+
+        print(f"{'query':<28} | {'before (s)':>10} | {'after (s)':>10} | plan")
+        print("-" * 100)
+        for name, plan in plans.items():
+            print(f"{name:<28} | {before[name]:>10.3f} | {after[name]:>10.3f} | {'; '.join(plan)}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_product_balances(history_rows, days=3 * 365, repeat=5):
+    """Time the balances of every product with a get_balance_by_date call per product against one batched call."""
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(workdir, 'balances.db')
+        create_empty_database(db_path)
+        populate_database(db_path, history_rows, days)
+        migrate_database(db_path)
+        with data_exploration.connect_to_database(db_path) as conn:
+            cursor = conn.cursor()
+            products = [name for (name,) in cursor.execute("SELECT DISTINCT name FROM daily_balances ORDER BY name")]
+            (last_date,) = cursor.execute("SELECT MAX(transaction_date) FROM daily_balances").fetchone()
+            last_week = (datetime.date.fromisoformat(last_date) - datetime.timedelta(days=6)).isoformat()
+            queries = {
+                'get_balance_by_date per product': lambda: [data_exploration.get_balance_by_date(cursor, name)
+                                                            for name in products],
+                'get_product_balances': lambda: data_exploration.get_product_balances(cursor),
+                'get_product_balances, last 7 days': lambda: data_exploration.get_product_balances(
+                    cursor, start_date=last_week),
+            }
+            print(f"{len(products)} products over {days} days, {history_rows} transactions.")
+            print(f"{'query':<34} | {'seconds':>8}")
+            print("-" * 45)
+            for name, query in queries.items():
+                print(f"{name:<34} | {_best_of(repeat, query):>8.4f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_daily_load(history_sizes, daily_rows=50_000, intraday_rows=1_000):
+    """Time the load of one new daily file and of a small intraday file of the same day as history grows.
+
+    Both loads include their daily_balances update, compared with a full refresh of the day's summary.
+    """
+    print(f"{'history rows':>12} | {'daily rows':>10} | {'load (s)':>8} | {'intraday (s)':>12} | {'full refresh (s)':>16}")
+    print("-" * 72)
+    for history_rows in history_sizes:
+        workdir = tempfile.mkdtemp()
+        try:
+            db_path = os.path.join(workdir, 'daily.db')
+            create_empty_database(db_path)
+            populate_database(db_path, history_rows)
+            migrate_database(db_path)
+            filename = os.path.join(workdir, 'retail_15_01_2023.csv')
+            generate_retail_csv(filename, daily_rows)
+            transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+            df = etl.transform_dataframe(etl.extract_data(filename), transaction_date)
+
+            generate_retail_csv(filename, intraday_rows, seed=1)
+            intraday_df = etl.transform_dataframe(etl.extract_data(filename), transaction_date)
+
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                etl.load_data(df, db_path, mode='upsert')
+                load_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                etl.load_data(intraday_df, db_path, mode='upsert')
+                intraday_seconds = time.perf_counter() - start
+            with sqlite3.connect(db_path) as conn:
+                start = time.perf_counter()
+                etl.refresh_daily_balances(conn, ['2023-01-15'])
+                refresh_seconds = time.perf_counter() - start
+            print(f"{history_rows:>12} | {daily_rows:>10} | {load_seconds:>8.2f} | {intraday_seconds:>12.3f} | "
+                  f"{refresh_seconds:>16.3f}")
+        finally:
+            shutil.rmtree(workdir)
+
+
+def benchmark_batch(files, rows_per_file, worker_counts):
+    """Time the parallel ingestion of a directory of daily files with different numbers of workers."""
+    workdir = tempfile.mkdtemp()
+    try:
+        drop_dir = os.path.join(workdir, 'drop')
+        os.mkdir(drop_dir)
+        for day in range(files):
+            generate_retail_csv(os.path.join(drop_dir, f'retail_{day % 28 + 1:02d}_{day // 28 % 12 + 1:02d}_2022.csv'),
+                                rows_per_file, seed=day)
+        filenames = batch_etl.find_retail_files(drop_dir)
+        print(f"{'workers':>7} | {'files':>5} | {'rows':>10} | {'seconds':>8} | {'rows/sec':>10}")
+        print("-" * 53)
+        for workers in worker_counts:
+            db_path = os.path.join(workdir, f'batch_{workers}.db')
+            create_empty_database(db_path)
+            start = time.perf_counter()
+            report = batch_etl.load_files(filenames, db_path, workers=workers)
+            seconds = time.perf_counter() - start
+            rows = sum(entry['rows'] for entry in report)
+            print(f"{workers:>7} | {len(report):>5} | {rows:>10} | {seconds:>8.2f} | {rows / seconds:>10.0f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _run_watch(staging_dir, drop_dir, db_path, interval):
+    """Drop every file of `staging_dir` into a watched directory at once and wait until all are loaded."""
+    reports = []
+    stop = threading.Event()
+    daemon = threading.Thread(target=watch_etl.watch, args=(drop_dir, db_path),
+                              kwargs={'interval': interval, 'stop': stop, 'on_batch': reports.append})
+    daemon.start()
+    filenames = sorted(os.listdir(staging_dir))
+    start = time.perf_counter()
+    for name in filenames:
+        os.replace(os.path.join(staging_dir, name), os.path.join(drop_dir, name))
+        # A rename keeps the mtime of the generation, the file lands now
+        os.utime(os.path.join(drop_dir, name))
+    while sum(len(report) for report in reports) < len(filenames):
+        time.sleep(0.01)
+    seconds = time.perf_counter() - start
+    stop.set()
+    daemon.join()
+    latencies = [entry['latency_seconds'] for report in reports for entry in report]
+    rows = sum(entry['inserted'] for report in reports for entry in report)
+    return len(reports), rows, seconds, latencies, _peak_rss_mb()
+
+
+def benchmark_watch(files, rows_per_file, interval=watch_etl.POLL_INTERVAL):
+    """Measure the latency from landing to queryable and the peak memory of the watch daemon for a burst of files."""
+    workdir = tempfile.mkdtemp()
+    try:
+        staging_dir = os.path.join(workdir, 'staging')
+        drop_dir = os.path.join(workdir, 'drop')
+        os.mkdir(staging_dir)
+        os.mkdir(drop_dir)
+        for day in range(files):
+            generate_retail_csv(os.path.join(staging_dir, f'retail_{day % 28 + 1:02d}_{day // 28 % 12 + 1:02d}_2022.csv'),
+                                rows_per_file, seed=day)
+        db_path = os.path.join(workdir, 'watch.db')
+        create_empty_database(db_path)
+        batches, rows, seconds, latencies, peak_rss = run_isolated(_run_watch, staging_dir, drop_dir, db_path, interval)
+        percentiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        print(f"{files} files of {rows_per_file} rows loaded in {batches} micro-batches and {seconds:.2f} seconds "
+              f"({rows / seconds:.0f} rows/sec).")
+        print(f"Latency from landing to queryable: p50 {percentiles[49]:.2f} s, p99 {percentiles[98]:.2f} s, "
+              f"max {max(latencies):.2f} s. Peak RSS {peak_rss:.0f} MiB.")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_cold_start(sizes, repeat=5):
+    """Time `python etl.py` from process start to exit after the commit, with each engine and file size.
+
+    Every run is a new interpreter loading the file into an empty database, like an invocation of the
+    Lambda-style deployment; the median of `repeat` runs is kept.
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'etl.py')
+    workdir = tempfile.mkdtemp()
+    try:
+        baseline = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, '-c', 'pass'], check=True)
+            baseline.append(time.perf_counter() - start)
+        print(f"Interpreter start and exit: {statistics.median(baseline):.3f} s")
+        print(f"{'rows':>8} | {'bytes':>10} | {'stdlib (s)':>10} | {'pandas (s)':>10}")
+        print("-" * 47)
+        for rows in sizes:
+            filename = os.path.join(workdir, 'retail_15_01_2023.csv')
+            generate_retail_csv(filename, rows)
+            timings = {}
+            for engine in ('stdlib', 'pandas'):
+                runs = []
+                for _ in range(repeat):
+                    db_path = os.path.join(workdir, 'cold.db')
+                    if os.path.exists(db_path):
+                        os.remove(db_path)
+                    create_empty_database(db_path)
+                    start = time.perf_counter()
+                    subprocess.run([sys.executable, script, filename, '--db', db_path, '--engine', engine],
+                                   check=True, stdout=subprocess.DEVNULL)
+                    runs.append(time.perf_counter() - start)
+                    with sqlite3.connect(db_path) as conn:
+                        (loaded,) = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()
+                    if loaded != rows:
+                        raise RuntimeError(f"The {engine} engine loaded {loaded} of {rows} rows")
+                timings[engine] = statistics.median(runs)
+            print(f"{rows:>8} | {os.path.getsize(filename):>10} | {timings['stdlib']:>10.3f} | {timings['pandas']:>10.3f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_rerun(files, rows_per_file):
+    """Time a first batch run over many daily files against a rerun that the manifest skips."""
+    workdir = tempfile.mkdtemp()
+    try:
+        drop_dir = os.path.join(workdir, 'drop')
+        os.mkdir(drop_dir)
+        start_date = datetime.date(2015, 1, 1)
+        for day in range(files):
+            file_date = start_date + datetime.timedelta(days=day)
+            generate_retail_csv(os.path.join(drop_dir, f"retail_{file_date:%d_%m_%Y}.csv"), rows_per_file, seed=day)
+        db_path = os.path.join(workdir, 'rerun.db')
+        create_empty_database(db_path)
+        for run in ('first', 'rerun'):
+            start = time.perf_counter()
+            report = batch_etl.load_files(batch_etl.find_retail_files(drop_dir), db_path)
+            print(f"{run:<6}: {len(report)} of {files} files loaded in {time.perf_counter() - start:.2f} seconds")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _best_of(repeat, func, setup=None):
+    """Return the shortest duration of `repeat` runs of `func`, calling `setup` untimed before each run."""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_suite(rows, history_rows, repeat=3):
+    """Time every ETL stage and every data_exploration query on synthetic data.
+
+    Args:
+        rows: Number of rows of the daily file going through extract, transform and load.
+        history_rows: Number of rows in the transactions table queried by data_exploration.
+        repeat: Number of runs of each measurement; the fastest one is kept.
+
+    Returns:
+        List of {'name', 'rows', 'seconds', 'rows_per_sec'} results.
+    """
+    workdir = tempfile.mkdtemp()
+    results = []
+
+    def record(name, measured_rows, seconds):
+        results.append({'name': name, 'rows': measured_rows, 'seconds': seconds,
+                        'rows_per_sec': measured_rows / seconds if seconds else None})
+        print(f"{name:<45} | {measured_rows:>10} | {seconds:>8.4f} s")
+
+    try:
+        filename = os.path.join(workdir, 'retail_15_01_2023.csv')
+        generate_retail_csv(filename, rows)
+        transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+        raw = etl.extract_data(filename)
+        transformed = etl.transform_dataframe(raw.copy(), transaction_date)
+
+        record('etl.extract_data', rows, _best_of(repeat, lambda: etl.extract_data(filename)))
+        record('etl.transform_dataframe', rows,
+               _best_of(repeat, lambda: etl.transform_dataframe(raw.copy(), transaction_date)))
+        record('etl.validate_dataframe', rows, _best_of(repeat, lambda: etl.validate_dataframe(transformed)))
+        db_path = os.path.join(workdir, 'load.db')
+        with contextlib.redirect_stdout(io.StringIO()):
+            load_seconds = _best_of(repeat, lambda: etl.load_data(transformed, db_path, mode='upsert'),
+                                    setup=lambda: _fresh_database(db_path))
+        record('etl.load_data', rows, load_seconds)
+
+        history_path = os.path.join(workdir, 'history.db')
+        create_empty_database(history_path)
+        populate_database(history_path, history_rows)
+        migrate_database(history_path)
+        with data_exploration.connect_to_database(history_path) as conn:
+            cursor = conn.cursor()
+            queries = {
+                'get_number_of_transactions': lambda: data_exploration.get_number_of_transactions(cursor, '2022-01-14'),
+                'get_total_sell_transactions': lambda: data_exploration.get_total_sell_transactions(cursor),
+                'get_balance_by_date': lambda: data_exploration.get_balance_by_date(cursor, 'Amazon Echo Dot'),
+                'get_cumulative_balance': lambda: data_exploration.get_cumulative_balance(cursor),
+            }
+            for name, query in queries.items():
+                record(f'data_exploration.{name}', history_rows, _best_of(repeat, query))
+    finally:
+        shutil.rmtree(workdir)
+    return results
+
+
+def _fresh_database(path):
+    # The load window switches the databases to WAL, whose -wal and -shm files must not outlive them
+    for stale_path in (path, path + '-wal', path + '-shm'):
+        if os.path.exists(stale_path):
+            os.remove(stale_path)
+    create_empty_database(path)
+
+
+def save_results(results, path, **parameters):
+    """Write suite results to a JSON file together with the parameters and library versions of the run."""
+    document = {
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'sqlite': sqlite3.sqlite_version,
+        'parameters': parameters,
+        'results': results,
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2)
+
+
+def benchmark_suite(rows, history_rows, repeat, output):
+    results = run_suite(rows, history_rows, repeat)
+    if output:
+        save_results(results, output, rows=rows, history_rows=history_rows, repeat=repeat)
+        print(f"Results saved to {output}.")
+
+
+def benchmark_partitions(history_rows, days=3 * 365):
+    """Compare the flat and partitioned layouts on a date count, a daily load and the removal of a month."""
+    workdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(workdir, 'retail_15_01_2025.csv')
+        generate_retail_csv(filename, 50_000)
+        transaction_date = etl.transform_value_to_date(etl.extract_date_from_filename(filename))
+        df = etl.transform_dataframe(etl.extract_data(filename), transaction_date)
+        print(f"{'layout':<12} | {'count of a date (ms)':>20} | {'daily load (s)':>14} | {'drop a month (s)':>16}")
+        print("-" * 72)
+        for layout in ('flat', 'partitioned'):
+            db_path = os.path.join(workdir, f'{layout}.db')
+            create_empty_database(db_path)
+            populate_database(db_path, history_rows, days)
+            migrate_database(db_path)
+            with data_exploration.connect_to_database(db_path) as conn:
+                if layout == 'partitioned':
+                    partitions.enable_partitioning(conn)
+                cursor = conn.cursor()
+                count_seconds = _best_of(5, lambda: data_exploration.get_number_of_transactions(cursor, '2023-06-14'))
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                etl.load_data(df, db_path, mode='upsert')
+                load_seconds = time.perf_counter() - start
+            with sqlite3.connect(db_path) as conn:
+                start = time.perf_counter()
+                if layout == 'partitioned':
+                    partitions.drop_partition(conn, '2022-03')
+                else:
+                    conn.execute("DELETE FROM transactions WHERE transaction_date BETWEEN '2022-03-01' AND '2022-03-31'")
+                    conn.execute("DELETE FROM daily_balances WHERE transaction_date BETWEEN '2022-03-01' AND '2022-03-31'")
+                    conn.commit()
+                drop_seconds = time.perf_counter() - start
+            print(f"{layout:<12} | {count_seconds * 1000:>20.2f} | {load_seconds:>14.2f} | {drop_seconds:>16.3f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_snapshot(history_rows, product_name='Amazon Echo Dot'):
+    """Compare the balance queries and a full column read on SQLite and on a memory-mapped snapshot."""
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(workdir, 'snapshot.db')
+        create_empty_database(db_path)
+        populate_database(db_path, history_rows)
+        migrate_database(db_path)
+        with data_exploration.connect_to_database(db_path) as conn:
+            start = time.perf_counter()
+            snapshot.export_snapshot(conn, os.path.join(workdir, 'snapshot'))
+            print(f"Exported {history_rows} rows in {time.perf_counter() - start:.2f} seconds.")
+            start = time.perf_counter()
+            columns = snapshot.Snapshot(os.path.join(workdir, 'snapshot'))
+            print(f"Opened the snapshot in {(time.perf_counter() - start) * 1000:.2f} ms.\n")
+
+            raw = {query: query.replace('daily_balances', 'transactions') for query in
+                   (data_exploration.BALANCE_BY_DATE_QUERY, data_exploration.CUMULATIVE_BALANCE_QUERY)}
+            measurements = {
+                'balance by date': [
+                    ('SQL on transactions', lambda: conn.execute(raw[data_exploration.BALANCE_BY_DATE_QUERY],
+                                                                 (product_name,)).fetchall()),
+                    ('SQL on daily_balances', lambda: data_exploration.get_balance_by_date(conn.cursor(), product_name)),
+                    ('snapshot', lambda: columns.balance_by_date(product_name)),
+                ],
+                'cumulative balance': [
+                    ('SQL on transactions', lambda: conn.execute(raw[data_exploration.CUMULATIVE_BALANCE_QUERY]).fetchall()),
+                    ('SQL on daily_balances', lambda: data_exploration.get_cumulative_balance(conn.cursor())),
+                    ('snapshot', columns.cumulative_balance),
+                ],
+                'amount_inc_tax as an array': [
+                    ('SQL', lambda: np.array(conn.execute("SELECT amount_inc_tax FROM transactions").fetchall(),
+                                             dtype='float64')),
+                    ('snapshot', lambda: np.asarray(columns.columns['amount_inc_tax']).sum()),
+                ],
+            }
+            print(f"{'question':<28} | {'path':<24} | {'seconds':>8}")
+            print("-" * 66)
+            for question, paths in measurements.items():
+                for path, func in paths:
+                    print(f"{question:<28} | {path:<24} | {_best_of(3, func):>8.4f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+async def _query_load(service, concurrency, requests):
+    """Issue `requests` queries from `concurrency` concurrent clients, cycling over the dashboard queries.
+
+    Returns:
+        Tuple (latency of every query in seconds, wall time of the whole load in seconds).
+    """
+    products = list(PRODUCTS)
+    mix = [
+        lambda n: service.get_number_of_transactions(f'2022-{n % 12 + 1:02d}-14'),
+        lambda n: service.get_total_sell_transactions(),
+        lambda n: service.get_balance_by_date(products[n % len(products)]),
+        lambda n: service.get_cumulative_balance(),
+    ]
+    latencies = []
+
+    async def client(first_request):
+        for n in range(first_request, requests, concurrency):
+            start = time.perf_counter()
+            await mix[n % len(mix)](n)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(i) for i in range(concurrency)))
+    return latencies, time.perf_counter() - start
+
+
+def benchmark_query_service(history_rows, concurrencies, pool_size=query_service.POOL_SIZE, requests=400, cache=False):
+    """Report p50/p99 latency and queries/sec of the query service as the number of concurrent clients grows,
+    optionally with a result cache."""
+    workdir = tempfile.mkdtemp()
+    try:
+        db_path = os.path.join(workdir, 'service.db')
+        create_empty_database(db_path)
+        populate_database(db_path, history_rows)
+        migrate_database(db_path)
+
+        async def run():
+            async with query_service.QueryService(db_path, pool_size,
+                                                  query_cache.QueryCache() if cache else None) as service:
+                for concurrency in concurrencies:
+                    latencies, seconds = await _query_load(service, concurrency, requests)
+                    percentiles = statistics.quantiles(latencies, n=100)
+                    print(f"{concurrency:>11} | {pool_size:>9} | {percentiles[49] * 1000:>8.1f} | "
+                          f"{percentiles[98] * 1000:>8.1f} | {len(latencies) / seconds:>11.1f}")
+                if service.cache:
+                    stats = service.cache.stats()
+                    print(f"Result cache: {stats['hits']} hits, {stats['misses']} misses.")
+
+        print(f"{'concurrency':>11} | {'pool size':>9} | {'p50 (ms)':>8} | {'p99 (ms)':>8} | {'queries/sec':>11}")
+        print("-" * 60)
+        asyncio.run(run())
+    finally:
+        shutil.rmtree(workdir)
+
+
+BENCHMARKS = {
+    'streaming': lambda args: benchmark_streaming(args.sizes, args.chunksize),
+    'upsert': lambda args: benchmark_upsert(args.sizes),
+    'bulk': lambda args: benchmark_bulk_load(args.sizes),
+    'plans': lambda args: benchmark_query_plans(args.sizes[-1]),
+    'daily': lambda args: benchmark_daily_load(args.sizes),
+    'balances': lambda args: benchmark_product_balances(args.history, repeat=args.repeat),
+    'batch': lambda args: benchmark_batch(args.files, args.sizes[0], args.workers),
+    'rerun': lambda args: benchmark_rerun(args.files, args.sizes[0]),
+    'coldstart': lambda args: benchmark_cold_start(args.sizes, args.repeat),
+    'watch': lambda args: benchmark_watch(args.files, args.sizes[0]),
+    'partitions': lambda args: benchmark_partitions(args.history),
+    'snapshot': lambda args: benchmark_snapshot(args.history),
+    'service': lambda args: benchmark_query_service(args.history, args.concurrency, args.pool_size, cache=args.cache),
+    'suite': lambda args: benchmark_suite(args.sizes[0], args.history, args.repeat, args.output),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the retail ETL.")
+    parser.add_argument('benchmark', nargs='?', choices=BENCHMARKS, default='streaming')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 1_000_000])
+    parser.add_argument('--chunksize', type=int, default=etl.CHUNK_SIZE)
+    parser.add_argument('--files', type=int, default=30, help="Number of daily files of the batch benchmark")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, os.cpu_count()])
+    parser.add_argument('--history', type=int, default=1_000_000, help="Rows queried by the suite benchmark")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help="Concurrent clients of the service benchmark")
+    parser.add_argument('--pool-size', type=int, default=query_service.POOL_SIZE,
+                        help="Connections of the query service in the service benchmark")
+    parser.add_argument('--cache', action='store_true', help="Serve the service benchmark through a result cache")
+    parser.add_argument('--repeat', type=int, default=3, help="Runs of each suite measurement, the fastest is kept")
+    parser.add_argument('--output', help="JSON file where the suite benchmark saves its results")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -1,30 +1,134 @@
+import os
 import sqlite3
+import sys
+
+from migrations import check_schema
+from partitions import partition_for_date
+
+# instrumentation.py is shared with the Junior project and lives at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from instrumentation import instrumented
+
+# SQL of the exploration queries, also used by the query plan check.
+# The balance queries read the daily_balances summary table maintained by etl.py, and the count of
+# one date reads the table returned by partitions.partition_for_date.
+NUMBER_OF_TRANSACTIONS_QUERY = "SELECT COUNT(*) AS number_of_transactions FROM {table} WHERE transaction_date = ?;"
+
+TOTAL_SELL_TRANSACTIONS_QUERY = """
+    SELECT SUM(amount_inc_tax) AS total_amount_sell_transactions_incltax
+    FROM transactions
+    WHERE category = 'SELL';
+"""
+
+BALANCE_BY_DATE_QUERY = """
+    SELECT
+        transaction_date,
+        SUM(CASE
+            WHEN category = 'SELL' THEN amount_inc_tax
+            WHEN category = 'BUY' THEN -amount_inc_tax
+            ELSE 0
+        END) AS balance
+    FROM
+        daily_balances
+    WHERE
+        name = ?
+    GROUP BY
+        transaction_date
+    ORDER BY
+        transaction_date;
+"""
+
+CUMULATIVE_BALANCE_QUERY = """
+    WITH DailyBalances AS (
+        SELECT
+            transaction_date,
+            SUM(CASE
+                WHEN category = 'SELL' THEN amount_inc_tax
+                WHEN category = 'BUY' THEN -amount_inc_tax
+                ELSE 0
+            END) AS daily_balance
+        FROM
+            daily_balances
+        GROUP BY
+            transaction_date
+    )
+    SELECT
+        transaction_date,
+        SUM(daily_balance) OVER (ORDER BY transaction_date) AS cumulated_balance
+    FROM
+        DailyBalances
+    ORDER BY
+        transaction_date;
+"""
+
+# Daily balance of every product in one pass over the idx_daily_balances_name index, in product and
+# date order. {where} filters the products and dates.
+PRODUCT_BALANCES_QUERY = """
+    SELECT
+        name,
+        transaction_date,
+        SUM(CASE
+            WHEN category = 'SELL' THEN amount_inc_tax
+            WHEN category = 'BUY' THEN -amount_inc_tax
+            ELSE 0
+        END) AS balance
+    FROM
+        daily_balances
+    {where}
+    GROUP BY
+        name, transaction_date
+    ORDER BY
+        name, transaction_date;
+"""
+
+# Balance of every product before a date, where the running totals of a date range start
+OPENING_BALANCES_QUERY = """
+    SELECT
+        name,
+        SUM(CASE
+            WHEN category = 'SELL' THEN amount_inc_tax
+            WHEN category = 'BUY' THEN -amount_inc_tax
+            ELSE 0
+        END) AS opening_balance
+    FROM
+        daily_balances
+    {where}
+    GROUP BY
+        name;
+"""
+
 
 # Function to connect to the SQLite database
 def connect_to_database(db_path):
-    """Establish a connection to the SQLite database."""
+    """Establish a connection to the SQLite database and check that its schema is up to date.
+
+    The queries only read, so the migrations are left to the loaders, see `migrations.check_schema`.
+    """
     try:
-        return sqlite3.connect(db_path)
+        conn = sqlite3.connect(db_path)
+        check_schema(conn)
+        return conn
     except sqlite3.Error as e:
         raise Exception(f"Database connection error: {e}")
 
 
 # Function to get the number of transactions on 14/01/2022
+@instrumented('query.get_number_of_transactions')
 def get_number_of_transactions(cursor, date):
-    """Return the number of transactions on a specific date."""
-    cursor.execute("SELECT COUNT(*) AS number_of_transactions FROM transactions WHERE transaction_date = ?;", (date,))
+    """Return the number of transactions on a specific date, reading only its partition in a partitioned database."""
+    table = partition_for_date(cursor, date)
+    if table is None:
+        return 0
+    cursor.execute(NUMBER_OF_TRANSACTIONS_QUERY.format(table=table), (date,))
     row_counts = cursor.fetchone() # Use fetchone() since there's only one result
     return row_counts[0] if row_counts else 0  # Handle case where there are no results
 
 
 # Function to get the total amount of sell transactions
+@instrumented('query.get_total_sell_transactions')
 def get_total_sell_transactions(cursor):
     """Return the total amount of sell transactions including tax."""
-    cursor.execute("""
-        SELECT SUM(amount_inc_tax) AS total_amount_sell_transactions_incltax  
-        FROM transactions   
-        WHERE category = 'SELL';
-    """)
+    cursor.execute(TOTAL_SELL_TRANSACTIONS_QUERY)
     total_row = cursor.fetchone()
     return total_row[0] if total_row else 0
 
@@ -33,61 +137,109 @@ def get_total_sell_transactions(cursor):
 # Consider the product Amazon Echo Dot:
 #   What is the balance (SELL - BUY) by date?
 # Function to get balance (SELL - BUY) by date for a specific product
+@instrumented('query.get_balance_by_date', rows_out=len)
 def get_balance_by_date(cursor, product_name):
     """Return balance (SELL - BUY) by transaction date for a specific product."""
-    cursor.execute("""
-        SELECT   
-            transaction_date,   
-            SUM(CASE   
-                WHEN category = 'SELL' THEN amount_inc_tax   
-                WHEN category = 'BUY' THEN -amount_inc_tax   
-                ELSE 0   
-            END) AS balance  
-        FROM   
-            transactions   
-        WHERE   
-            name = ?   
-        GROUP BY   
-            transaction_date   
-        ORDER BY   
-            transaction_date;
-    """, (product_name,))
+    cursor.execute(BALANCE_BY_DATE_QUERY, (product_name,))
     return cursor.fetchall()
 
 # (Optional) What is the cumulated balance (SELL - BUY) by date?
 # Function to get cumulative balance by date
+@instrumented('query.get_cumulative_balance', rows_out=len)
 def get_cumulative_balance(cursor):
     """Return cumulative balance (SELL - BUY) by date."""
-    cursor.execute("""
-        WITH DailyBalances AS (  
-            SELECT   
-                transaction_date,   
-                SUM(CASE   
-                    WHEN category = 'SELL' THEN amount_inc_tax   
-                    WHEN category = 'BUY' THEN -amount_inc_tax   
-                    ELSE 0   
-                END) AS daily_balance  
-            FROM   
-                transactions   
-            GROUP BY   
-                transaction_date   
-        )  
-        SELECT   
-            transaction_date,   
-            SUM(daily_balance) OVER (ORDER BY transaction_date) AS cumulated_balance  
-        FROM   
-            DailyBalances  
-        ORDER BY   
-            transaction_date;
-    """)
+    cursor.execute(CUMULATIVE_BALANCE_QUERY)
     return cursor.fetchall()
 
 
+def _product_balances_query(query, product_names=None, date_conditions=()):
+    """Return `query` filtered on the given products and (condition, date) pairs, and its parameters."""
+    conditions, params = [], []
+    if product_names is not None:
+        conditions.append(f"name IN ({', '.join('?' * len(product_names))})")
+        params.extend(product_names)
+    for condition, date in date_conditions:
+        conditions.append(condition)
+        params.append(date)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    return query.format(where=where), tuple(params)
+
+
+# Balance and cumulated balance (SELL - BUY) by date of every product, e.g. for a per-product dashboard
+@instrumented('query.get_product_balances', rows_out=lambda result: len(result['name']))
+def get_product_balances(cursor, product_names=None, start_date=None, end_date=None):
+    """Return the daily and cumulated balances (SELL - BUY) of many products in one query.
+
+    One grouped pass replaces a `get_balance_by_date` call per product. The cumulated balance of a
+    product is its running total since its first day: with a `start_date` it starts from the balance
+    of the earlier days, which SQLite sums without returning them, so a client can fetch only the
+    days loaded since its last call.
+
+    Args:
+        cursor: Cursor of a migrated database.
+        product_names: Products to return, by default every product.
+        start_date: First date to return in 'YYYY-MM-DD' format, by default the first loaded date.
+        end_date: Last date to return in 'YYYY-MM-DD' format, by default the last loaded date.
+
+    Returns:
+        Dictionary of columns, each a list with one value per (product, date) row, sorted by product
+        and date: 'name', 'transaction_date', 'balance' and 'cumulated_balance'.
+    """
+    if product_names is not None:
+        product_names = list(product_names)
+    date_conditions = []
+    opening_balances = {}
+    if start_date is not None:
+        cursor.execute(*_product_balances_query(OPENING_BALANCES_QUERY, product_names,
+                                                [("transaction_date < ?", start_date)]))
+        opening_balances = dict(cursor.fetchall())
+        date_conditions.append(("transaction_date >= ?", start_date))
+    if end_date is not None:
+        date_conditions.append(("transaction_date <= ?", end_date))
+    cursor.execute(*_product_balances_query(PRODUCT_BALANCES_QUERY, product_names, date_conditions))
+
+    columns = {'name': [], 'transaction_date': [], 'balance': [], 'cumulated_balance': []}
+    product_name, cumulated_balance = None, 0
+    for name, transaction_date, balance in cursor:
+        if name != product_name:
+            product_name, cumulated_balance = name, opening_balances.get(name, 0)
+        cumulated_balance += balance
+        columns['name'].append(name)
+        columns['transaction_date'].append(transaction_date)
+        columns['balance'].append(balance)
+        columns['cumulated_balance'].append(cumulated_balance)
+    return columns
+
+
+# Function to check how SQLite executes each exploration query
+def explain_query_plans(cursor, date='2022-01-14', product_name='Amazon Echo Dot'):
+    """Return the EXPLAIN QUERY PLAN details of every exploration query, keyed by function name."""
+    queries = {
+        'get_number_of_transactions': (
+            NUMBER_OF_TRANSACTIONS_QUERY.format(table=partition_for_date(cursor, date) or 'transactions'), (date,)),
+        'get_total_sell_transactions': (TOTAL_SELL_TRANSACTIONS_QUERY, ()),
+        'get_balance_by_date': (BALANCE_BY_DATE_QUERY, (product_name,)),
+        'get_cumulative_balance': (CUMULATIVE_BALANCE_QUERY, ()),
+        'get_product_balances': _product_balances_query(PRODUCT_BALANCES_QUERY, [product_name],
+                                                        [("transaction_date >= ?", date)]),
+    }
+    plans = {}
+    for function_name, (query, params) in queries.items():
+        cursor.execute("EXPLAIN QUERY PLAN " + query, params)
+        plans[function_name] = [detail for _, _, _, detail in cursor.fetchall()]
+    return plans
+
+
 # Main function to run the queries
 def main():
     db_path = 'retail.db'
 
-    with connect_to_database(db_path) as conn:
+    try:
+        conn = connect_to_database(db_path)
+    except Exception as e:
+        # The read paths do not migrate: an out of date database exits with the migration hint
+        sys.exit(str(e))
+    with conn:
         cursor = conn.cursor()
 
         # Get the number of transactions on 14/01/2022
@@ -1,15 +1,46 @@
+import argparse
+import csv
 import sqlite3
-import pandas as pd
 import re
 import os  # Import os for file existence checking
+import sys
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
+from migrations import apply_migrations, index_statements
+from partitions import claim_ids, route, route_records
+from query_cache import bump_generation
+
+# instrumentation.py is shared with the Junior project and lives at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from instrumentation import configure, instrumented
+
 DB_PATH = 'retail.db'
 FILENAME = 'retail_15_01_2022.csv'
 TAX_RATE = 0.20
+CHUNK_SIZE = 50_000
+# Declared dtypes of the CSV columns, so read_csv does not infer them. quantity is read as a float so
+# that a missing or fractional quantity reaches the validation instead of failing the whole file.
+CSV_DTYPES = {'id': 'str', 'category': 'category', 'description': 'category', 'quantity': 'float64',
+              'amount_excl_tax': 'float64', 'amount_inc_tax': 'float64'}
+CATEGORIES = ('SELL', 'BUY')
+UUID_PATTERN = r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}'
+# amount_inc_tax is rounded to the cent from the rounded amount_excl_tax, so they may be a cent apart
+AMOUNT_TOLERANCE = 0.01
+# pandas is imported inside the functions of the DataFrame engine: importing it costs more than loading a
+# small file, which the stdlib engine loads without it below SMALL_FILE_BYTES (about 27,000 rows), see
+# `choose_engine`. From cold start to commit, the stdlib engine stays faster up to about 3 MiB.
+SMALL_FILE_BYTES = 2 << 20
+ENGINES = ('auto', 'stdlib', 'pandas')
+# Strings read as missing values by pandas.read_csv, so that both engines reject the same rows
+NA_VALUES = frozenset({'', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+                       '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'})
+NUMERIC_COLUMNS = ('quantity', 'amount_excl_tax', 'amount_inc_tax')
 
 
 # Extract
+@instrumented('extract', rows_out=len)
 def extract_data(filename):
     """Extract data from the CSV file into a pandas DataFrame.
 
@@ -22,8 +53,33 @@ def extract_data(filename):
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
     """
+    import pandas as pd
+
     try:
-        return pd.read_csv(filename)
+        return pd.read_csv(filename, dtype=CSV_DTYPES)
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"File not found: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while reading the file: {e}")
+
+
+def extract_data_in_chunks(filename, chunksize=CHUNK_SIZE):
+    """Extract data from the CSV file as an iterator of bounded DataFrame chunks.
+
+    Args:
+        filename: Path to the CSV file.
+        chunksize: Maximum number of rows per chunk.
+
+    Returns:
+        Iterator yielding DataFrames of at most `chunksize` rows.
+
+    Raises:
+        FileNotFoundError: If the specified CSV file does not exist.
+    """
+    import pandas as pd
+
+    try:
+        return pd.read_csv(filename, dtype=CSV_DTYPES, chunksize=chunksize)
     except FileNotFoundError as e:
         raise FileNotFoundError(f"File not found: {e}")
     except Exception as e:
@@ -57,12 +113,15 @@ def transform_value_to_date(value):
     Returns:
         Corresponding datetime object.
     """
+    import pandas as pd
+
     try:
         return pd.to_datetime(value, format='%d_%m_%Y')
     except ValueError as e:
         raise ValueError(f"Error converting string to date: {e}")
 
 
+@instrumented('transform', rows_in=lambda df, *args, **kwargs: len(df), rows_out=len)
 def transform_dataframe(df, transaction_date):
     """Transform the DataFrame by adding a transaction_date column and renaming description to name.
 
@@ -77,13 +136,304 @@ def transform_dataframe(df, transaction_date):
     df.rename(columns={"description": "name"}, inplace=True)
     return df
 
+
+@instrumented('validate', rows_in=len, rows_out=lambda result: len(result[0]))
+def validate_dataframe(df):
+    """Split a transformed DataFrame into the rows that pass validation and the rejected rows.
+
+    Every check is a column operation over the whole DataFrame, so no Python code runs per row:
+    ids must be UUIDs, category one of CATEGORIES, name present, quantity a positive integer and
+    amount_inc_tax equal to amount_excl_tax * (1 + TAX_RATE) within AMOUNT_TOLERANCE.
+
+    Args:
+        df: Transformed DataFrame.
+
+    Returns:
+        Tuple (valid rows with quantity coerced to integers, rejected rows with a 'reason' column
+        listing their failed checks).
+    """
+    import pandas as pd
+
+    quantity = df['quantity']
+    checks = {
+        'invalid id': df['id'].astype('str').str.fullmatch(UUID_PATTERN, case=False),
+        'invalid category': df['category'].isin(CATEGORIES),
+        'missing name': df['name'].notna(),
+        'invalid quantity': (quantity > 0) & (quantity % 1 == 0),
+        'inconsistent tax': (df['amount_inc_tax'] - df['amount_excl_tax'] * (1 + TAX_RATE)).abs() <= AMOUNT_TOLERANCE,
+    }
+    valid = pd.Series(True, index=df.index)
+    for passed in checks.values():
+        valid &= passed
+    if valid.all():
+        return df.astype({'quantity': 'int64'}), df.iloc[:0].assign(reason='')
+
+    rejected = ~valid
+    rejects = df[rejected].copy()
+    reason = pd.Series('', index=rejects.index, dtype=object)
+    for name, passed in checks.items():
+        failed = ~passed[rejected]
+        reason[failed] = reason[failed] + name + ', '
+    rejects['reason'] = reason.str[:-2]
+    return df[valid].astype({'quantity': 'int64'}), rejects
+
 # Load
-def load_data(df, db_path):
+TRANSACTION_COLUMNS = ['id', 'transaction_date', 'category', 'name', 'quantity', 'amount_excl_tax', 'amount_inc_tax']
+LOAD_MODES = ('append', 'upsert')
+# Pragmas of the load window. WAL and synchronous=NORMAL only sync at checkpoints instead of on every
+# commit, a 256 MiB page cache (negative values are KiB) keeps the index pages of a large load in memory
+# and temp_store keeps the sorts of the index builds out of temporary files.
+LOAD_PRAGMAS = {'journal_mode': 'WAL', 'synchronous': 'NORMAL', 'cache_size': -262144, 'temp_store': 'MEMORY'}
+# The page cache fills up to its size as the database grows, and in-memory temp storage holds the sort of
+# the daily_balances refresh of a whole day, so the loads whose memory must stay flat (streamed files,
+# the watch daemon) keep the default cache and temp_store of the connection
+STREAMING_PRAGMAS = {name: value for name, value in LOAD_PRAGMAS.items() if name not in ('cache_size', 'temp_store')}
+
+
+def _to_records(df, columns=TRANSACTION_COLUMNS):
+    """Convert a transformed DataFrame into tuples in the given column order, by default the one of the transactions table.
+
+    Rows are sorted by id so that the inserts and lookups walk the primary key index in order.
+    """
+    import pandas as pd
+
+    records = df[columns].sort_values('id')
+    transaction_dates = pd.to_datetime(records['transaction_date']).dt.strftime('%Y-%m-%d')
+    columns = [transaction_dates if column == 'transaction_date' else records[column] for column in columns]
+    return zip(*(column.tolist() for column in columns))
+
+
+def quarantine_rows(conn, rejects):
+    """Insert the rows rejected by `validate_dataframe` into the quarantine table, with their reason."""
+    columns = ['reason'] + TRANSACTION_COLUMNS
+    conn.executemany(f"INSERT INTO quarantine ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                     _to_records(rejects, columns))
+
+
+# Adds the rows of a table inserted after a rowid to the daily_balances summary. NOT INDEXED keeps SQLite
+# on the rowid range of the new rows instead of a full scan of an index sorted like the GROUP BY.
+ADD_DAILY_BALANCES = """
+    INSERT INTO daily_balances
+    SELECT transaction_date, name, category, COUNT(*), SUM(quantity), SUM(amount_excl_tax), SUM(amount_inc_tax)
+    FROM {table} NOT INDEXED
+    WHERE rowid > ?
+    GROUP BY transaction_date, name, category
+    ON CONFLICT (transaction_date, name, category) DO UPDATE SET
+        transaction_count = transaction_count + excluded.transaction_count,
+        quantity = quantity + excluded.quantity,
+        amount_excl_tax = amount_excl_tax + excluded.amount_excl_tax,
+        amount_inc_tax = amount_inc_tax + excluded.amount_inc_tax
+"""
+
+
+def insert_transactions(conn, table, records, mode='append'):
+    """Insert transaction records into a table and add them to the daily_balances summary.
+
+    SQLite gives the inserted rows rowids above the largest one of the table, so only the new rows are
+    aggregated and added to the summary, and the cost of a load is proportional to its inserted rows
+    rather than to the rows already loaded for the same days.
+
+    Args:
+        conn: Open connection to a migrated SQLite database, in the transaction of the write.
+        table: 'transactions' or a partition table.
+        records: Tuples in TRANSACTION_COLUMNS order.
+        mode: 'append' or 'upsert', see `load_data`.
+
+    Returns:
+        Number of inserted rows.
+    """
+    verb = "INSERT" if mode == 'append' else "INSERT OR IGNORE"
+    (last_rowid,) = conn.execute(f"SELECT COALESCE(MAX(rowid), 0) FROM {table}").fetchone()
+    changes_before = conn.total_changes
+    conn.executemany(f"{verb} INTO {table} ({', '.join(TRANSACTION_COLUMNS)}) "
+                     f"VALUES ({', '.join('?' * len(TRANSACTION_COLUMNS))})", records)
+    inserted = conn.total_changes - changes_before
+    if inserted:
+        conn.execute(ADD_DAILY_BALANCES.format(table=table), (last_rowid,))
+    return inserted
+
+
+def _write_transactions(conn, df, mode):
+    """Validate a transformed DataFrame and write it to the transactions table in one bulk executemany.
+
+    In a partitioned database the rows go to the partition of their month, see `partitions.route`,
+    and their ids are checked against every month with `partitions.claim_ids`. In 'append' mode a
+    transaction id that is already loaded is an error. In 'upsert' mode the rows are inserted with
+    INSERT OR IGNORE against the primary key, so ids that are already loaded are skipped. Rows that
+    fail validation are written to the quarantine table instead. The inserted rows are added to the
+    daily_balances summary, see `insert_transactions`.
+
+    Returns:
+        Dictionary with the number of 'inserted', 'duplicates' and 'rejected' rows.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode '{mode}', expected one of {LOAD_MODES}")
+    df, rejects = validate_dataframe(df)
+    if not rejects.empty:
+        quarantine_rows(conn, rejects)
+    inserted = 0
+    for table, rows in route(conn, df):
+        if table != 'transactions':
+            rows = rows[~rows['id'].isin(claim_ids(conn, table, rows['id'], mode))]
+        inserted += insert_transactions(conn, table, _to_records(rows), mode)
+    if inserted:
+        bump_generation(conn)
+    return {'inserted': inserted, 'duplicates': len(df) - inserted, 'rejected': len(rejects)}
+
+
+def refresh_daily_balances(conn, transaction_dates):
+    """Recompute the daily_balances summary rows of the given dates from the transactions table.
+
+    The loads add their rows to the summary as they insert them; this rebuilds the rows of whole days,
+    e.g. after the transactions were changed outside of the ETL.
+
+    Args:
+        conn: Open connection to the SQLite database.
+        transaction_dates: Dates in 'YYYY-MM-DD' format whose totals changed.
+    """
+    dates = [(transaction_date,) for transaction_date in sorted(set(transaction_dates))]
+    conn.executemany("DELETE FROM daily_balances WHERE transaction_date = ?", dates)
+    conn.executemany("""
+        INSERT INTO daily_balances
+        SELECT transaction_date, name, category, COUNT(*), SUM(quantity), SUM(amount_excl_tax), SUM(amount_inc_tax)
+        FROM transactions
+        WHERE transaction_date = ?
+        GROUP BY transaction_date, name, category
+    """, dates)
+    bump_generation(conn)
+
+
+def write_dataframe(conn, df, mode='append'):
+    """Write a transformed DataFrame and add its inserted rows to the summary through an open connection.
+
+    The caller owns the connection and the transaction, which lets a single writer load many
+    DataFrames, e.g. the files of a batch.
+
+    Args:
+        conn: Open connection to a migrated SQLite database.
+        df: Transformed DataFrame to load.
+        mode: 'append' or 'upsert', see `load_data`.
+
+    Returns:
+        Dictionary with the number of 'inserted', 'duplicates' and 'rejected' rows.
+    """
+    return _write_transactions(conn, df, mode)
+
+
+@contextmanager
+def load_window(conn, pragmas=None):
+    """Apply SQLite pragmas for the duration of a load and restore their previous values afterwards.
+
+    journal_mode is a property of the database file rather than of the connection: it is not
+    restored, so a database switched to WAL stays in WAL, which also lets readers query it while
+    later loads run.
+
+    Args:
+        conn: Open connection to the SQLite database, outside of any transaction.
+        pragmas: Dictionary of pragma names and values, defaults to LOAD_PRAGMAS.
+    """
+    pragmas = LOAD_PRAGMAS if pragmas is None else pragmas
+    previous = {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in pragmas if name != 'journal_mode'}
+    for name, value in pragmas.items():
+        conn.execute(f"PRAGMA {name} = {value}")
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+
+def bulk_write(conn, df, mode='append', rebuild_indexes=False, filename=None):
+    """Write a transformed DataFrame and add its inserted rows to the summary in one explicit transaction.
+
+    With `rebuild_indexes`, the secondary indexes of the written table or partitions are dropped before the
+    insert and rebuilt after it, inside the same transaction: one sorted index build is much cheaper
+    than maintaining three indexes row by row when the load is large compared to the table.
+
+    Args:
+        conn: Open connection to a migrated SQLite database, outside of any transaction.
+        df: Transformed DataFrame to load.
+        mode: 'append' or 'upsert', see `load_data`.
+        rebuild_indexes: Drop and rebuild the secondary indexes around the insert.
+        filename: Path of the loaded file, recorded in the ingested_files manifest in the same transaction.
+
+    Returns:
+        Dictionary with the number of 'inserted', 'duplicates' and 'rejected' rows.
+    """
+    conn.execute("BEGIN")
+    try:
+        indexes = {}
+        if rebuild_indexes:
+            for table, _ in route(conn, df):
+                indexes.update(index_statements(table))
+            for name in indexes:
+                conn.execute(f"DROP INDEX IF EXISTS {name}")
+        result = _write_transactions(conn, df, mode)
+        for statement in indexes.values():
+            conn.execute(statement)
+        if filename:
+            _record_file(conn, filename, len(df))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def _record_file(conn, filename, row_count):
+    """Record a loaded file in the ingested_files manifest, see `manifest.record_file`."""
+    # manifest imports extract_date_from_filename from this module, so it is imported on use
+    from manifest import record_file
+    record_file(conn, filename, row_count)
+
+
+def is_loaded(filename, db_path):
+    """Return True if the ingested_files manifest holds the file with its current content.
+
+    Args:
+        filename: Path of the file to load.
+        db_path: Path to the SQLite database, migrated if needed.
+
+    Returns:
+        False if the file is missing from the manifest or changed since it was loaded, see
+        `manifest.changed_files`.
+    """
+    from manifest import changed_files
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"The database file '{db_path}' does not exist.")
+    with sqlite3.connect(db_path) as conn:
+        apply_migrations(conn)
+        return not changed_files(conn, [filename])
+
+
+def _print_load_result(result, seconds=None):
+    print(f"{result['inserted']} lines were successfully loaded into the database.")
+    if result['rejected']:
+        print(f"{result['rejected']} invalid lines were written to the quarantine table.")
+    if seconds:
+        rows = sum(result.values())
+        print(f"Loaded {rows} rows in {seconds:.2f} seconds ({rows / seconds:.0f} rows/sec).")
+    if result['duplicates']:
+        print(f"{result['duplicates']} duplicate lines were skipped.")
+
+
+@instrumented('load', rows_in=lambda df, *args, **kwargs: len(df), rows_out=lambda result: result['inserted'])
+def load_data(df, db_path, mode='append', pragmas=None, rebuild_indexes=False, filename=None):
     """Load the transformed data into the SQLite database.
 
     Args:
         df: DataFrame containing the data to load.
         db_path: Path to the SQLite database.
+        mode: 'append' to append every row, or 'upsert' to skip transactions whose id is already loaded.
+            The schema migrations are applied before loading and the inserted rows are
+            added to the daily_balances summary in the same transaction.
+        pragmas: Pragmas of the load window, defaults to LOAD_PRAGMAS, see `load_window`.
+        rebuild_indexes: Drop and rebuild the secondary indexes around the insert, for large backfills.
+        filename: Path of the loaded file, recorded in the ingested_files manifest in the load
+            transaction, see `manifest.record_file`.
+
+    Returns:
+        Dictionary with the number of 'inserted', 'duplicates' and 'rejected' rows.
     """
 
     # Check if the database path exists
@@ -91,26 +441,299 @@ def load_data(df, db_path):
         raise FileNotFoundError(f"The database file '{db_path}' does not exist.")
     try:
         with sqlite3.connect(db_path) as conn:
-            df.to_sql('transactions', conn, if_exists='append', index=False)
-            print(f"{len(df)} lines were successfully loaded into the database.")
+            apply_migrations(conn)
+            with load_window(conn, pragmas):
+                start = time.perf_counter()
+                result = bulk_write(conn, df, mode, rebuild_indexes, filename)
+                _print_load_result(result, time.perf_counter() - start)
+    except sqlite3.DatabaseError as e:
+        raise Exception(f"Database error: {e}")
+    return result
+
+
+@instrumented('load_in_chunks', rows_out=lambda result: result['inserted'])
+def load_data_in_chunks(chunks, transaction_date, db_path, mode='append', pragmas=None, filename=None):
+    """Transform and load DataFrame chunks into the SQLite database, one batch per chunk.
+
+    Each chunk is committed on its own with its rows added to the daily_balances summary, so only one
+    chunk is held in memory at a time and the summary matches every committed chunk. Only the inserted
+    rows of a chunk are aggregated, see `insert_transactions`, so the cost of a chunk does not grow
+    with the chunks of the same day before it. A failing chunk is rolled back and the chunks before it
+    stay loaded.
+
+    Args:
+        chunks: Iterable of DataFrames, as returned by `extract_data_in_chunks`.
+        transaction_date: Date of the transactions in the file.
+        db_path: Path to the SQLite database.
+        mode: 'append' or 'upsert', see `load_data`.
+        pragmas: Pragmas of the load window, defaults to STREAMING_PRAGMAS, see `load_window`.
+        filename: Path of the loaded file, recorded in the ingested_files manifest once its last
+            chunk is committed, so a file that fails halfway is loaded again by the next run.
+
+    Returns:
+        Dictionary with the total number of 'inserted', 'duplicates' and 'rejected' rows.
+    """
+    pragmas = STREAMING_PRAGMAS if pragmas is None else pragmas
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"The database file '{db_path}' does not exist.")
+    result = {'inserted': 0, 'duplicates': 0, 'rejected': 0}
+    try:
+        with sqlite3.connect(db_path) as conn:
+            apply_migrations(conn)
+            with load_window(conn, pragmas):
+                start = time.perf_counter()
+                rows = 0
+                try:
+                    for chunk in chunks:
+                        chunk_result = write_dataframe(conn, transform_dataframe(chunk, transaction_date), mode)
+                        conn.commit()
+                        rows += len(chunk)
+                        for key in result:
+                            result[key] += chunk_result[key]
+                    if filename:
+                        _record_file(conn, filename, rows)
+                        conn.commit()
+                except Exception:
+                    # Rolled back before load_window restores pragmas that cannot change inside a transaction
+                    conn.rollback()
+                    raise
+                _print_load_result(result, time.perf_counter() - start)
     except sqlite3.DatabaseError as e:
         raise Exception(f"Database error: {e}")
+    return result
+
+# Stdlib engine
+def choose_engine(filename, chunksize=None, rebuild_indexes=False):
+    """Choose the engine loading a file.
+
+    Args:
+        filename: Path to the CSV file.
+        chunksize: Chunk size of a streaming load, only supported by the pandas engine.
+        rebuild_indexes: Index rebuild of a backfill, only supported by the pandas engine.
+
+    Returns:
+        'stdlib' for a file smaller than SMALL_FILE_BYTES, else 'pandas'.
+    """
+    if chunksize or rebuild_indexes or os.path.getsize(filename) >= SMALL_FILE_BYTES:
+        return 'pandas'
+    return 'stdlib'
+
+
+@instrumented('extract', rows_out=len)
+def extract_records(filename):
+    """Extract the rows of the CSV file as dictionaries, with the csv module instead of pandas.
+
+    Missing values are None and the numeric columns are floats, like `extract_data` reads them with CSV_DTYPES.
+
+    Args:
+        filename: Path to the CSV file.
+
+    Returns:
+        List of dictionaries keyed by the CSV columns.
+
+    Raises:
+        FileNotFoundError: If the specified CSV file does not exist.
+    """
+    try:
+        with open(filename, newline='') as file:
+            rows = list(csv.DictReader(file))
+        for row in rows:
+            for column, value in row.items():
+                if value in NA_VALUES:
+                    row[column] = None
+                elif column in NUMERIC_COLUMNS:
+                    row[column] = float(value)
+        return rows
+    except FileNotFoundError as e:
+        raise FileNotFoundError(f"File not found: {e}")
+    except Exception as e:
+        raise Exception(f"An error occurred while reading the file: {e}")
+
+
+@instrumented('transform', rows_in=lambda rows, *args, **kwargs: len(rows), rows_out=len)
+def transform_records(rows, transaction_date):
+    """Transform the rows like `transform_dataframe`: add a transaction_date and rename description to name.
+
+    Args:
+        rows: List of dictionaries, as returned by `extract_records`.
+        transaction_date: Date of the transaction.
+
+    Returns:
+        The same rows, with the transaction_date in 'YYYY-MM-DD' format.
+    """
+    transaction_date = transaction_date.strftime('%Y-%m-%d')
+    for row in rows:
+        row['transaction_date'] = transaction_date
+        row['name'] = row.pop('description')
+    return rows
+
+
+@instrumented('validate', rows_in=len, rows_out=lambda result: len(result[0]))
+def validate_records(rows):
+    """Split transformed rows into the rows that pass validation and the rejected rows.
+
+    The checks are the ones of `validate_dataframe`, run row by row.
+
+    Args:
+        rows: Transformed rows, as returned by `transform_records`.
+
+    Returns:
+        Tuple (valid rows with quantity converted to an integer, rejected rows with a 'reason' key
+        listing their failed checks).
+    """
+    uuid = re.compile(UUID_PATTERN, re.IGNORECASE)
+    valid, rejects = [], []
+    for row in rows:
+        quantity, amount_excl_tax, amount_inc_tax = row['quantity'], row['amount_excl_tax'], row['amount_inc_tax']
+        checks = {
+            'invalid id': row['id'] is not None and uuid.fullmatch(row['id']),
+            'invalid category': row['category'] in CATEGORIES,
+            'missing name': row['name'] is not None,
+            'invalid quantity': quantity is not None and quantity > 0 and quantity % 1 == 0,
+            'inconsistent tax': amount_excl_tax is not None and amount_inc_tax is not None
+                                and abs(amount_inc_tax - amount_excl_tax * (1 + TAX_RATE)) <= AMOUNT_TOLERANCE,
+        }
+        failed = [name for name, passed in checks.items() if not passed]
+        if failed:
+            rejects.append({**row, 'reason': ', '.join(failed)})
+        else:
+            valid.append({**row, 'quantity': int(quantity)})
+    return valid, rejects
+
+
+def _record_tuples(rows, columns=TRANSACTION_COLUMNS):
+    """Convert transformed rows into tuples in the given column order, sorted by id like `_to_records`."""
+    rows = sorted(rows, key=lambda row: (row['id'] is None, row['id'] or ''))
+    return [tuple(row[column] for column in columns) for row in rows]
+
+
+def write_records(conn, rows, mode='append', filename=None):
+    """Validate transformed rows, write them and add them to the summary in one explicit transaction.
+
+    This is `bulk_write` for the rows of the stdlib engine: rejected rows go to the quarantine table,
+    and in a partitioned database the rows go to the partition of their month.
+
+    Args:
+        conn: Open connection to a migrated SQLite database, outside of any transaction.
+        rows: Transformed rows, as returned by `transform_records`.
+        mode: 'append' or 'upsert', see `load_data`.
+        filename: Path of the loaded file, recorded in the ingested_files manifest in the same transaction.
+
+    Returns:
+        Dictionary with the number of 'inserted', 'duplicates' and 'rejected' rows.
+    """
+    if mode not in LOAD_MODES:
+        raise ValueError(f"Unknown load mode '{mode}', expected one of {LOAD_MODES}")
+    valid, rejects = validate_records(rows)
+    conn.execute("BEGIN")
+    try:
+        if rejects:
+            columns = ['reason'] + TRANSACTION_COLUMNS
+            conn.executemany(f"INSERT INTO quarantine ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                             _record_tuples(rejects, columns))
+        inserted = 0
+        for table, table_rows in route_records(conn, valid):
+            if table != 'transactions':
+                loaded = claim_ids(conn, table, [row['id'] for row in table_rows], mode)
+                table_rows = [row for row in table_rows if row['id'] not in loaded]
+            inserted += insert_transactions(conn, table, _record_tuples(table_rows), mode)
+        if inserted:
+            bump_generation(conn)
+        if filename:
+            _record_file(conn, filename, len(rows))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {'inserted': inserted, 'duplicates': len(valid) - inserted, 'rejected': len(rejects)}
+
+
+@instrumented('load', rows_in=lambda rows, *args, **kwargs: len(rows), rows_out=lambda result: result['inserted'])
+def load_records(rows, db_path, mode='append', pragmas=None, filename=None):
+    """Load transformed rows into the SQLite database, like `load_data` without pandas.
+
+    Args:
+        rows: Transformed rows, as returned by `transform_records`.
+        db_path: Path to the SQLite database.
+        mode: 'append' or 'upsert', see `load_data`.
+        pragmas: Pragmas of the load window, defaults to LOAD_PRAGMAS, see `load_window`.
+        filename: Path of the loaded file, recorded in the ingested_files manifest, see `load_data`.
+
+    Returns:
+        Dictionary with the number of 'inserted', 'duplicates' and 'rejected' rows.
+    """
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"The database file '{db_path}' does not exist.")
+    try:
+        with sqlite3.connect(db_path) as conn:
+            apply_migrations(conn)
+            with load_window(conn, pragmas):
+                start = time.perf_counter()
+                result = write_records(conn, rows, mode, filename)
+                _print_load_result(result, time.perf_counter() - start)
+    except sqlite3.DatabaseError as e:
+        raise Exception(f"Database error: {e}")
+    return result
 
 # Main function
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load a retail CSV file into the SQLite database.")
+    parser.add_argument('filename', nargs='?', default=FILENAME, help="CSV file to load")
+    parser.add_argument('--db', default=DB_PATH, help="Path to the SQLite database")
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help="Stream the file in chunks of this many rows instead of loading it at once")
+    parser.add_argument('--mode', choices=LOAD_MODES, default='append',
+                        help="'upsert' skips transactions whose id is already loaded")
+    parser.add_argument('--journal-mode', default=LOAD_PRAGMAS['journal_mode'], help="journal_mode of the load window")
+    parser.add_argument('--synchronous', default=LOAD_PRAGMAS['synchronous'], help="synchronous pragma of the load window")
+    parser.add_argument('--cache-size', type=int, default=None,
+                        help="cache_size pragma of the load window, negative values are KiB; "
+                             f"defaults to {LOAD_PRAGMAS['cache_size']}, and to the SQLite default with --chunksize")
+    parser.add_argument('--rebuild-indexes', action='store_true',
+                        help="Drop the secondary indexes before a large backfill and rebuild them after it")
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help=f"'stdlib' loads without pandas; 'auto' uses it below {SMALL_FILE_BYTES} bytes")
+    parser.add_argument('--force', action='store_true', help="Reload the file even if it is already in the manifest")
+    parser.add_argument('--metrics-log', help="JSON lines file receiving the metrics of every stage")
+    parser.add_argument('--profile', nargs='*', default=[], help="Stages to run under cProfile, e.g. load")
+    parser.add_argument('--trace-memory', nargs='*', default=[], help="Stages to run under tracemalloc")
+    args = parser.parse_args()
+    configure(log_path=args.metrics_log, profile=args.profile, trace_memory=args.trace_memory)
+    pragmas = {**(STREAMING_PRAGMAS if args.chunksize else LOAD_PRAGMAS),
+               'journal_mode': args.journal_mode, 'synchronous': args.synchronous}
+    if args.cache_size is not None:
+        pragmas['cache_size'] = args.cache_size
+
     try:
-        # Extract step
-        df = extract_data(FILENAME)
-        print(f"Extracted {len(df)} rows from {FILENAME}.")  # Print number of rows extracted
+        if not args.force and is_loaded(args.filename, args.db):
+            print(f"{args.filename} is unchanged since its last load, use --force to reload it.")
+            sys.exit(0)
 
         # Transform steps
-        date_str = extract_date_from_filename(FILENAME)
+        date_str = extract_date_from_filename(args.filename)
         print(f"Extracted date: {date_str}")  # Print the extracted date
-        transaction_date = transform_value_to_date(date_str)
-        df = transform_dataframe(df, transaction_date)
+        engine = args.engine
+        if engine == 'auto':
+            engine = choose_engine(args.filename, args.chunksize, args.rebuild_indexes)
+
+        if engine == 'stdlib':
+            # Small file: extract, transform and load with the csv and sqlite3 modules, without importing pandas
+            rows = extract_records(args.filename)
+            print(f"Extracted {len(rows)} rows from {args.filename}.")
+            rows = transform_records(rows, datetime.strptime(date_str, '%d_%m_%Y'))
+            load_records(rows, args.db, args.mode, pragmas, args.filename)
+        elif args.chunksize:
+            # Streaming mode: extract, transform and load one chunk at a time
+            chunks = extract_data_in_chunks(args.filename, args.chunksize)
+            load_data_in_chunks(chunks, transform_value_to_date(date_str), args.db, args.mode, pragmas, args.filename)
+        else:
+            # Extract step
+            df = extract_data(args.filename)
+            print(f"Extracted {len(df)} rows from {args.filename}.")  # Print number of rows extracted
+            df = transform_dataframe(df, transform_value_to_date(date_str))
 
-        # Load step
-        load_data(df, DB_PATH)
+            # Load step
+            load_data(df, args.db, args.mode, pragmas, args.rebuild_indexes, args.filename)
 
     except Exception as e:
         print(f"An error occurred: {e}")  # Catch and print any exceptions
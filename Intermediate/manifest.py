@@ -0,0 +1,72 @@
+import hashlib
+import os
+from datetime import datetime, timezone
+
+from etl import extract_date_from_filename
+
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def content_hash(path):
+    """Return the SHA-256 hex digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_date(path):
+    """Return the date of a retail file name in 'YYYY-MM-DD' format."""
+    day, month, year = extract_date_from_filename(os.path.basename(path)).split('_')
+    return f"{year}-{month}-{day}"
+
+
+def changed_files(conn, filenames):
+    """Return the files that are not in the manifest or whose content changed since they were loaded.
+
+    A file whose size and mtime match the manifest is skipped after a single stat() call.
+    When only the mtime changed (e.g. the file was copied again), the content hash decides,
+    and the manifest is updated so that the next run skips the file on stat() alone.
+
+    Args:
+        conn: Open connection to a migrated SQLite database.
+        filenames: Paths of the candidate files.
+
+    Returns:
+        List of the paths to (re)load, in the order of `filenames`.
+    """
+    manifest = {path: (size, mtime_ns, digest) for path, size, mtime_ns, digest
+                in conn.execute("SELECT path, size, mtime_ns, content_hash FROM ingested_files")}
+    to_load = []
+    for filename in filenames:
+        path = os.path.abspath(filename)
+        stat = os.stat(path)
+        recorded = manifest.get(path)
+        if recorded is None or recorded[0] != stat.st_size:
+            to_load.append(filename)
+        elif recorded[1] != stat.st_mtime_ns:
+            if content_hash(path) != recorded[2]:
+                to_load.append(filename)
+            else:
+                conn.execute("UPDATE ingested_files SET mtime_ns = ? WHERE path = ?", (stat.st_mtime_ns, path))
+    conn.commit()
+    return to_load
+
+
+def record_file(conn, filename, row_count, digest=None):
+    """Record a loaded file in the manifest; call it in the transaction that loads the file.
+
+    Args:
+        conn: Open connection to a migrated SQLite database.
+        filename: Path of the loaded file.
+        row_count: Number of rows read from the file.
+        digest: SHA-256 of the file if already known, computed otherwise.
+    """
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    conn.execute("""
+        INSERT OR REPLACE INTO ingested_files (path, size, mtime_ns, content_hash, file_date, row_count, loaded_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (path, stat.st_size, stat.st_mtime_ns, digest or content_hash(path), _file_date(path), row_count,
+          datetime.now(timezone.utc).isoformat(timespec='seconds')))
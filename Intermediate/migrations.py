@@ -0,0 +1,237 @@
+import argparse
+import sqlite3
+
+# Schema of the transactions table, also used by the monthly partitions of partitions.py
+TRANSACTIONS_TABLE = """
+    CREATE TABLE {table} (
+        id TEXT NOT NULL PRIMARY KEY,
+        transaction_date DATE NOT NULL CHECK (transaction_date IS date(transaction_date)),
+        category TEXT NOT NULL,
+        name TEXT NOT NULL,
+        quantity INTEGER NOT NULL,
+        amount_excl_tax NUMERIC(12, 2) NOT NULL,
+        amount_inc_tax NUMERIC(12, 2) NOT NULL
+    )
+"""
+
+# Rows rejected by the validation of etl.py, or by migration 1. The quarantined values failed
+# validation, so their columns are left untyped and unconstrained.
+QUARANTINE_TABLE = """
+    CREATE TABLE IF NOT EXISTS quarantine (
+        reason TEXT NOT NULL,
+        quarantined_at TEXT NOT NULL DEFAULT (datetime('now')),
+        id,
+        transaction_date,
+        category,
+        name,
+        quantity,
+        amount_excl_tax,
+        amount_inc_tax
+    )
+"""
+
+# Rows of the legacy table that the typed table can hold
+LEGACY_VALID_ROWS = """
+    id IS NOT NULL AND date(transaction_date) IS NOT NULL AND category IS NOT NULL AND name IS NOT NULL
+    AND quantity IS NOT NULL AND amount_excl_tax IS NOT NULL AND amount_inc_tax IS NOT NULL
+"""
+
+# Covering indexes for the access paths of data_exploration.py:
+#   - COUNT(*) filtered on transaction_date, and SUM of the balance grouped by transaction_date
+#   - SUM(amount_inc_tax) filtered on category
+#   - balance of one product (name) grouped by transaction_date
+INDEX_COLUMNS = {
+    'date': "transaction_date, category, amount_inc_tax",
+    'category': "category, amount_inc_tax",
+    'name': "name, transaction_date, category, amount_inc_tax",
+}
+
+
+def index_statements(table):
+    """Return the CREATE INDEX statement of every covering index of a transactions table, keyed by index name."""
+    return {f'idx_{table}_{suffix}': f"CREATE INDEX IF NOT EXISTS idx_{table}_{suffix} ON {table} ({columns})"
+            for suffix, columns in INDEX_COLUMNS.items()}
+
+
+INDEXES = index_statements('transactions')
+
+# Each migration is (version, description, statements). Versions are applied in order and the
+# version of the database is stored in PRAGMA user_version, so a migration runs at most once.
+MIGRATIONS = [
+    (1, "Typed transactions table with a primary key on id", [
+        # A new, empty database starts from the untyped table of the original retail.db
+        """
+        CREATE TABLE IF NOT EXISTS transactions (
+            id TEXT,
+            transaction_date TEXT,
+            category TEXT,
+            name TEXT,
+            quantity BIGINT,
+            amount_excl_tax FLOAT,
+            amount_inc_tax FLOAT
+        )
+        """,
+        TRANSACTIONS_TABLE.format(table='transactions_typed'),
+        # Rows with a missing value or a date that is not ISO would break the constraints of the typed table
+        QUARANTINE_TABLE,
+        f"""
+        INSERT INTO quarantine (reason, id, transaction_date, category, name, quantity, amount_excl_tax, amount_inc_tax)
+        SELECT
+            rtrim(CASE WHEN id IS NULL THEN 'missing id, ' ELSE '' END
+                  || CASE WHEN date(transaction_date) IS NULL THEN 'invalid date, ' ELSE '' END
+                  || CASE WHEN category IS NULL OR name IS NULL OR quantity IS NULL OR amount_excl_tax IS NULL
+                          OR amount_inc_tax IS NULL THEN 'missing value, ' ELSE '' END, ', '),
+            id, transaction_date, category, name, quantity, amount_excl_tax, amount_inc_tax
+        FROM transactions
+        WHERE NOT ({LEGACY_VALID_ROWS})
+        """,
+        # Rows appended twice before the primary key existed are only kept once
+        f"""
+        INSERT INTO transactions_typed
+        SELECT id, date(transaction_date), category, name, quantity, amount_excl_tax, amount_inc_tax
+        FROM transactions
+        WHERE {LEGACY_VALID_ROWS}
+        GROUP BY id
+        ORDER BY id
+        """,
+        "DROP TABLE transactions",
+        "ALTER TABLE transactions_typed RENAME TO transactions",
+    ]),
+    (2, "Covering indexes for the data exploration queries", list(INDEXES.values())),
+    (3, "Daily balances summary table maintained by the ETL", [
+        """
+        CREATE TABLE daily_balances (
+            transaction_date DATE NOT NULL,
+            name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            transaction_count INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            amount_excl_tax NUMERIC(12, 2) NOT NULL,
+            amount_inc_tax NUMERIC(12, 2) NOT NULL,
+            PRIMARY KEY (transaction_date, name, category)
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO daily_balances
+        SELECT transaction_date, name, category, COUNT(*), SUM(quantity), SUM(amount_excl_tax), SUM(amount_inc_tax)
+        FROM transactions
+        GROUP BY transaction_date, name, category
+        """,
+        """
+        CREATE INDEX idx_daily_balances_name
+        ON daily_balances (name, transaction_date, category, amount_inc_tax)
+        """,
+    ]),
+    (4, "Manifest of the ingested files", [
+        """
+        CREATE TABLE ingested_files (
+            path TEXT NOT NULL PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_date DATE NOT NULL,
+            row_count INTEGER NOT NULL,
+            loaded_at TEXT NOT NULL
+        )
+        """,
+    ]),
+    # Created by migration 1 when the legacy table had invalid rows
+    (5, "Quarantine of the rows rejected by the validation", [QUARANTINE_TABLE]),
+    (6, "Data generation counter bumped by every load", [
+        "CREATE TABLE data_generation (id INTEGER PRIMARY KEY CHECK (id = 1), generation INTEGER NOT NULL)",
+        "INSERT INTO data_generation VALUES (1, 0)",
+    ]),
+    (7, "Catalog of the monthly partitions of the transactions", [
+        "CREATE TABLE partitions (month TEXT NOT NULL PRIMARY KEY, table_name TEXT NOT NULL UNIQUE)",
+    ]),
+    # The primary key of a partition only spans its month, so the ids of every partition are also kept here,
+    # with the partition that holds them. A partition is identified by its month and the data generation
+    # at its creation, so the ids of a dropped partition are no longer loaded without deleting them.
+    (8, "Transaction ids of every monthly partition", [
+        "ALTER TABLE partitions ADD COLUMN created_generation INTEGER NOT NULL DEFAULT 0",
+        """
+        CREATE TABLE transaction_ids (
+            id TEXT NOT NULL PRIMARY KEY,
+            month TEXT NOT NULL,
+            generation INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+        """
+        INSERT INTO transaction_ids
+        SELECT id, substr(transaction_date, 1, 7), 0 FROM transactions
+        WHERE (SELECT type FROM sqlite_master WHERE name = 'transactions') = 'view'
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(conn):
+    """Return the migration version of the database.
+
+    Args:
+        conn: Open connection to the SQLite database.
+
+    Returns:
+        Version of the last applied migration, 0 for a database that was never migrated.
+    """
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def check_schema(conn):
+    """Raise an error unless every migration was applied, for the read paths that must not migrate.
+
+    The migrations write to the database, so they are only applied by the loaders and `python migrations.py`.
+
+    Args:
+        conn: Open connection to the SQLite database, possibly read-only.
+
+    Raises:
+        sqlite3.DatabaseError: If the schema version is older than LATEST_VERSION.
+    """
+    version = get_schema_version(conn)
+    if version < LATEST_VERSION:
+        raise sqlite3.DatabaseError(f"The schema of the database is at version {version}, expected {LATEST_VERSION}: "
+                                    "run `python migrations.py` or load a file first.")
+
+
+def apply_migrations(conn):
+    """Apply every migration newer than the version of the database.
+
+    Each migration runs in its own transaction together with the update of the version,
+    so a failing migration leaves the database at the previous version.
+
+    Args:
+        conn: Open connection to the SQLite database.
+
+    Returns:
+        List of the versions that were applied.
+    """
+    current_version = get_schema_version(conn)
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        conn.commit()
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except sqlite3.Error as e:
+            conn.rollback()
+            raise sqlite3.DatabaseError(f"Migration {version} ({description}) failed: {e}")
+        applied.append(version)
+    return applied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply the schema migrations to a retail database.")
+    parser.add_argument('--db', default='retail.db', help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.db) as conn:
+        applied = apply_migrations(conn)
+        print(f"Applied migrations: {applied or 'none'}; schema version is {get_schema_version(conn)}.")
@@ -0,0 +1,314 @@
+import argparse
+import sqlite3
+
+from migrations import TRANSACTIONS_TABLE, apply_migrations, index_statements
+from query_cache import bump_generation
+
+TRANSACTION_COLUMNS = "id, transaction_date, category, name, quantity, amount_excl_tax, amount_inc_tax"
+# A compound SELECT has at most 500 terms in SQLite (SQLITE_MAX_COMPOUND_SELECT), so the view
+# over the partitions is limited to about 41 years of months
+MAX_PARTITIONS = 500
+# Ids looked up per statement in transaction_ids, below the 999 host parameters of older SQLite versions
+ID_BATCH_SIZE = 500
+
+
+def partition_table(month):
+    """Return the name of the partition table of a month given as 'YYYY-MM', e.g. transactions_2022_01."""
+    year, month_number = month.split('-')
+    return f"transactions_{year}_{month_number}"
+
+
+def _month_bounds(month):
+    # ISO dates compare as strings, and no date of a month sorts after its day 31
+    return f"{month}-01", f"{month}-31"
+
+
+def is_partitioned(conn):
+    """Return whether the transactions are stored in monthly partitions behind a `transactions` view."""
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'transactions'").fetchone()
+    return row is not None and row[0] == 'view'
+
+
+def list_partitions(conn):
+    """Return the months that have a partition, in 'YYYY-MM' format and in order."""
+    return [month for (month,) in conn.execute("SELECT month FROM partitions ORDER BY month")]
+
+
+def partition_for_date(conn, date):
+    """Return the table holding the transactions of a date.
+
+    Args:
+        conn: Connection or cursor of a migrated database.
+        date: Date in 'YYYY-MM-DD' format.
+
+    Returns:
+        'transactions' for a flat database, the partition table of the month of `date`, or None when
+        that month has no partition.
+    """
+    if not is_partitioned(conn):
+        return 'transactions'
+    row = conn.execute("SELECT table_name FROM partitions WHERE month = ?", (date[:7],)).fetchone()
+    return row[0] if row else None
+
+
+def _rebuild_view(conn):
+    tables = [table for (table,) in conn.execute("SELECT table_name FROM partitions ORDER BY month")]
+    if len(tables) > MAX_PARTITIONS:
+        raise sqlite3.DatabaseError(f"The transactions view cannot span more than {MAX_PARTITIONS} partitions.")
+    selects = [f"SELECT {TRANSACTION_COLUMNS} FROM {table}" for table in tables]
+    if not selects:
+        columns = ", ".join(f"NULL AS {column}" for column in TRANSACTION_COLUMNS.split(", "))
+        selects = [f"SELECT {columns} WHERE 0"]
+    conn.execute("DROP VIEW IF EXISTS transactions")
+    conn.execute("CREATE VIEW transactions AS " + " UNION ALL ".join(selects))
+
+
+def _create_partition_table(conn, month, indexes=True):
+    table = partition_table(month)
+    conn.execute(TRANSACTIONS_TABLE.format(table=table))
+    if indexes:
+        for statement in index_statements(table).values():
+            conn.execute(statement)
+    # A month dropped and created again gets a newer generation, as drop_partition bumps it
+    conn.execute("""
+        INSERT INTO partitions (month, table_name, created_generation)
+        SELECT ?, ?, generation FROM data_generation
+    """, (month, table))
+    return table
+
+
+def _in_transaction(conn, func, *args):
+    """Run `func(conn, *args)` in the open transaction of the caller, or in its own transaction."""
+    if conn.in_transaction:
+        return func(conn, *args)
+    conn.execute("BEGIN")
+    try:
+        result = func(conn, *args)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return result
+
+
+def create_partition(conn, month):
+    """Create the partition of a month if it does not exist yet and add it to the transactions view.
+
+    Args:
+        conn: Open connection to a partitioned database.
+        month: Month in 'YYYY-MM' format.
+
+    Returns:
+        Name of the partition table.
+    """
+    def create(conn, month):
+        row = conn.execute("SELECT table_name FROM partitions WHERE month = ?", (month,)).fetchone()
+        if row:
+            return row[0]
+        table = _create_partition_table(conn, month)
+        _rebuild_view(conn)
+        return table
+
+    return _in_transaction(conn, create, month)
+
+
+def claim_ids(conn, table, ids, mode='append'):
+    """Record the ids of rows written to a partition in transaction_ids, which spans every month.
+
+    The primary key of a partition only covers its own month, so without this check a file loaded
+    again under the date of another month would duplicate its transactions. An id only counts as
+    loaded while the partition it was written to exists: the ids of a dropped partition are left
+    in transaction_ids, so that the drop stays O(1), and are claimed again when they are reloaded.
+
+    Args:
+        conn: Open connection to a partitioned database, in the transaction of the write.
+        table: Partition table the rows are written to.
+        ids: Transaction ids of the rows about to be written.
+        mode: 'append' or 'upsert', see `etl.load_data`.
+
+    Returns:
+        Set of the ids that are already loaded, whose rows must not be written.
+
+    Raises:
+        sqlite3.IntegrityError: In 'append' mode, if an id is already loaded.
+    """
+    month, generation = conn.execute(
+        "SELECT month, created_generation FROM partitions WHERE table_name = ?", (table,)).fetchone()
+    ids = list(ids)
+    loaded = set()
+    for start in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[start:start + ID_BATCH_SIZE]
+        loaded.update(id_ for (id_,) in conn.execute(f"""
+            SELECT transaction_ids.id FROM transaction_ids
+            JOIN partitions ON partitions.month = transaction_ids.month
+                AND partitions.created_generation = transaction_ids.generation
+            WHERE transaction_ids.id IN ({', '.join('?' * len(batch))})
+        """, batch))
+    if loaded and mode == 'append':
+        raise sqlite3.IntegrityError(f"UNIQUE constraint failed: transactions.id, {len(loaded)} ids are already loaded")
+    conn.executemany("""
+        INSERT INTO transaction_ids (id, month, generation) VALUES (?, ?, ?)
+        ON CONFLICT (id) DO UPDATE SET month = excluded.month, generation = excluded.generation
+    """, ((id_, month, generation) for id_ in ids if id_ not in loaded))
+    return loaded
+
+
+def prune_transaction_ids(conn):
+    """Delete the ids of dropped partitions from transaction_ids, e.g. in a maintenance window.
+
+    `drop_partition` leaves them in place to stay O(1); they only take space until they are pruned.
+
+    Args:
+        conn: Open connection to a partitioned database.
+
+    Returns:
+        Number of deleted ids.
+    """
+    def prune(conn):
+        return conn.execute("""
+            DELETE FROM transaction_ids WHERE NOT EXISTS (
+                SELECT 1 FROM partitions
+                WHERE partitions.month = transaction_ids.month
+                    AND partitions.created_generation = transaction_ids.generation)
+        """).rowcount
+
+    return _in_transaction(conn, prune)
+
+
+def route(conn, df):
+    """Split transformed rows by the table they are written to.
+
+    The rows of a retail file all carry the date of its name (see `etl.extract_date_from_filename`),
+    so a file goes to a single partition, which is created on its first load.
+
+    Args:
+        conn: Open connection to a migrated database.
+        df: Transformed DataFrame.
+
+    Returns:
+        List of (table name, rows) pairs: [('transactions', df)] for a flat database.
+    """
+    if not is_partitioned(conn):
+        return [('transactions', df)]
+    # Imported here so that the stdlib engine of etl.py never imports pandas
+    import pandas as pd
+
+    months = pd.to_datetime(df['transaction_date']).dt.strftime('%Y-%m')
+    distinct_months = months.unique()
+    if len(distinct_months) == 1:
+        return [(create_partition(conn, distinct_months[0]), df)]
+    return [(create_partition(conn, month), df[months == month]) for month in distinct_months]
+
+
+def route_records(conn, rows):
+    """Split transformed rows by the table they are written to, like `route` for the rows of `etl.load_records`.
+
+    Args:
+        conn: Open connection to a migrated database.
+        rows: List of dictionaries with a 'transaction_date' in 'YYYY-MM-DD' format.
+
+    Returns:
+        List of (table name, rows) pairs: [('transactions', rows)] for a flat database.
+    """
+    if not is_partitioned(conn):
+        return [('transactions', rows)]
+    months = {}
+    for row in rows:
+        months.setdefault(row['transaction_date'][:7], []).append(row)
+    return [(create_partition(conn, month), month_rows) for month, month_rows in months.items()]
+
+
+def enable_partitioning(conn):
+    """Move the flat transactions table into monthly partitions behind a `transactions` view.
+
+    The queries of data_exploration.py and the daily_balances refresh keep reading `transactions`,
+    and SQLite pushes their date filters into every partition of the view.
+
+    Args:
+        conn: Open connection to a migrated database.
+
+    Returns:
+        List of the months that were partitioned, empty when the database was already partitioned.
+    """
+    def enable(conn):
+        if is_partitioned(conn):
+            return []
+        months = [month for (month,) in conn.execute(
+            "SELECT DISTINCT substr(transaction_date, 1, 7) FROM transactions ORDER BY 1")]
+        for month in months:
+            # The indexes are built after the copy, which is faster than maintaining them row by row
+            table = _create_partition_table(conn, month, indexes=False)
+            conn.execute(f"""
+                INSERT INTO {table} SELECT {TRANSACTION_COLUMNS} FROM transactions
+                WHERE transaction_date BETWEEN ? AND ? ORDER BY id
+            """, _month_bounds(month))
+            for statement in index_statements(table).values():
+                conn.execute(statement)
+        conn.execute("""
+            INSERT INTO transaction_ids
+            SELECT transactions.id, partitions.month, partitions.created_generation
+            FROM transactions JOIN partitions ON partitions.month = substr(transactions.transaction_date, 1, 7)
+        """)
+        conn.execute("DROP TABLE transactions")
+        _rebuild_view(conn)
+        return months
+
+    apply_migrations(conn)
+    return _in_transaction(conn, enable)
+
+
+def drop_partition(conn, month):
+    """Drop the transactions of a month with a DROP TABLE of its partition instead of a DELETE of its rows.
+
+    The daily_balances rows and the ingested_files records of the month are deleted too, so the files of
+    the month are loaded again if they come back. The ids of the month are left in transaction_ids,
+    where they no longer count as loaded, see `prune_transaction_ids`.
+
+    Args:
+        conn: Open connection to a partitioned database.
+        month: Month in 'YYYY-MM' format.
+
+    Returns:
+        True if the month had a partition.
+    """
+    def drop(conn, month):
+        row = conn.execute("SELECT table_name FROM partitions WHERE month = ?", (month,)).fetchone()
+        if row is None:
+            return False
+        conn.execute("DELETE FROM partitions WHERE month = ?", (month,))
+        _rebuild_view(conn)
+        conn.execute(f"DROP TABLE {row[0]}")
+        first_day, last_day = _month_bounds(month)
+        conn.execute("DELETE FROM daily_balances WHERE transaction_date BETWEEN ? AND ?", (first_day, last_day))
+        conn.execute("DELETE FROM ingested_files WHERE file_date BETWEEN ? AND ?", (first_day, last_day))
+        bump_generation(conn)
+        return True
+
+    if not is_partitioned(conn):
+        raise ValueError("The database is not partitioned, see enable_partitioning.")
+    return _in_transaction(conn, drop, month)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the monthly partitions of the transactions.")
+    parser.add_argument('command', choices=('enable', 'list', 'drop', 'prune'))
+    parser.add_argument('month', nargs='?', help="Month to drop, in YYYY-MM format")
+    parser.add_argument('--db', default='retail.db', help="Path to the SQLite database")
+    args = parser.parse_args()
+
+    with sqlite3.connect(args.db) as conn:
+        apply_migrations(conn)
+        if args.command == 'enable':
+            months = enable_partitioning(conn)
+            print(f"Partitioned {len(months)} months." if months else "The database is already partitioned.")
+        elif args.command == 'list':
+            for month in list_partitions(conn):
+                print(f"{month}: {partition_table(month)}")
+        elif args.command == 'prune':
+            print(f"Pruned {prune_transaction_ids(conn)} ids of dropped partitions.")
+        elif not args.month:
+            parser.error("drop needs the month to drop")
+        elif drop_partition(conn, args.month):
+            print(f"Dropped the partition of {args.month}.")
+        else:
+            print(f"There is no partition for {args.month}.")
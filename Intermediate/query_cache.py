@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import OrderedDict
+
+MAX_ENTRIES = 256
+TTL_SECONDS = 300.0
+
+
+def get_generation(cursor):
+    """Return the data generation of the database, which every load increments."""
+    cursor.execute("SELECT generation FROM data_generation")
+    return cursor.fetchone()[0]
+
+
+def bump_generation(conn):
+    """Increment the data generation of the database, which invalidates the cached query results.
+
+    Loaders call it in the transaction of their write, so a reader never sees new data with the old generation.
+    """
+    conn.execute("UPDATE data_generation SET generation = generation + 1")
+
+
+class QueryCache:
+    """Memoize the results of the data_exploration queries until the next load.
+
+    Results are keyed on the query function and its arguments and tagged with the data generation of
+    the database when they were computed. A lookup reads the current generation, a single-row
+    primary key read, so a result computed before a load is never returned after it. Entries also
+    expire after `ttl` seconds, and the least recently used entry is evicted beyond `max_entries`.
+
+    The cache is thread-safe, so the worker threads of a `query_service.QueryService` can share one.
+    """
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def call(self, cursor, query, *args):
+        """Return the cached result of `query(cursor, *args)`, running the query on a miss.
+
+        Args:
+            cursor: Cursor of a migrated database.
+            query: data_exploration query function taking the cursor followed by `args`.
+            args: Hashable arguments of the query after the cursor.
+
+        Returns:
+            The result of the query. List and dictionary results are copied, so callers can modify them.
+        """
+        key = (query.__name__, args)
+        generation = get_generation(cursor)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == generation and now - entry[1] < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return _copy(entry[2])
+            self.misses += 1
+
+        result = query(cursor, *args)
+        with self._lock:
+            self._entries[key] = (generation, now, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return _copy(result)
+
+    def stats(self):
+        """Return the 'hits', 'misses', 'evictions', current 'entries' and 'hit_rate' of the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'hit_rate': self.hits / lookups if lookups else 0.0}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _copy(result):
+    """Copy a list result, or the column lists of a dictionary result such as `get_product_balances`."""
+    if isinstance(result, dict):
+        return {key: _copy(value) for key, value in result.items()}
+    return list(result) if isinstance(result, list) else result
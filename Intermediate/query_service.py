@@ -0,0 +1,167 @@
+import argparse
+import asyncio
+import pathlib
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import data_exploration
+from migrations import check_schema
+
+POOL_SIZE = 4
+
+
+def connect_read_only(db_path):
+    """Open a read-only connection to the SQLite database that the worker threads of a pool can share.
+
+    Args:
+        db_path: Path to the SQLite database.
+
+    Returns:
+        Connection opened with mode=ro, so any write through it fails.
+    """
+    uri = pathlib.Path(db_path).resolve().as_uri() + '?mode=ro'
+    try:
+        return sqlite3.connect(uri, uri=True, check_same_thread=False)
+    except sqlite3.Error as e:
+        raise Exception(f"Database connection error: {e}")
+
+
+class ConnectionPool:
+    """Fixed set of read-only connections handed out to one query at a time.
+
+    The pooled connections can only read, so a dashboard query can never modify retail.db nor take its
+    write lock. The schema must already be migrated by the loaders, which is checked when the pool is created.
+    """
+
+    def __init__(self, db_path, size=POOL_SIZE):
+        self._connections = [connect_read_only(db_path) for _ in range(size)]
+        try:
+            check_schema(self._connections[0])
+        except sqlite3.DatabaseError:
+            self.close()
+            raise
+        self._idle = asyncio.Queue()
+        for conn in self._connections:
+            self._idle.put_nowait(conn)
+
+    @property
+    def size(self):
+        return len(self._connections)
+
+    async def acquire(self):
+        """Wait until a connection is idle and take it."""
+        return await self._idle.get()
+
+    def release(self, conn):
+        """Give a connection back to the pool."""
+        self._idle.put_nowait(conn)
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+
+
+def _run_query(conn, query, args, cache):
+    cursor = conn.cursor()
+    try:
+        if cache is not None:
+            return cache.call(cursor, query, *args)
+        return query(cursor, *args)
+    finally:
+        cursor.close()
+
+
+class QueryService:
+    """Serve the data_exploration queries to concurrent asyncio callers.
+
+    Every query runs on a pooled connection in a worker thread. SQLite releases the GIL while it
+    executes a statement, so queries on different connections overlap instead of waiting behind one
+    connection, and no caller pays for opening a connection. Callers beyond the pool size wait for
+    an idle connection. With a `query_cache.QueryCache`, results are reused until the next load.
+
+    Use it as an async context manager:
+
+        async with QueryService('retail.db') as service:
+            total = await service.get_total_sell_transactions()
+    """
+
+    def __init__(self, db_path, pool_size=POOL_SIZE, cache=None):
+        self.pool = ConnectionPool(db_path, pool_size)
+        self.cache = cache
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix='query')
+
+    async def run(self, query, *args):
+        """Run a data_exploration query function on a pooled connection.
+
+        The connection goes back to the pool when the query has finished in its thread, even when
+        the caller is cancelled before, so a connection is never used by two queries at once.
+
+        Args:
+            query: Function taking a cursor followed by `args`, e.g. `data_exploration.get_balance_by_date`.
+            args: Arguments of the query after the cursor.
+
+        Returns:
+            The result of the query function.
+        """
+        loop = asyncio.get_running_loop()
+        conn = await self.pool.acquire()
+        try:
+            future = self._executor.submit(_run_query, conn, query, args, self.cache)
+        except Exception:
+            self.pool.release(conn)
+            raise
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.pool.release, conn))
+        return await asyncio.wrap_future(future)
+
+    async def get_number_of_transactions(self, date):
+        return await self.run(data_exploration.get_number_of_transactions, date)
+
+    async def get_total_sell_transactions(self):
+        return await self.run(data_exploration.get_total_sell_transactions)
+
+    async def get_balance_by_date(self, product_name):
+        return await self.run(data_exploration.get_balance_by_date, product_name)
+
+    async def get_cumulative_balance(self):
+        return await self.run(data_exploration.get_cumulative_balance)
+
+    async def get_product_balances(self, product_names=None, start_date=None, end_date=None):
+        # A tuple, so that the arguments can key the result cache
+        product_names = None if product_names is None else tuple(product_names)
+        return await self.run(data_exploration.get_product_balances, product_names, start_date, end_date)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+async def main(db_path, pool_size, date='2022-01-14', product_name='Amazon Echo Dot'):
+    """Run the four exploration queries concurrently and print their results."""
+    async with QueryService(db_path, pool_size) as service:
+        number_of_transactions, total_amount, balances, cumulative_balances = await asyncio.gather(
+            service.get_number_of_transactions(date),
+            service.get_total_sell_transactions(),
+            service.get_balance_by_date(product_name),
+            service.get_cumulative_balance(),
+        )
+    print(f"Number of transactions on {date}: {number_of_transactions}")
+    print(f"Total Amount of Sell Transactions (including tax): {total_amount:.2f}")
+    print(f"{len(balances)} daily balances of {product_name}, {len(cumulative_balances)} cumulated balances.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the exploration queries through the pooled query service.")
+    parser.add_argument('--db', default='retail.db', help="Path to the SQLite database")
+    parser.add_argument('--pool-size', type=int, default=POOL_SIZE, help="Number of read-only connections")
+    args = parser.parse_args()
+    try:
+        asyncio.run(main(args.db, args.pool_size))
+    except sqlite3.DatabaseError as e:
+        sys.exit(str(e))
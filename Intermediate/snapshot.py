@@ -0,0 +1,173 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+from data_exploration import connect_to_database
+from query_cache import get_generation
+
+MANIFEST = 'snapshot.json'
+BATCH_SIZE = 500_000
+# Dtypes of the exported columns. name and category hold codes into the dictionaries of the manifest.
+COLUMN_DTYPES = {
+    'transaction_date': 'datetime64[D]',
+    'category': 'int8',
+    'name': 'int16',
+    'quantity': 'int32',
+    'amount_excl_tax': 'float64',
+    'amount_inc_tax': 'float64',
+}
+
+
+def export_snapshot(conn, directory, batch_size=BATCH_SIZE):
+    """Write the transactions table to one .npy file per column, sorted by transaction_date.
+
+    name and category are dictionary-encoded: their .npy files hold integer codes into the
+    dictionaries saved in snapshot.json. The rows are streamed in batches into memory-mapped files, so
+    the export never holds the whole table in memory. The transaction ids are not exported.
+
+    Args:
+        conn: Open connection to a migrated database, outside of any transaction.
+        directory: Directory of the snapshot, created if needed; an existing snapshot is overwritten.
+        batch_size: Number of rows read from SQLite at a time.
+
+    Returns:
+        The manifest of the snapshot.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest_path = os.path.join(directory, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+
+    # One read transaction, so a load committed during the export can neither change the rows between
+    # the reads nor be missing from rows exported under the generation read first
+    conn.execute("BEGIN")
+    try:
+        generation = get_generation(conn.cursor())
+        rows = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        dictionaries = {column: [value for (value,) in conn.execute(
+                            f"SELECT DISTINCT {column} FROM transactions ORDER BY {column}")]
+                        for column in ('category', 'name')}
+        for column, values in dictionaries.items():
+            if len(values) > np.iinfo(COLUMN_DTYPES[column]).max:
+                raise ValueError(f"Too many distinct values of {column} for its {COLUMN_DTYPES[column]} codes.")
+        arrays = {column: np.lib.format.open_memmap(os.path.join(directory, f'{column}.npy'), mode='w+',
+                                                    dtype=dtype, shape=(rows,))
+                  for column, dtype in COLUMN_DTYPES.items()}
+
+        cursor = conn.execute(f"SELECT {', '.join(COLUMN_DTYPES)} FROM transactions ORDER BY transaction_date")
+        start = 0
+        while batch := cursor.fetchmany(batch_size):
+            end = start + len(batch)
+            for column, values in zip(COLUMN_DTYPES, zip(*batch)):
+                if column in dictionaries:
+                    values = pd.Categorical(values, categories=dictionaries[column]).codes
+                arrays[column][start:end] = values
+            start = end
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    for array in arrays.values():
+        array.flush()
+
+    manifest = {
+        'rows': rows,
+        'columns': COLUMN_DTYPES,
+        'dictionaries': dictionaries,
+        'generation': generation,
+        'created': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+    }
+    # The manifest is written last, so a directory without it is an incomplete export
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class Snapshot:
+    """Read-only view of an exported snapshot, answering the exploration queries with NumPy.
+
+    The columns are opened with mmap_mode='r': opening a snapshot reads no data, and the pages of a
+    column are only read by the operating system when a query touches them. Queries are vectorized
+    over the columns and return the same values as the SQL queries of data_exploration.py.
+    """
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.columns = {column: np.load(os.path.join(directory, f'{column}.npy'), mmap_mode='r')
+                        for column in self.manifest['columns']}
+        self.dictionaries = self.manifest['dictionaries']
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def is_current(self, cursor):
+        """Return whether no load happened in the database since the snapshot was exported."""
+        return get_generation(cursor) == self.manifest['generation']
+
+    def _code(self, column, value):
+        try:
+            return self.dictionaries[column].index(value)
+        except ValueError:
+            return None
+
+    def _daily_sums(self, rows=slice(None)):
+        """Return the dates that have rows and the balance (SELL - BUY amount_inc_tax) of each date.
+
+        Args:
+            rows: Index array or slice of the rows to aggregate, all rows by default.
+        """
+        dates = self.columns['transaction_date'][rows]
+        if len(dates) == 0:
+            return dates, np.zeros(0)
+        signs = np.zeros(len(self.dictionaries['category']), dtype='float64')
+        for value, sign in (('SELL', 1.0), ('BUY', -1.0)):
+            code = self._code('category', value)
+            if code is not None:
+                signs[code] = sign
+        amounts = signs[self.columns['category'][rows]] * self.columns['amount_inc_tax'][rows]
+        # Dates are sorted by the export, so the day offsets start at the first one
+        offsets = (dates - dates[0]).astype('int64')
+        sums = np.bincount(offsets, weights=amounts)
+        present = np.bincount(offsets) > 0
+        return dates[0] + np.flatnonzero(present), sums[present]
+
+    def number_of_transactions(self, date):
+        """Return the number of transactions on a date given in 'YYYY-MM-DD' format."""
+        dates = self.columns['transaction_date']
+        day = np.datetime64(date, 'D')
+        return int(np.searchsorted(dates, day, side='right') - np.searchsorted(dates, day, side='left'))
+
+    def balance_by_date(self, product_name):
+        """Return the (date, balance) pairs of a product, like data_exploration.get_balance_by_date."""
+        code = self._code('name', product_name)
+        if code is None:
+            return []
+        days, sums = self._daily_sums(np.flatnonzero(self.columns['name'] == code))
+        return list(zip(days.astype(str).tolist(), sums.tolist()))
+
+    def cumulative_balance(self):
+        """Return the (date, cumulated balance) pairs, like data_exploration.get_cumulative_balance."""
+        days, sums = self._daily_sums()
+        return list(zip(days.astype(str).tolist(), np.cumsum(sums).tolist()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the transactions to a memory-mappable columnar snapshot.")
+    parser.add_argument('directory', help="Directory of the snapshot")
+    parser.add_argument('--db', default='retail.db', help="Path to the SQLite database")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="Rows read from SQLite at a time")
+    args = parser.parse_args()
+
+    try:
+        conn = connect_to_database(args.db)
+    except Exception as e:
+        sys.exit(str(e))
+    with conn:
+        manifest = export_snapshot(conn, args.directory, args.batch_size)
+    print(f"Exported {manifest['rows']} transactions to {args.directory}.")
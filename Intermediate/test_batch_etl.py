@@ -0,0 +1,46 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+import pandas as pd
+from batch_etl import *
+
+
+class BatchEtlTest(unittest.TestCase):
+
+    def setUp(self):
+        """Build a drop directory with two daily files and a copy of retail.db."""
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.db_path = shutil.copy('retail.db', self.workdir)
+        self.drop_dir = os.path.join(self.workdir, 'drop')
+        os.mkdir(self.drop_dir)
+
+        shutil.copy('retail_15_01_2022.csv', self.drop_dir)
+        next_day = pd.read_csv('retail_15_01_2022.csv')
+        next_day['id'] = [str(uuid.uuid4()) for _ in range(len(next_day))]
+        next_day.to_csv(os.path.join(self.drop_dir, 'retail_16_01_2022.csv'), index=False)
+        open(os.path.join(self.drop_dir, 'notes.csv'), 'w').close()
+
+    def test_find_retail_files(self):
+        """Test that only the dated retail files are found, in date order."""
+        files = [os.path.basename(path) for path in find_retail_files(self.drop_dir)]
+        self.assertEqual(files, ['retail_15_01_2022.csv', 'retail_16_01_2022.csv'])
+
+    def test_load_files(self):
+        """Test that every file is loaded and reported."""
+        report = load_files(find_retail_files(self.drop_dir), self.db_path, mode='upsert', workers=2)
+
+        by_file = {os.path.basename(entry['file']): entry for entry in report}
+        self.assertEqual(by_file['retail_15_01_2022.csv']['inserted'], 4)
+        self.assertEqual(by_file['retail_16_01_2022.csv']['inserted'], 54)
+        self.assertTrue(all(entry['error'] is None for entry in report))
+        with sqlite3.connect(self.db_path) as conn:
+            count = conn.execute("SELECT COUNT(*) FROM transactions WHERE transaction_date = '2022-01-16'").fetchone()[0]
+        self.assertEqual(count, 54)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+import itertools
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from data_exploration import *
+from migrations import apply_migrations, get_schema_version
+
+
+class ProductBalancesTest(unittest.TestCase):
+
+    def setUp(self):
+        """Query a migrated copy of retail.db."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.conn = sqlite3.connect(shutil.copy('retail.db', workdir))
+        self.addCleanup(self.conn.close)
+        apply_migrations(self.conn)
+        self.cursor = self.conn.cursor()
+        self.products = [name for (name,) in self.cursor.execute("SELECT DISTINCT name FROM daily_balances ORDER BY name")]
+
+    def test_matches_balance_by_date_of_every_product(self):
+        """Test that one batched call returns the balances of get_balance_by_date and their running totals."""
+        balances = get_product_balances(self.cursor)
+        self.assertEqual(list(balances), ['name', 'transaction_date', 'balance', 'cumulated_balance'])
+        self.assertEqual(sorted(set(balances['name'])), self.products)
+        rows = list(zip(*balances.values()))
+        for product_name in self.products:
+            expected = get_balance_by_date(self.cursor, product_name)
+            product_rows = [row for row in rows if row[0] == product_name]
+            self.assertEqual([(date, balance) for _, date, balance, _ in product_rows], expected)
+            for (_, _, _, cumulated), total in zip(product_rows, itertools.accumulate(b for _, b in expected)):
+                self.assertAlmostEqual(cumulated, total, places=6)
+
+    def test_products_and_date_bounds(self):
+        """Test that the bounds select a slice of the rows without changing its running totals."""
+        selected = self.products[:2]
+        full = get_product_balances(self.cursor, selected)
+        window = get_product_balances(self.cursor, selected, start_date='2022-01-10', end_date='2022-01-12')
+        expected = [row for row in zip(*full.values()) if '2022-01-10' <= row[1] <= '2022-01-12']
+        actual = list(zip(*window.values()))
+        self.assertEqual([row[:3] for row in actual], [row[:3] for row in expected])
+        # The running totals start from the sum of the earlier days, added in another order
+        for row, expected_row in zip(actual, expected):
+            self.assertAlmostEqual(row[3], expected_row[3], places=6)
+        self.assertEqual(sorted(set(window['name'])), selected)
+        self.assertEqual(set(window['transaction_date']), {'2022-01-10', '2022-01-11', '2022-01-12'})
+
+    def test_no_rows(self):
+        """Test that a selection without rows returns empty columns."""
+        empty = {'name': [], 'transaction_date': [], 'balance': [], 'cumulated_balance': []}
+        self.assertEqual(get_product_balances(self.cursor, []), empty)
+        self.assertEqual(get_product_balances(self.cursor, start_date='2030-01-01'), empty)
+
+
+class ConnectToDatabaseTest(unittest.TestCase):
+
+    def test_unmigrated_database_is_rejected(self):
+        """Test that connecting to a database whose schema is out of date raises instead of migrating it."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        db_path = shutil.copy('retail.db', workdir)
+        with self.assertRaisesRegex(Exception, "schema of the database is at version 0"):
+            connect_to_database(db_path)
+        conn = sqlite3.connect(db_path)
+        self.addCleanup(conn.close)
+        self.assertEqual(get_schema_version(conn), 0)
+        apply_migrations(conn)
+        connect_to_database(db_path).close()
+
+
+    def test_script_prints_migration_hint(self):
+        """Test that the script run next to an unmigrated retail.db exits with the migration hint, without a traceback."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        shutil.copy('retail.db', workdir)
+        script = os.path.abspath('data_exploration.py')
+        process = subprocess.run([sys.executable, script], cwd=workdir, capture_output=True, text=True)
+        self.assertEqual(process.returncode, 1)
+        self.assertIn("run `python migrations.py`", process.stderr)
+        self.assertNotIn("Traceback", process.stderr)
+
+        subprocess.run([sys.executable, os.path.abspath('migrations.py')], cwd=workdir, capture_output=True, check=True)
+        output = subprocess.run([sys.executable, script], cwd=workdir, capture_output=True, text=True, check=True).stdout
+        self.assertIn("Number of transactions on 2022-01-14: 47", output)
+
+
+if __name__ == '__main__':
+    unittest.main()
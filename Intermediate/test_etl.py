@@ -2,7 +2,13 @@ import unittest
 import pandas as pd
 from datetime import datetime
 from etl import *
+from migrations import INDEXES
 import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
 
 
 class TransactionTest(unittest.TestCase):
@@ -18,6 +24,12 @@ class TransactionTest(unittest.TestCase):
         cls.df = pd.read_csv(cls.csv_file)
         cls.transaction_date = datetime(2022, 1, 15)
 
+    def setUp(self):
+        """Copy retail.db into a temporary directory, so that every test loads into its own database."""
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.db_path = shutil.copy('retail.db', self.workdir)
+
     def test_number_of_transactions_on_15_01_2022(self):
         """Test that the number of transactions matches the expected value."""
         # Suppose we know the expected number of transactions for this date.
@@ -37,6 +49,183 @@ class TransactionTest(unittest.TestCase):
         self.assertIn('name', transformed_df.columns, "The 'description' column was not renamed to 'name'.")
         self.assertNotIn('description', transformed_df.columns, "The 'description' column still exists after renaming.")
 
+    def test_extract_data_in_chunks(self):
+        """Test that the CSV file is read in chunks of bounded size."""
+        chunks = list(extract_data_in_chunks(self.csv_file, chunksize=20))
+        self.assertEqual([len(chunk) for chunk in chunks], [20, 20, 14])
+
+    def test_load_data_in_chunks(self):
+        """Test that every chunk is transformed and appended to the transactions table."""
+
+        chunks = extract_data_in_chunks(self.csv_file, chunksize=20)
+        # 50 of the 54 transactions of the file are already in retail.db
+        result = load_data_in_chunks(chunks, self.transaction_date, self.db_path, mode='upsert')
+
+        self.assertEqual(result, {'inserted': 4, 'duplicates': 50, 'rejected': 0})
+        with sqlite3.connect(self.db_path) as conn:
+            total = conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0]
+        self.assertEqual(total, 731 + 4)
+
+    def test_load_data_in_chunks_failure_keeps_summary_of_committed_chunks(self):
+        """Test that a failing chunk reports its error and the committed chunks are in daily_balances."""
+        new_chunk, loaded_chunk = list(extract_data_in_chunks(self.csv_file, chunksize=20))[:2]
+        new_chunk['id'] = [f"00000000-0000-4000-8000-{n:012d}" for n in range(len(new_chunk))]
+
+        with self.assertRaisesRegex(Exception, "UNIQUE constraint failed"):
+            load_data_in_chunks([new_chunk, loaded_chunk], datetime(2022, 1, 20), self.db_path, mode='append')
+        with sqlite3.connect(self.db_path) as conn:
+            loaded = conn.execute("""SELECT COUNT(*), ROUND(SUM(amount_inc_tax), 2) FROM transactions
+                                     WHERE transaction_date = '2022-01-20'""").fetchone()
+            summary = conn.execute("""SELECT SUM(transaction_count), ROUND(SUM(amount_inc_tax), 2) FROM daily_balances
+                                      WHERE transaction_date = '2022-01-20'""").fetchone()
+        self.assertEqual(loaded[0], 20)
+        self.assertEqual(summary, loaded)
+
+    def test_load_data_append_rejects_loaded_ids(self):
+        """Test that appending transactions whose id is already loaded fails instead of duplicating them."""
+        df = transform_dataframe(self.df.copy(), self.transaction_date)
+
+        with self.assertRaises(Exception):
+            load_data(df, self.db_path, mode='append')
+
+    def test_load_data_upsert_skips_duplicates(self):
+        """Test that the upsert mode only inserts transactions whose id is not loaded yet."""
+        df = transform_dataframe(self.df.copy(), self.transaction_date)
+
+        # 50 of the 54 transactions of the file are already in retail.db
+        first_load = load_data(df, self.db_path, mode='upsert')
+        self.assertEqual(first_load, {'inserted': 4, 'duplicates': 50, 'rejected': 0})
+
+        reload = load_data(df, self.db_path, mode='upsert')
+        self.assertEqual(reload, {'inserted': 0, 'duplicates': 54, 'rejected': 0})
+
+        with sqlite3.connect(self.db_path) as conn:
+            total, distinct_ids = conn.execute("SELECT COUNT(*), COUNT(DISTINCT id) FROM transactions").fetchone()
+            summary_count = conn.execute(
+                "SELECT SUM(transaction_count) FROM daily_balances WHERE transaction_date = '2022-01-15'").fetchone()[0]
+        self.assertEqual(total, 735)
+        self.assertEqual(distinct_ids, 735)
+        self.assertEqual(summary_count, 54, "The daily_balances summary was not refreshed for the loaded date.")
+
+    def test_intraday_loads_add_to_daily_balances(self):
+        """Test that several loads of the same day, with overlapping ids and both engines, keep the summary exact."""
+        df = transform_dataframe(self.df.copy(), datetime(2022, 1, 20))
+        df['id'] = [f"00000000-0000-4000-8000-{n:012d}" for n in range(len(df))]
+
+        self.assertEqual(load_data(df[:30], self.db_path, mode='upsert')['inserted'], 30)
+        self.assertEqual(load_data(df[20:40], self.db_path, mode='upsert')['inserted'], 10)
+        rows = [{**row, 'transaction_date': '2022-01-20'} for row in df[30:].to_dict('records')]
+        self.assertEqual(load_records(rows, self.db_path, mode='upsert')['inserted'], 14)
+        with sqlite3.connect(self.db_path) as conn:
+            expected = conn.execute("""
+                SELECT name, category, COUNT(*), SUM(quantity), ROUND(SUM(amount_excl_tax), 2), ROUND(SUM(amount_inc_tax), 2)
+                FROM transactions WHERE transaction_date = '2022-01-20' GROUP BY name, category ORDER BY name, category
+            """).fetchall()
+            summary = conn.execute("""
+                SELECT name, category, transaction_count, quantity, ROUND(amount_excl_tax, 2), ROUND(amount_inc_tax, 2)
+                FROM daily_balances WHERE transaction_date = '2022-01-20' ORDER BY name, category
+            """).fetchall()
+        self.assertEqual(sum(row[2] for row in expected), 54)
+        self.assertEqual(summary, expected)
+
+    def test_load_data_rebuilds_indexes(self):
+        """Test that a load with rebuilt indexes leaves every index in place and the pragmas restored."""
+        df = transform_dataframe(self.df.copy(), self.transaction_date)
+
+        result = load_data(df, self.db_path, mode='upsert', rebuild_indexes=True)
+        self.assertEqual(result, {'inserted': 4, 'duplicates': 50, 'rejected': 0})
+        with sqlite3.connect(self.db_path) as conn:
+            indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+            self.assertEqual(conn.execute("PRAGMA integrity_check").fetchone()[0], 'ok')
+            self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        self.assertTrue(set(INDEXES) <= indexes)
+
+    def test_load_window_restores_pragmas(self):
+        """Test that the load window pragmas only apply inside the window, and after a failed write."""
+        with sqlite3.connect(self.db_path) as conn:
+            synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+            cache_size = conn.execute("PRAGMA cache_size").fetchone()[0]
+            # The raw DataFrame has no transaction_date column, so the write fails and is rolled back
+            with self.assertRaises(KeyError):
+                with load_window(conn, {'synchronous': 'OFF', 'cache_size': -1024}):
+                    self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], 0)
+                    self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], -1024)
+                    bulk_write(conn, self.df, 'upsert')
+            self.assertFalse(conn.in_transaction)
+            self.assertEqual(conn.execute("PRAGMA synchronous").fetchone()[0], synchronous)
+            self.assertEqual(conn.execute("PRAGMA cache_size").fetchone()[0], cache_size)
+
+
+    def test_validate_dataframe_rejects_invalid_rows(self):
+        """Test that every validation check rejects its rows, with the reasons of the failed checks."""
+        df = transform_dataframe(self.df.head(6).copy(), self.transaction_date)
+        df.loc[1, 'id'] = 'not-a-uuid'
+        df.loc[2, 'category'] = 'REFUND'
+        df.loc[3, 'quantity'] = 0
+        df.loc[4, 'amount_inc_tax'] = df.loc[4, 'amount_excl_tax']
+        df.loc[5, ['category', 'quantity']] = ['GIFT', -1]
+
+        valid, rejects = validate_dataframe(df)
+        self.assertEqual(len(valid), 1)
+        self.assertEqual(valid['quantity'].dtype, 'int64')
+        self.assertEqual(rejects['reason'].tolist(), ['invalid id', 'invalid category', 'invalid quantity',
+                                                      'inconsistent tax', 'invalid category, invalid quantity'])
+
+    def test_load_data_quarantines_invalid_rows(self):
+        """Test that invalid rows of a file are written to the quarantine table instead of transactions."""
+        csv_file = os.path.join(self.workdir, 'retail_16_01_2022.csv')
+        with open(self.csv_file) as source, open(csv_file, 'w') as target:
+            target.write(source.read())
+            target.write("b1b7cd0e-3a8e-4c43-9a3e-0f2d1e4c5a6b,SELL,Instant Pot Duo,2.5,224.88,269.86\n")
+        df = transform_dataframe(extract_data(csv_file), self.transaction_date)
+
+        result = load_data(df, self.db_path, mode='upsert')
+        self.assertEqual(result, {'inserted': 4, 'duplicates': 50, 'rejected': 1})
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT reason, id, transaction_date, quantity FROM quarantine").fetchall()
+        self.assertEqual(row, [('invalid quantity', 'b1b7cd0e-3a8e-4c43-9a3e-0f2d1e4c5a6b', '2022-01-15', 2.5)])
+
+    def test_stdlib_engine_matches_pandas_engine(self):
+        """Test that the stdlib engine loads, quarantines and summarizes a file like the pandas engine."""
+        csv_file = os.path.join(self.workdir, 'retail_16_01_2022.csv')
+        with open(self.csv_file) as source, open(csv_file, 'w') as target:
+            target.write(source.read())
+            target.write("b1b7cd0e-3a8e-4c43-9a3e-0f2d1e4c5a6b,SELL,Instant Pot Duo,2.5,224.88,269.86\n"
+                         "not-a-uuid,GIFT,,1,10,12\n"
+                         ",SELL,NA,3,10,99\n")
+        transaction_date = datetime(2022, 1, 16)
+        tables = {}
+        for engine in ('stdlib', 'pandas'):
+            db_path = shutil.copy('retail.db', os.path.join(self.workdir, f'{engine}.db'))
+            if engine == 'stdlib':
+                result = load_records(transform_records(extract_records(csv_file), transaction_date), db_path, 'upsert')
+            else:
+                result = load_data(transform_dataframe(extract_data(csv_file), transaction_date), db_path, 'upsert')
+            self.assertEqual(result, {'inserted': 4, 'duplicates': 50, 'rejected': 3})
+            with sqlite3.connect(db_path) as conn:
+                tables[engine] = [conn.execute(query).fetchall() for query in (
+                    "SELECT * FROM transactions ORDER BY id, transaction_date",
+                    "SELECT * FROM daily_balances ORDER BY transaction_date, name, category",
+                    "SELECT reason, id, transaction_date, category, name, quantity, amount_excl_tax, amount_inc_tax"
+                    " FROM quarantine ORDER BY reason")]
+        self.assertEqual(tables['stdlib'], tables['pandas'])
+        self.assertEqual([row[0] for row in tables['stdlib'][2]],
+                         ['invalid id, invalid category, missing name', 'invalid id, missing name, inconsistent tax',
+                          'invalid quantity'])
+
+    def test_small_file_is_loaded_without_pandas(self):
+        """Test that the command line picks the stdlib engine for a small file and never imports pandas."""
+        self.assertEqual(choose_engine(self.csv_file), 'stdlib')
+        self.assertEqual(choose_engine(self.csv_file, chunksize=20), 'pandas')
+
+        script = ("import runpy, sys; "
+                  f"sys.argv = ['etl.py', {self.csv_file!r}, '--db', {self.db_path!r}, '--mode', 'upsert']; "
+                  "runpy.run_path('etl.py', run_name='__main__'); "
+                  "print('pandas imported:', 'pandas' in sys.modules)")
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+        self.assertIn("4 lines were successfully loaded into the database.", output)
+        self.assertIn("pandas imported: False", output)
+
 
 if __name__ == '__main__':
     unittest.main()
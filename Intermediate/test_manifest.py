@@ -0,0 +1,66 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from batch_etl import find_retail_files, load_files
+from manifest import *
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        """Build a drop directory with one daily file and a copy of retail.db."""
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.db_path = shutil.copy('retail.db', self.workdir)
+        self.drop_dir = os.path.join(self.workdir, 'drop')
+        os.mkdir(self.drop_dir)
+        self.csv_file = shutil.copy('retail_15_01_2022.csv', self.drop_dir)
+
+    def test_loaded_file_is_recorded(self):
+        """Test that a loaded file is recorded with its date and row count."""
+        load_files(find_retail_files(self.drop_dir), self.db_path, workers=1)
+        with sqlite3.connect(self.db_path) as conn:
+            row = conn.execute("SELECT path, file_date, row_count, content_hash FROM ingested_files").fetchone()
+        self.assertEqual(row, (os.path.abspath(self.csv_file), '2022-01-15', 54, content_hash(self.csv_file)))
+
+    def test_unchanged_file_is_skipped(self):
+        """Test that a second run skips the file, even when only its mtime changed."""
+        load_files(find_retail_files(self.drop_dir), self.db_path, workers=1)
+        self.assertEqual(load_files(find_retail_files(self.drop_dir), self.db_path, workers=1), [])
+
+        os.utime(self.csv_file, ns=(0, 0))
+        self.assertEqual(load_files(find_retail_files(self.drop_dir), self.db_path, workers=1), [])
+
+    def test_changed_file_is_reloaded(self):
+        """Test that a file whose content changed is loaded again."""
+        load_files(find_retail_files(self.drop_dir), self.db_path, workers=1)
+        with open(self.csv_file, 'a') as f:
+            f.write("6f0bb0e3-1c7b-4a76-93e6-e0d58e3d55b2,SELL,Amazon Echo Dot,1,49.99,59.99\n")
+
+        report = load_files(find_retail_files(self.drop_dir), self.db_path, workers=1)
+        self.assertEqual([(entry['rows'], entry['inserted']) for entry in report], [(55, 1)])
+
+
+    def test_command_line_uses_the_manifest(self):
+        """Test that `python etl.py` records the file it loads and skips it when it is unchanged."""
+        for engine in ('stdlib', 'pandas'):
+            with self.subTest(engine=engine):
+                db_path = shutil.copy('retail.db', os.path.join(self.workdir, f'{engine}.db'))
+                command = [sys.executable, 'etl.py', self.csv_file, '--db', db_path, '--engine', engine,
+                           '--mode', 'upsert']
+                subprocess.run(command, capture_output=True, text=True, check=True)
+                with sqlite3.connect(db_path) as conn:
+                    row = conn.execute("SELECT path, row_count FROM ingested_files").fetchone()
+                self.assertEqual(row, (os.path.abspath(self.csv_file), 54))
+
+                output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+                self.assertIn("unchanged since its last load", output)
+                output = subprocess.run(command + ['--force'], capture_output=True, text=True, check=True).stdout
+                self.assertIn("0 lines were successfully loaded into the database.", output)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import unittest
+import shutil
+import sqlite3
+import tempfile
+from migrations import *
+from data_exploration import explain_query_plans, get_number_of_transactions, get_total_sell_transactions
+
+
+class MigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        """Work on a copy of retail.db so that the migrations never touch the original database."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.conn = sqlite3.connect(shutil.copy('retail.db', workdir))
+        self.addCleanup(self.conn.close)
+
+    def test_apply_migrations_once(self):
+        """Test that every migration is applied once and the version is recorded."""
+        self.assertEqual(apply_migrations(self.conn), [version for version, _, _ in MIGRATIONS])
+        self.assertEqual(get_schema_version(self.conn), LATEST_VERSION)
+        self.assertEqual(apply_migrations(self.conn), [])
+
+    def test_migrate_empty_database(self):
+        """Test that a new database without any table is migrated to the latest schema."""
+        with sqlite3.connect(':memory:') as conn:
+            self.assertEqual(apply_migrations(conn), [version for version, _, _ in MIGRATIONS])
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0], 0)
+            self.assertEqual(conn.execute("SELECT type FROM sqlite_master WHERE name = 'idx_transactions_date'").fetchone(),
+                             ('index',))
+
+    def test_migrations_keep_the_data(self):
+        """Test that the typed table holds the same transactions as the original one."""
+        cursor = self.conn.cursor()
+        expected_count = get_number_of_transactions(cursor, '2022-01-14')
+        expected_total = get_total_sell_transactions(cursor)
+
+        apply_migrations(self.conn)
+
+        self.assertEqual(get_number_of_transactions(cursor, '2022-01-14'), expected_count)
+        self.assertAlmostEqual(get_total_sell_transactions(cursor), expected_total, places=6)
+        with self.assertRaises(sqlite3.IntegrityError):
+            cursor.execute("INSERT INTO transactions SELECT * FROM transactions LIMIT 1")
+
+    def test_invalid_rows_are_quarantined(self):
+        """Test that only duplicate ids are dropped, and rows breaking the typed schema go to the quarantine table."""
+        (rows,) = self.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        self.conn.execute("INSERT INTO transactions SELECT * FROM transactions LIMIT 1")
+        self.conn.executemany("INSERT INTO transactions VALUES (?, ?, 'SELL', 'Amazon Echo Dot', 1, 49.99, 59.99)", [
+            ('00000000-0000-4000-8000-000000000001', None),
+            ('00000000-0000-4000-8000-000000000002', '15/01/2022'),
+            (None, '2022-01-15'),
+        ])
+        self.conn.commit()
+
+        apply_migrations(self.conn)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0], rows)
+        self.assertEqual(self.conn.execute("SELECT reason, id, transaction_date FROM quarantine ORDER BY id").fetchall(), [
+            ('missing id', None, '2022-01-15'),
+            ('invalid date', '00000000-0000-4000-8000-000000000001', None),
+            ('invalid date', '00000000-0000-4000-8000-000000000002', '15/01/2022'),
+        ])
+
+    def test_queries_use_indexes(self):
+        """Test that no exploration query scans the transactions table after the migrations."""
+        apply_migrations(self.conn)
+        for function_name, plan in explain_query_plans(self.conn.cursor()).items():
+            for step in plan:
+                if 'transactions' in step:
+                    self.assertIn('USING COVERING INDEX', step, f"{function_name} does a full table scan: {step}")
+
+    def test_daily_balances_backfill(self):
+        """Test that the summary table holds the totals of the transactions table."""
+        apply_migrations(self.conn)
+        expected = self.conn.execute("""
+            SELECT transaction_date, COUNT(*), ROUND(SUM(amount_inc_tax), 2)
+            FROM transactions GROUP BY transaction_date ORDER BY transaction_date
+        """).fetchall()
+        actual = self.conn.execute("""
+            SELECT transaction_date, SUM(transaction_count), ROUND(SUM(amount_inc_tax), 2)
+            FROM daily_balances GROUP BY transaction_date ORDER BY transaction_date
+        """).fetchall()
+        self.assertEqual(actual, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
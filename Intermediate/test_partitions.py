@@ -0,0 +1,111 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+from datetime import datetime
+import pandas as pd
+from batch_etl import find_retail_files, load_files
+from etl import extract_records, load_data, load_records, transform_dataframe, transform_records
+from data_exploration import (explain_query_plans, get_balance_by_date, get_number_of_transactions,
+                              get_total_sell_transactions)
+from migrations import apply_migrations
+from partitions import *
+
+
+class PartitionTest(unittest.TestCase):
+
+    def setUp(self):
+        """Partition a copy of retail.db, whose transactions are all from January 2022."""
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.db_path = shutil.copy('retail.db', self.workdir)
+        self.conn = sqlite3.connect(self.db_path)
+        self.addCleanup(self.conn.close)
+        apply_migrations(self.conn)
+        cursor = self.conn.cursor()
+        self.flat_results = [get_number_of_transactions(cursor, '2022-01-14'), get_total_sell_transactions(cursor),
+                             get_balance_by_date(cursor, 'Amazon Echo Dot')]
+        self.assertEqual(enable_partitioning(self.conn), ['2022-01'])
+
+    def load_files_of(self, *dates, new_ids=True):
+        """Load a copy of retail_15_01_2022.csv named after each of `dates` (DD_MM_YYYY).
+
+        With `new_ids`, the copies of other dates get new transaction ids, as the files of another day would.
+        """
+        drop_dir = os.path.join(self.workdir, 'drop')
+        os.makedirs(drop_dir, exist_ok=True)
+        for date in dates:
+            df = pd.read_csv('retail_15_01_2022.csv')
+            if new_ids and date != '15_01_2022':
+                df['id'] = [str(uuid.uuid4()) for _ in range(len(df))]
+            df.to_csv(os.path.join(drop_dir, f'retail_{date}.csv'), index=False)
+        return load_files(find_retail_files(drop_dir), self.db_path, workers=1)
+
+    def test_queries_are_unchanged(self):
+        """Test that the queries return the same results through the partitions view."""
+        cursor = self.conn.cursor()
+        self.assertTrue(is_partitioned(self.conn))
+        self.assertEqual(enable_partitioning(self.conn), [])
+        self.assertEqual([get_number_of_transactions(cursor, '2022-01-14'), get_total_sell_transactions(cursor),
+                          get_balance_by_date(cursor, 'Amazon Echo Dot')], self.flat_results)
+
+    def test_loads_are_routed_to_the_month_of_the_file(self):
+        """Test that each file is written to the partition of the date of its name, created on first use."""
+        report = self.load_files_of('15_01_2022', '03_02_2022')
+        self.assertEqual([entry['inserted'] for entry in report], [4, 54])
+        self.assertEqual(list_partitions(self.conn), ['2022-01', '2022-02'])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM transactions_2022_02").fetchone()[0], 54)
+        self.assertEqual(get_number_of_transactions(self.conn.cursor(), '2022-02-03'), 54)
+
+    def test_date_query_reads_one_partition(self):
+        """Test that the count of one date only reads the partition of its month."""
+        self.load_files_of('03_02_2022')
+        plan = explain_query_plans(self.conn.cursor(), date='2022-02-03')['get_number_of_transactions']
+        self.assertEqual(plan, ['SEARCH transactions_2022_02 USING COVERING INDEX '
+                                'idx_transactions_2022_02_date (transaction_date=?)'])
+        self.assertEqual(get_number_of_transactions(self.conn.cursor(), '2022-03-01'), 0)
+
+    def test_drop_partition(self):
+        """Test that dropping a month removes its transactions, summary rows and manifest records."""
+        self.load_files_of('03_02_2022')
+        self.assertTrue(drop_partition(self.conn, '2022-02'))
+        self.assertFalse(drop_partition(self.conn, '2022-02'))
+
+        self.assertEqual(list_partitions(self.conn), ['2022-01'])
+        tables = {name for (name,) in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.assertNotIn('transactions_2022_02', tables)
+        for query in ("SELECT COUNT(*) FROM transactions WHERE transaction_date >= '2022-02-01'",
+                      "SELECT COUNT(*) FROM daily_balances WHERE transaction_date >= '2022-02-01'",
+                      "SELECT COUNT(*) FROM ingested_files WHERE file_date >= '2022-02-01'"):
+            self.assertEqual(self.conn.execute(query).fetchone()[0], 0, query)
+        # The ids of the dropped month are kept until they are pruned, but no longer count as loaded
+        (stale_ids,) = self.conn.execute("SELECT COUNT(*) FROM transaction_ids WHERE month = '2022-02'").fetchone()
+        self.assertEqual(stale_ids, 54)
+        drop_dir = os.path.join(self.workdir, 'drop')
+        report = load_files(find_retail_files(drop_dir), self.db_path, workers=1)
+        self.assertEqual([entry['inserted'] for entry in report], [54])
+        self.assertEqual(list_partitions(self.conn), ['2022-01', '2022-02'])
+        self.assertEqual(prune_transaction_ids(self.conn), 0)
+        self.assertTrue(drop_partition(self.conn, '2022-02'))
+        self.assertEqual(prune_transaction_ids(self.conn), 54)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM transaction_ids").fetchone()[0], 731)
+
+    def test_ids_are_unique_across_months(self):
+        """Test that ids already loaded in one month are not loaded again under the date of another month."""
+        report = self.load_files_of('15_01_2022', '03_02_2022', new_ids=False)
+        self.assertEqual([(entry['inserted'], entry['duplicates']) for entry in report], [(4, 50), (0, 54)])
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM transactions_2022_02").fetchone()[0], 0)
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) - COUNT(DISTINCT id) FROM transactions").fetchone()[0], 0)
+
+        df = transform_dataframe(pd.read_csv('retail_15_01_2022.csv'), datetime(2022, 3, 1))
+        with self.assertRaisesRegex(Exception, "UNIQUE constraint failed"):
+            load_data(df, self.db_path)
+        rows = transform_records(extract_records('retail_15_01_2022.csv'), datetime(2022, 3, 1))
+        self.assertEqual(load_records(rows, self.db_path, mode='upsert'), {'inserted': 0, 'duplicates': 54, 'rejected': 0})
+        self.assertEqual(self.conn.execute("SELECT COUNT(*) FROM transactions_2022_03").fetchone()[0], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import unittest
+import asyncio
+import shutil
+import sqlite3
+import tempfile
+import pandas as pd
+from datetime import datetime
+from data_exploration import get_balance_by_date, get_product_balances, get_total_sell_transactions
+from etl import load_data, transform_dataframe
+from migrations import apply_migrations
+from query_cache import *
+from query_service import QueryService
+
+
+class QueryCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        """Query a migrated copy of retail.db."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.db_path = shutil.copy('retail.db', workdir)
+        self.conn = sqlite3.connect(self.db_path)
+        self.addCleanup(self.conn.close)
+        apply_migrations(self.conn)
+        self.cursor = self.conn.cursor()
+
+    def test_repeated_calls_hit(self):
+        """Test that a repeated call with the same arguments is served from the cache."""
+        cache = QueryCache()
+        first = cache.call(self.cursor, get_balance_by_date, 'Amazon Echo Dot')
+        self.assertEqual(cache.call(self.cursor, get_balance_by_date, 'Amazon Echo Dot'), first)
+        cache.call(self.cursor, get_balance_by_date, 'Fitbit Charge 5')
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 2, 'evictions': 0, 'entries': 2, 'hit_rate': 1 / 3})
+
+    def test_callers_cannot_modify_cached_results(self):
+        """Test that a caller modifying its result, a list or a dictionary of columns, does not change the cache."""
+        cache = QueryCache()
+        balances = cache.call(self.cursor, get_balance_by_date, 'Amazon Echo Dot')
+        columns = cache.call(self.cursor, get_product_balances, ('Amazon Echo Dot',))
+        expected = {key: list(values) for key, values in columns.items()}
+        balances.clear()
+        columns['balance'].clear()
+        columns.pop('name')
+        self.assertTrue(cache.call(self.cursor, get_balance_by_date, 'Amazon Echo Dot'))
+        self.assertEqual(cache.call(self.cursor, get_product_balances, ('Amazon Echo Dot',)), expected)
+        self.assertEqual(cache.hits, 2)
+
+    def test_load_invalidates_cached_results(self):
+        """Test that a load bumps the generation, so the next call runs the query again."""
+        cache = QueryCache()
+        total_before = cache.call(self.cursor, get_total_sell_transactions)
+        self.conn.commit()
+
+        df = transform_dataframe(pd.read_csv('retail_15_01_2022.csv'), datetime(2022, 1, 15))
+        load_data(df, self.db_path, mode='upsert')
+        total_after = cache.call(self.cursor, get_total_sell_transactions)
+
+        self.assertEqual(total_after, get_total_sell_transactions(self.cursor))
+        self.assertNotEqual(total_after, total_before)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+
+    def test_ttl_and_lru_eviction(self):
+        """Test that entries expire after the TTL and the least recently used entry is evicted."""
+        expired = QueryCache(ttl=0)
+        for _ in range(2):
+            expired.call(self.cursor, get_total_sell_transactions)
+        self.assertEqual((expired.hits, expired.misses), (0, 2))
+
+        cache = QueryCache(max_entries=2)
+        for product_name in ('Amazon Echo Dot', 'Fitbit Charge 5', 'Amazon Echo Dot', 'Instant Pot Duo'):
+            cache.call(self.cursor, get_balance_by_date, product_name)
+        cache.call(self.cursor, get_balance_by_date, 'Amazon Echo Dot')
+        self.assertEqual(cache.stats()['hits'], 2)
+        self.assertEqual(cache.evictions, 1)
+
+    def test_query_service_shares_cache(self):
+        """Test that the query service serves repeated queries from its cache."""
+        async def query_twice():
+            async with QueryService(self.db_path, pool_size=2, cache=QueryCache()) as service:
+                for _ in range(2):
+                    await asyncio.gather(service.get_cumulative_balance(), service.get_total_sell_transactions())
+                return service.cache.stats()
+
+        stats = asyncio.run(query_twice())
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
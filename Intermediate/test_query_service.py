@@ -0,0 +1,89 @@
+import unittest
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import data_exploration
+from migrations import apply_migrations, get_schema_version
+from query_cache import QueryCache
+from query_service import *
+
+
+class QueryServiceTest(unittest.TestCase):
+
+    def setUp(self):
+        """Serve a migrated copy of retail.db."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.unmigrated_path = shutil.copy('retail.db', os.path.join(workdir, 'unmigrated.db'))
+        self.db_path = shutil.copy('retail.db', workdir)
+        conn = sqlite3.connect(self.db_path)
+        apply_migrations(conn)
+        conn.close()
+
+    def test_results_match_direct_queries(self):
+        """Test that concurrent queries through the service return the results of the direct queries."""
+        async def query_all():
+            async with QueryService(self.db_path, pool_size=2) as service:
+                return await asyncio.gather(
+                    service.get_number_of_transactions('2022-01-14'),
+                    service.get_total_sell_transactions(),
+                    service.get_balance_by_date('Amazon Echo Dot'),
+                    service.get_cumulative_balance(),
+                    *(service.get_balance_by_date('Amazon Echo Dot') for _ in range(10)),
+                )
+
+        results = asyncio.run(query_all())
+        with data_exploration.connect_to_database(self.db_path) as conn:
+            cursor = conn.cursor()
+            expected = [
+                data_exploration.get_number_of_transactions(cursor, '2022-01-14'),
+                data_exploration.get_total_sell_transactions(cursor),
+                data_exploration.get_balance_by_date(cursor, 'Amazon Echo Dot'),
+                data_exploration.get_cumulative_balance(cursor),
+            ]
+        self.assertEqual(results[:4], expected)
+        self.assertEqual(results[4:], [expected[2]] * 10)
+
+    def test_product_balances_are_cached(self):
+        """Test that the batched product balances of a list of products are served from the cache."""
+        cache = QueryCache()
+
+        async def query_twice():
+            async with QueryService(self.db_path, pool_size=1, cache=cache) as service:
+                return [await service.get_product_balances(['Amazon Echo Dot'], start_date='2022-01-10')
+                        for _ in range(2)]
+
+        first, second = asyncio.run(query_twice())
+        self.assertEqual(first, second)
+        self.assertEqual(set(first['name']), {'Amazon Echo Dot'})
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    def test_pooled_connections_are_read_only(self):
+        """Test that a query writing through the pool fails and its connection goes back to the pool."""
+        def delete_transactions(cursor):
+            cursor.execute("DELETE FROM transactions")
+
+        async def write_then_read():
+            async with QueryService(self.db_path, pool_size=1) as service:
+                with self.assertRaises(sqlite3.OperationalError):
+                    await service.run(delete_transactions)
+                return await service.get_total_sell_transactions()
+
+        self.assertIsNotNone(asyncio.run(write_then_read()))
+        with sqlite3.connect(self.db_path) as conn:
+            self.assertGreater(conn.execute("SELECT COUNT(*) FROM transactions").fetchone()[0], 0)
+
+
+    def test_unmigrated_database_is_rejected(self):
+        """Test that the service refuses a database whose schema is out of date, without migrating it."""
+        with self.assertRaisesRegex(sqlite3.DatabaseError, "run `python migrations.py`"):
+            QueryService(self.unmigrated_path)
+        conn = sqlite3.connect(self.unmigrated_path)
+        self.addCleanup(conn.close)
+        self.assertEqual(get_schema_version(conn), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import numpy as np
+from data_exploration import get_balance_by_date, get_cumulative_balance, get_number_of_transactions
+from migrations import apply_migrations
+from snapshot import *
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        """Export a snapshot of a migrated copy of retail.db, in batches smaller than the table."""
+        workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, workdir)
+        self.db_path = shutil.copy('retail.db', workdir)
+        self.conn = sqlite3.connect(self.db_path)
+        self.addCleanup(self.conn.close)
+        apply_migrations(self.conn)
+        self.cursor = self.conn.cursor()
+        self.workdir = workdir
+        self.directory = os.path.join(workdir, 'snapshot')
+        self.manifest = export_snapshot(self.conn, self.directory, batch_size=100)
+        self.snapshot = Snapshot(self.directory)
+
+    def assertPairsAlmostEqual(self, actual, expected):
+        self.assertEqual([date for date, _ in actual], [date for date, _ in expected])
+        np.testing.assert_allclose([value for _, value in actual], [value for _, value in expected], atol=1e-6)
+
+    def test_columns_are_memory_mapped(self):
+        """Test that every column is opened as a memory map, with its codes and dictionaries."""
+        self.assertEqual(len(self.snapshot), 731)
+        for column, array in self.snapshot.columns.items():
+            self.assertIsInstance(array, np.memmap, column)
+            self.assertEqual(array.dtype, np.dtype(COLUMN_DTYPES[column]))
+        self.assertEqual(self.snapshot.dictionaries['category'], ['BUY', 'SELL'])
+        self.assertTrue(np.all(np.diff(self.snapshot.columns['transaction_date'].astype('int64')) >= 0))
+
+    def test_queries_match_sql(self):
+        """Test that the snapshot answers the exploration queries like SQL."""
+        for product_name in self.snapshot.dictionaries['name']:
+            self.assertPairsAlmostEqual(self.snapshot.balance_by_date(product_name),
+                                        get_balance_by_date(self.cursor, product_name))
+        self.assertPairsAlmostEqual(self.snapshot.cumulative_balance(), get_cumulative_balance(self.cursor))
+        self.assertEqual(self.snapshot.number_of_transactions('2022-01-14'),
+                         get_number_of_transactions(self.cursor, '2022-01-14'))
+        self.assertEqual(self.snapshot.balance_by_date('Unknown product'), [])
+
+    def test_snapshot_goes_stale_after_a_load(self):
+        """Test that a snapshot is current until the next load bumps the data generation."""
+        self.assertTrue(self.snapshot.is_current(self.cursor))
+        self.conn.execute("UPDATE data_generation SET generation = generation + 1")
+        self.assertFalse(self.snapshot.is_current(self.cursor))
+
+
+    def test_load_during_export_is_left_out(self):
+        """Test that a load committed while the rows are read is neither exported nor counted in the generation."""
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        writer = sqlite3.connect(self.db_path)
+        self.addCleanup(writer.close)
+
+        def load_when_rows_are_read(statement):
+            if statement.startswith("SELECT transaction_date, category"):
+                writer.execute("INSERT INTO transactions VALUES ('00000000-0000-4000-8000-000000000000', "
+                               "'2022-01-20', 'SELL', 'Amazon Echo Dot', 1, 49.99, 59.99)")
+                writer.execute("UPDATE data_generation SET generation = generation + 1")
+                writer.commit()
+
+        self.conn.set_trace_callback(load_when_rows_are_read)
+        manifest = export_snapshot(self.conn, os.path.join(self.workdir, 'during_load'), batch_size=100)
+        self.conn.set_trace_callback(None)
+        self.assertEqual(manifest['rows'], 731)
+        self.assertEqual(manifest['generation'], self.manifest['generation'])
+        self.assertFalse(Snapshot(os.path.join(self.workdir, 'during_load')).is_current(self.cursor))
+
+
+if __name__ == '__main__':
+    unittest.main()
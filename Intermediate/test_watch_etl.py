@@ -0,0 +1,81 @@
+import unittest
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from migrations import apply_migrations
+from watch_etl import *
+
+
+class WatchEtlTest(unittest.TestCase):
+
+    def setUp(self):
+        """Build an empty drop directory next to a copy of retail.db."""
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.db_path = shutil.copy('retail.db', self.workdir)
+        self.drop_dir = os.path.join(self.workdir, 'drop')
+        os.mkdir(self.drop_dir)
+
+    def drop(self, name, source='retail_15_01_2022.csv'):
+        """Drop a file the way a producer should: under a temporary name, then renamed."""
+        path = os.path.join(self.drop_dir, name)
+        shutil.copy(source, path + '.part')
+        os.replace(path + '.part', path)
+        return path
+
+    def count_transactions(self, date):
+        with sqlite3.connect(self.db_path) as conn:
+            return conn.execute("SELECT COUNT(*) FROM transactions WHERE transaction_date = ?", (date,)).fetchone()[0]
+
+    def test_next_batch(self):
+        """Test that a micro-batch is bounded by its number of files and bytes."""
+        files = [self.drop(f'retail_{day:02d}_01_2022.csv') for day in range(1, 6)]
+        size = os.path.getsize(files[0])
+        self.assertEqual(next_batch(files, max_files=2), files[:2])
+        self.assertEqual(next_batch(files, max_bytes=3 * size), files[:3])
+        self.assertEqual(next_batch(files, max_bytes=1), files[:1])
+
+    def test_failed_file_is_rolled_back_alone(self):
+        """Test that a bad file goes to failed/ while the other files of its batch are committed."""
+        good = self.drop('retail_15_01_2022.csv')
+        bad_source = os.path.join(self.workdir, 'bad.csv')
+        with open(bad_source, 'w') as f:
+            f.write("id,category\nnot-a-transaction,SELL\n")
+        bad = self.drop('retail_16_01_2022.csv', bad_source)
+
+        with sqlite3.connect(self.db_path) as conn:
+            apply_migrations(conn)
+            report = process_batch(conn, [good, bad])
+        self.assertEqual([entry['inserted'] for entry in report], [4, 0])
+        self.assertIsNone(report[0]['error'])
+        self.assertIsNotNone(report[1]['error'])
+        self.assertEqual(os.listdir(os.path.join(self.drop_dir, 'processed')), ['retail_15_01_2022.csv'])
+        self.assertEqual(os.listdir(os.path.join(self.drop_dir, 'failed')), ['retail_16_01_2022.csv'])
+        self.assertEqual(find_retail_files(self.drop_dir), [])
+
+    def test_watch_loads_dropped_files(self):
+        """Test that the daemon makes the rows of a dropped file queryable within a few seconds."""
+        reports = []
+        stop = threading.Event()
+        daemon = threading.Thread(target=watch, args=(self.drop_dir, self.db_path),
+                                  kwargs={'interval': 0.05, 'settle': 0, 'stop': stop, 'on_batch': reports.append})
+        daemon.start()
+        self.addCleanup(daemon.join)
+        self.addCleanup(stop.set)
+
+        self.drop('retail_15_01_2022.csv')
+        deadline = time.monotonic() + 10
+        while not reports and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(reports), 1)
+        self.assertEqual(reports[0][0]['inserted'], 4)
+        self.assertLess(reports[0][0]['latency_seconds'], 5)
+        self.assertEqual(self.count_transactions('2022-01-15'), 54)
+        self.assertTrue(os.path.isfile(os.path.join(self.drop_dir, 'processed', 'retail_15_01_2022.csv')))
+
+
+if __name__ == '__main__':
+    unittest.main()
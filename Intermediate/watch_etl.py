@@ -0,0 +1,179 @@
+import argparse
+import os
+import signal
+import sqlite3
+import threading
+import time
+
+from batch_etl import extract_and_transform, find_retail_files
+from etl import DB_PATH, LOAD_MODES, STREAMING_PRAGMAS, load_window, write_dataframe
+from instrumentation import configure, stage
+from manifest import changed_files, record_file
+from migrations import apply_migrations
+
+POLL_INTERVAL = 1.0
+# A file is picked up once nothing wrote to it for this long, so a file that is still being copied is not read
+SETTLE_SECONDS = 0.5
+# Bounds of a micro-batch. The rows of a batch become queryable at its commit, and 4 MiB is about
+# 50,000 rows or under two seconds of load, so a burst is committed every few seconds.
+MAX_BATCH_FILES = 32
+MAX_BATCH_BYTES = 4 << 20
+PROCESSED_DIR = 'processed'
+FAILED_DIR = 'failed'
+
+
+def ready_files(directory, settle=SETTLE_SECONDS):
+    """Return the retail files of a drop directory that were not modified for `settle` seconds.
+
+    Files are best dropped under a temporary name (e.g. retail_15_01_2022.csv.part) and renamed once
+    complete, which `find_retail_files` ignores until the rename; `settle` covers the writers that do not.
+
+    Args:
+        directory: Drop directory.
+        settle: Seconds since the last modification of a file before it is loaded.
+
+    Returns:
+        List of file paths, sorted by the date of their name.
+    """
+    now = time.time()
+    return [path for path in find_retail_files(directory) if now - os.stat(path).st_mtime >= settle]
+
+
+def next_batch(filenames, max_files=MAX_BATCH_FILES, max_bytes=MAX_BATCH_BYTES):
+    """Return the first files of `filenames` that fit in a micro-batch; a larger file makes a batch on its own."""
+    batch, batch_bytes = [], 0
+    for filename in filenames:
+        size = os.path.getsize(filename)
+        if batch and (len(batch) == max_files or batch_bytes + size > max_bytes):
+            break
+        batch.append(filename)
+        batch_bytes += size
+    return batch
+
+
+def _move(filename, folder):
+    os.makedirs(folder, exist_ok=True)
+    target = os.path.join(folder, os.path.basename(filename))
+    os.replace(filename, target)
+    return target
+
+
+def process_batch(conn, filenames, mode='upsert'):
+    """Load a micro-batch of files in one transaction, then move each file to processed/ or failed/.
+
+    The files are read one at a time, so memory is bounded by the largest file of the batch and not
+    by the size of a burst. Each file is written under its own savepoint: a file that fails is rolled
+    back alone and moved to failed/, the others are committed together. Files that are unchanged since
+    their last load (see `manifest.changed_files`) are moved to processed/ without being loaded.
+
+    Args:
+        conn: Open connection to a migrated SQLite database, outside of any transaction.
+        filenames: Paths of the files of the batch, in the drop directory.
+        mode: 'append' or 'upsert', see `etl.load_data`.
+
+    Returns:
+        List of one dictionary per file with its 'file' (path after the move), 'rows', 'inserted',
+        'duplicates', 'rejected', 'skipped', 'latency_seconds' and 'error'. The latency runs from the
+        last modification of the file to the commit that made its rows queryable.
+    """
+    to_load = set(changed_files(conn, filenames))
+    report = []
+    with stage('watch.batch', files=len(filenames)) as record:
+        conn.execute("BEGIN")
+        try:
+            for filename in filenames:
+                entry = {'file': filename, 'rows': 0, 'inserted': 0, 'duplicates': 0, 'rejected': 0,
+                         'skipped': filename not in to_load, 'latency_seconds': 0.0, 'error': None,
+                         'landed_at': os.stat(filename).st_mtime}
+                report.append(entry)
+                if entry['skipped']:
+                    continue
+                conn.execute("SAVEPOINT load_file")
+                try:
+                    _, df, digest, _ = extract_and_transform(filename)
+                    entry.update(write_dataframe(conn, df, mode))
+                    record_file(conn, filename, len(df), digest)
+                    entry['rows'] = len(df)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO load_file")
+                    entry['error'] = str(e)
+                conn.execute("RELEASE load_file")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        committed_at = time.time()
+        record['rows_out'] = sum(entry['inserted'] for entry in report)
+
+    for entry in report:
+        entry['latency_seconds'] = committed_at - entry.pop('landed_at')
+        folder = FAILED_DIR if entry['error'] else PROCESSED_DIR
+        entry['file'] = _move(entry['file'], os.path.join(os.path.dirname(entry['file']), folder))
+    return report
+
+
+def print_batch(report):
+    """Print one line per micro-batch with its files, rows and worst latency, and the errors of its files."""
+    loaded = [entry for entry in report if not entry['skipped'] and not entry['error']]
+    print(f"{len(loaded)} files, {sum(entry['inserted'] for entry in loaded)} rows loaded, "
+          f"{sum(entry['skipped'] for entry in report)} unchanged, "
+          f"max latency {max(entry['latency_seconds'] for entry in report):.2f} seconds.")
+    for entry in report:
+        if entry['error']:
+            print(f"{os.path.basename(entry['file'])} failed: {entry['error']}")
+
+
+def watch(directory, db_path, mode='upsert', interval=POLL_INTERVAL, settle=SETTLE_SECONDS,
+          max_files=MAX_BATCH_FILES, max_bytes=MAX_BATCH_BYTES, pragmas=None, stop=None, on_batch=print_batch):
+    """Poll a drop directory and load the files that land in it, in micro-batches, until `stop` is set.
+
+    A burst of files is drained batch after batch without waiting between them, and the directory is
+    polled every `interval` seconds once it is empty, so a file is queryable about
+    `interval + settle` seconds after it lands plus the time of its load.
+
+    Args:
+        directory: Drop directory; the processed/ and failed/ folders are created inside it.
+        db_path: Path to the SQLite database.
+        mode: 'append' or 'upsert', see `etl.load_data`.
+        interval: Seconds between two polls of an empty directory.
+        settle: Seconds since the last modification of a file before it is loaded, see `ready_files`.
+        max_files: Maximum number of files of a micro-batch.
+        max_bytes: Maximum size of the files of a micro-batch.
+        pragmas: Pragmas of the load window, defaults to etl.STREAMING_PRAGMAS, see `etl.load_window`.
+        stop: threading.Event that ends the loop, e.g. set by a signal handler or another thread.
+        on_batch: Function called with the report of every micro-batch.
+    """
+    if not os.path.isfile(db_path):
+        raise FileNotFoundError(f"The database file '{db_path}' does not exist.")
+    stop = stop or threading.Event()
+    with sqlite3.connect(db_path) as conn:
+        apply_migrations(conn)
+        with load_window(conn, STREAMING_PRAGMAS if pragmas is None else pragmas):
+            while not stop.is_set():
+                filenames = ready_files(directory, settle)
+                if not filenames:
+                    stop.wait(interval)
+                    continue
+                on_batch(process_batch(conn, next_batch(filenames, max_files, max_bytes), mode))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Watch a drop directory and load its retail_DD_MM_YYYY.csv files.")
+    parser.add_argument('directory', help="Directory where the CSV files are dropped")
+    parser.add_argument('--db', default=DB_PATH, help="Path to the SQLite database")
+    parser.add_argument('--mode', choices=LOAD_MODES, default='upsert')
+    parser.add_argument('--interval', type=float, default=POLL_INTERVAL, help="Seconds between two polls")
+    parser.add_argument('--settle', type=float, default=SETTLE_SECONDS,
+                        help="Seconds without modification before a file is loaded")
+    parser.add_argument('--max-files', type=int, default=MAX_BATCH_FILES, help="Maximum files of a micro-batch")
+    parser.add_argument('--max-mb', type=int, default=MAX_BATCH_BYTES >> 20, help="Maximum MiB of a micro-batch")
+    parser.add_argument('--metrics-log', help="JSON lines file receiving the metrics of every stage")
+    args = parser.parse_args()
+    configure(log_path=args.metrics_log)
+
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+    print(f"Watching {args.directory}, press Ctrl+C to stop.")
+    watch(args.directory, args.db, args.mode, args.interval, args.settle, args.max_files, args.max_mb << 20,
+          stop=stop)
@@ -0,0 +1,124 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import bike_investigation
+from bike_investigation import CITY_DATA, DAYS, MONTHS, load_data
+from stats_engine import compute_stats, print_stats
+
+ALL_MONTHS = ["all"] + MONTHS
+ALL_DAYS = ["all"] + DAYS
+
+
+def check_filters(cities, months, days):
+    """
+    Raises a ValueError naming the first city, month or day that get_filters would not accept.
+    """
+    for values, valid in ((cities, CITY_DATA), (months, ALL_MONTHS), (days, ALL_DAYS)):
+        for value in values:
+            if value not in valid:
+                raise ValueError(f"Invalid filter '{value}', expected one of: {', '.join(valid)}.")
+
+
+def city_report(city, months, days, data_dir=None, use_cache=True):
+    """
+    Computes the statistics of one city for every combination of month and day filters; runs in a worker process.
+    The city is parsed once and stays in the session cache, so each filter only costs an integer mask
+    and one compute_stats call.
+    Args:
+        (str) city - name of the city to analyze
+        (list) months - month filters, "all" for no filter
+        (list) days - day filters, "all" for no filter
+        (str) data_dir - directory of the raw files, defaults to bike_investigation.DATA_DIR
+        (bool) use_cache - read the city through its Parquet cache
+    Returns:
+        (tuple) {month: {day: statistics}} where the statistics are the dictionary of compute_stats,
+            and the seconds spent on the city
+    """
+    start = time.perf_counter()
+    if data_dir is not None:
+        bike_investigation.DATA_DIR = data_dir
+        bike_investigation.CACHE_DIR = os.path.join(data_dir, "cache")
+    # A forked worker inherits the session of the parent, which may hold the city of another directory
+    bike_investigation.clear_city_session()
+    grid = {}
+    for month in months:
+        grid[month] = {}
+        for day in days:
+            # load_data explains empty filters on stdout, which is noise in a batch
+            with contextlib.redirect_stdout(io.StringIO()):
+                df = load_data(city, month, day, use_cache=use_cache)
+            grid[month][day] = compute_stats(df)
+    return grid, time.perf_counter() - start
+
+
+def batch_report(cities=None, months=None, days=None, workers=None, data_dir=None, use_cache=True):
+    """
+    Computes the statistics of several cities for every combination of month and day filters.
+    Each city runs in its own worker process, so the report takes about the time of the slowest city.
+    Args:
+        (list) cities - names of the cities, all of CITY_DATA by default
+        (list) months - month filters, "all" and the six months by default
+        (list) days - day filters, "all" and the seven days by default
+        (int) workers - number of worker processes, defaults to one per city
+        (str) data_dir - directory of the raw files, defaults to bike_investigation.DATA_DIR
+        (bool) use_cache - read the cities through their Parquet cache
+    Returns:
+        (tuple) report - {city: {month: {day: statistics}}}, seconds - {city: seconds spent on the city}
+    """
+    cities = list(cities or CITY_DATA)
+    months = list(months or ALL_MONTHS)
+    days = list(days or ALL_DAYS)
+    check_filters(cities, months, days)
+    data_dir = data_dir or bike_investigation.DATA_DIR
+
+    with ProcessPoolExecutor(max_workers=min(workers or len(cities), len(cities))) as pool:
+        futures = {city: pool.submit(city_report, city, months, days, data_dir, use_cache) for city in cities}
+        results = {city: future.result() for city, future in futures.items()}
+    report = {city: grid for city, (grid, _) in results.items()}
+    seconds = {city: city_seconds for city, (_, city_seconds) in results.items()}
+    return report, seconds
+
+
+def print_report(report):
+    """Displays the statistics of every city and filter of a batch report."""
+    for city, grid in report.items():
+        for month, by_day in grid.items():
+            for day, stats in by_day.items():
+                print(f"\n{'=' * 40}\n{city.title()}, month: {month}, day: {day}")
+                print_stats(stats)
+
+
+def _to_json(value):
+    # NumPy scalars of the statistics, e.g. the uint32 total travel time
+    return value.item() if hasattr(value, "item") else str(value)
+
+
+def save_report(report, path):
+    """Writes a batch report to a JSON file."""
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, default=_to_json)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bikeshare statistics of several cities and filters at once.")
+    parser.add_argument("--cities", nargs="+", choices=CITY_DATA, default=list(CITY_DATA))
+    parser.add_argument("--months", nargs="+", choices=ALL_MONTHS, default=ALL_MONTHS)
+    parser.add_argument("--days", nargs="+", choices=ALL_DAYS, default=ALL_DAYS)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes, one per city by default")
+    parser.add_argument("--output", help="JSON file receiving the report instead of printing it")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    report, seconds = batch_report(args.cities, args.months, args.days, args.workers)
+    if args.output:
+        save_report(report, args.output)
+        print(f"Report saved to {args.output}.")
+    else:
+        print_report(report)
+    print(f"\n{len(args.cities) * len(args.months) * len(args.days)} reports in {time.perf_counter() - start:.2f} seconds "
+          f"(slowest city: {max(seconds.values()):.2f} seconds).")
@@ -0,0 +1,371 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import batch_report
+import bike_investigation
+import cube
+import sketches
+import stats_engine
+import streaming_stats
+
+# Columns of the raw files: every city has the six core columns, washington has no user details
+CITY_COLUMNS = {
+    "chicago": ["Start Time", "End Time", "Trip Duration", "Start Station", "End Station",
+                "User Type", "Gender", "Birth Year"],
+    "new york city": ["Start Time", "End Time", "Trip Duration", "Start Station", "End Station",
+                      "User Type", "Gender", "Birth Year"],
+    "washington": ["Start Time", "End Time", "Trip Duration", "Start Station", "End Station", "User Type"],
+}
+
+
+def generate_bike_frame(city, rows, stations=600, seed=0):
+    """Return a synthetic DataFrame of trips in the schema of a city's raw CSV file.
+
+    Args:
+        city: Key of CITY_DATA, selects the columns of the file.
+        rows: Number of trips to generate.
+        stations: Number of distinct stations.
+        seed: Seed of the random generator, for reproducible files.
+    """
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp("2017-01-01") + pd.to_timedelta(rng.integers(0, 181 * 86400, rows), unit="s")
+    duration = rng.gamma(2.0, 450.0, rows).round().astype(int) + 60
+    # A skewed popularity makes the most common stations and trips meaningful
+    popularity = 1.0 / np.arange(1, stations + 1)
+    popularity /= popularity.sum()
+    names = np.array([f"Station {i:04d}" for i in range(stations)], dtype=object)
+    df = pd.DataFrame({
+        "Start Time": start.strftime("%Y-%m-%d %H:%M:%S"),
+        "End Time": (start + pd.to_timedelta(duration, unit="s")).strftime("%Y-%m-%d %H:%M:%S"),
+        "Trip Duration": duration,
+        "Start Station": names[rng.choice(stations, rows, p=popularity)],
+        "End Station": names[rng.choice(stations, rows, p=popularity)],
+        "User Type": rng.choice(np.array(["Subscriber", "Customer"], dtype=object), rows, p=[0.8, 0.2]),
+        "Gender": rng.choice(np.array(["Male", "Female", None], dtype=object), rows, p=[0.65, 0.25, 0.1]),
+        "Birth Year": np.where(rng.random(rows) < 0.1, np.nan, rng.integers(1940, 2002, rows)),
+    })
+    return df[CITY_COLUMNS[city]]
+
+
+def generate_bike_csv(directory, city, rows, seed=0):
+    """Write a synthetic raw CSV file of a city into `directory`, named as in CITY_DATA."""
+    path = os.path.join(directory, bike_investigation.CITY_DATA[city])
+    generate_bike_frame(city, rows, seed=seed).to_csv(path)
+    return path
+
+
+def use_data_dir(directory):
+    """Point bike_investigation at another directory of raw files and cache."""
+    bike_investigation.DATA_DIR = directory
+    bike_investigation.CACHE_DIR = os.path.join(directory, "cache")
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def benchmark_cache(rows, city="chicago"):
+    """Compare the load time of a city from its CSV file and from its cold and warm Parquet cache."""
+    workdir = tempfile.mkdtemp()
+    try:
+        use_data_dir(workdir)
+        generate_bike_csv(workdir, city, rows)
+        _, csv_seconds = _timed(bike_investigation.read_city, city, use_cache=False)
+        _, cold_seconds = _timed(bike_investigation.read_city, city)
+        _, warm_seconds = _timed(bike_investigation.read_city, city)
+        _, warm_time_seconds = _timed(bike_investigation.read_city, city, stats=["time_stats"])
+
+        print(f"{'load path':<32} | {'seconds':>8}")
+        print("-" * 43)
+        print(f"{'CSV':<32} | {csv_seconds:>8.3f}")
+        print(f"{'cache, cold (builds Parquet)':<32} | {cold_seconds:>8.3f}")
+        print(f"{'cache, warm, all columns':<32} | {warm_seconds:>8.3f}")
+        print(f"{'cache, warm, time_stats columns':<32} | {warm_time_seconds:>8.3f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_session(rows, city="chicago"):
+    """Time a sequence of filter changes on one city within a session."""
+    workdir = tempfile.mkdtemp()
+    try:
+        use_data_dir(workdir)
+        generate_bike_csv(workdir, city, rows)
+        bike_investigation.build_cache(city)
+        bike_investigation.clear_city_session()
+        print(f"{'filters':<20} | {'seconds':>8} | {'rows':>9}")
+        print("-" * 43)
+        for month, day in [("june", "friday"), ("march", "all"), ("all", "sunday"), ("all", "all")]:
+            df, seconds = _timed(bike_investigation.load_data, city, month, day)
+            print(f"{month + '/' + day:<20} | {seconds:>8.3f} | {len(df):>9}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_stats(rows, city="chicago"):
+    """Compare the four statistics functions with the single-pass stats_engine."""
+    df = generate_bike_frame(city, rows)
+    df["Start Time"] = pd.to_datetime(df["Start Time"])
+    df["month"] = df["Start Time"].dt.month_name()
+    df["day_of_week"] = df["Start Time"].dt.day_name()
+    df["hour"] = df["Start Time"].dt.hour
+
+    functions = [bike_investigation.time_stats, bike_investigation.station_stats,
+                 bike_investigation.trip_duration_stats, bike_investigation.user_stats]
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, functions_seconds = _timed(lambda: [function(df) for function in functions])
+    _, engine_seconds = _timed(stats_engine.compute_stats, df)
+    categorical = df.astype({column: "category" for column in
+                             ["month", "day_of_week", "Start Station", "End Station", "User Type", "Gender"]})
+    _, categorical_seconds = _timed(stats_engine.compute_stats, categorical)
+    print(f"{rows} trips: stats functions {functions_seconds:.3f} s, stats_engine {engine_seconds:.3f} s "
+          f"({functions_seconds / engine_seconds:.1f}x faster), "
+          f"stats_engine on categorical columns {categorical_seconds:.3f} s "
+          f"({functions_seconds / categorical_seconds:.1f}x faster)")
+
+
+def benchmark_memory(rows):
+    """Print the memory report of each city and the memory of the three cities loaded side by side."""
+    workdir = tempfile.mkdtemp()
+    try:
+        use_data_dir(workdir)
+        totals = []
+        for seed, city in enumerate(bike_investigation.CITY_DATA):
+            generate_bike_csv(workdir, city, rows, seed=seed)
+            print(f"\n{city} ({rows} trips)")
+            totals.append(bike_investigation.memory_report(city))
+        before, after = (sum(column) for column in zip(*totals))
+        print(f"\nThree cities side by side: {before / 2**20:.1f} MiB untyped, {after / 2**20:.1f} MiB typed.")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_grid(rows, workers=None):
+    """Time the full month x day report of the three cities, one city at a time and in parallel workers."""
+    workdir = tempfile.mkdtemp()
+    try:
+        use_data_dir(workdir)
+        for seed, city in enumerate(bike_investigation.CITY_DATA):
+            generate_bike_csv(workdir, city, rows, seed=seed)
+            bike_investigation.build_cache(city)
+        print(f"{'workers':>7} | {'reports':>7} | {'seconds':>8} | {'slowest city (s)':>16} | {'sum of cities (s)':>17}")
+        print("-" * 68)
+        for worker_count in [1, workers or len(bike_investigation.CITY_DATA)]:
+            (report, seconds), wall_seconds = _timed(batch_report.batch_report, workers=worker_count)
+            reports = sum(len(by_day) for grid in report.values() for by_day in grid.values())
+            print(f"{worker_count:>7} | {reports:>7} | {wall_seconds:>8.2f} | {max(seconds.values()):>16.2f} | "
+                  f"{sum(seconds.values()):>17.2f}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def benchmark_cube(rows, city="chicago"):
+    """Compare the statistics of every month and day filter from the raw trips and from the aggregate cube."""
+    workdir = tempfile.mkdtemp()
+    try:
+        use_data_dir(workdir)
+        generate_bike_csv(workdir, city, rows)
+        bike_investigation.build_cache(city)
+        bike_investigation.clear_city_session()
+        _, build_seconds = _timed(bike_investigation.get_cube, city)
+        bike_investigation.clear_city_session()
+        city_cube, load_seconds = _timed(bike_investigation.get_cube, city)
+        bike_investigation.load_data(city, "all", "all")
+        filters = [(month, day) for month in ["all"] + bike_investigation.MONTHS
+                   for day in ["all"] + bike_investigation.DAYS]
+        raw, cubed = [], []
+        with contextlib.redirect_stdout(io.StringIO()):
+            for month, day in filters:
+                raw.append(_timed(lambda: stats_engine.compute_stats(
+                    bike_investigation.load_data(city, month, day)))[1])
+                cubed.append(_timed(cube.cube_stats, city_cube, month, day)[1])
+        print(f"{rows} trips: cube built in {build_seconds:.2f} s, "
+              f"{os.path.getsize(bike_investigation.cube_path(city)) / 2**10:.0f} KiB, read in {load_seconds * 1000:.1f} ms")
+        print(f"{'path':<26} | {'median (ms)':>11} | {'max (ms)':>8}")
+        print("-" * 51)
+        for name, timings in [("load_data + compute_stats", raw), ("cube_stats", cubed)]:
+            print(f"{name:<26} | {np.median(timings) * 1000:>11.2f} | {max(timings) * 1000:>8.2f}")
+    finally:
+        bike_investigation.clear_city_session()
+        shutil.rmtree(workdir)
+
+
+def _stats_in_memory(directory, city):
+    use_data_dir(directory)
+    stats, seconds = _timed(lambda: stats_engine.compute_stats(bike_investigation.load_data(city, "all", "all",
+                                                                                             use_cache=False)))
+    return stats, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _stats_streaming(directory, city, chunksize, workers):
+    use_data_dir(directory)
+    stats, seconds = _timed(streaming_stats.stream_stats, city, chunksize=chunksize, workers=workers)
+    return stats, seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_isolated(func, *args):
+    """
+    Runs `func(*args)` in a fresh process, so that its peak RSS is measured on its own. The process is
+    spawned from this one, whose peak RSS it inherits, so this process must not hold large data itself.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        return pool.submit(func, *args).result()
+
+
+def benchmark_streaming(rows, city="chicago", chunksize=streaming_stats.CHUNK_SIZE, workers=None):
+    """Compare the time and peak memory of the statistics of a city file read whole and read in chunks."""
+    workdir = tempfile.mkdtemp()
+    try:
+        _run_isolated(generate_bike_csv, workdir, city, rows)
+        runs = [("whole file", _stats_in_memory, (workdir, city)),
+                ("chunks, 1 process", _stats_streaming, (workdir, city, chunksize, 1))]
+        if workers and workers > 1:
+            runs.append((f"chunks, {workers} workers", _stats_streaming, (workdir, city, chunksize, workers)))
+        print(f"{'path':<20} | {'seconds':>8} | {'peak RSS MiB':>12}")
+        print("-" * 46)
+        results = []
+        for name, func, args in runs:
+            stats, seconds, peak_rss = _run_isolated(func, *args)
+            results.append(stats)
+            print(f"{name:<20} | {seconds:>8.2f} | {peak_rss:>12.0f}")
+        print("Same results." if all(stats == results[0] for stats in results) else "Different results!")
+    finally:
+        shutil.rmtree(workdir)
+
+def benchmark_sketch(rows, stations=3000, sizes=(100, 1000, 10000), top_n=10):
+    """Compare the approximate top stations and trips of sketches of several sizes with the exact mode() results."""
+    workdir = tempfile.mkdtemp()
+    try:
+        use_data_dir(workdir)
+        generate_bike_frame("chicago", rows, stations=stations).to_csv(os.path.join(workdir, "chicago.csv"))
+        df, read_seconds = _timed(bike_investigation.read_city_csv, "chicago")
+        with contextlib.redirect_stdout(io.StringIO()):
+            exact, exact_seconds = _timed(bike_investigation.station_stats, df)
+        trips = (df["Start Station"].astype(object) + " to " + df["End Station"].astype(object)).value_counts()
+        exact_top = set(trips.index[:top_n])
+        print(f"{rows} trips, {len(trips)} distinct trips. Exact: read_city_csv {read_seconds:.2f} s + "
+              f"station_stats {exact_seconds:.2f} s, trip counts {trips.memory_usage(deep=True) / 2**20:.1f} MiB.")
+        print(f"{'counters':>8} | {'seconds':>8} | {'top trip':>8} | {'top stations':>12} | "
+              f"{f'top-{top_n} recall':>13} | {'error bound':>11} | {'max error':>9}")
+        print("-" * 88)
+        for size in sizes:
+            stats, seconds = _timed(sketches.sketch_station_stats, "chicago", top_n=top_n, size=size)
+            same_stations = (stats["mostCommonStartStation"] == exact["mostCommonStartStation"]
+                             and stats["mostCommonEndStation"] == exact["mostCommonEndStation"])
+            recall = len(exact_top & {trip for trip, _ in stats["topTrips"]}) / top_n
+            max_error = max(trips[trip] - estimate for trip, estimate in stats["topTrips"])
+            print(f"{size:>8} | {seconds:>8.2f} | {str(stats['mostCommonTrip'] == exact['mostCommonTrip']):>8} | "
+                  f"{str(same_stations):>12} | {recall:>13.0%} | {stats['errorBounds']['topTrips']:>11} | {max_error:>9}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _best_of(repeat, func):
+    """Return the shortest duration of `repeat` runs of `func`, with its output silenced."""
+    timings = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def run_suite(rows, repeat=3, cities=None):
+    """
+    Times the load and every statistics function of each city on synthetic files in the city schemas.
+    Args:
+        rows: Number of trips of each city file.
+        repeat: Number of runs of each measurement; the fastest one is kept.
+        cities: Cities to measure, all of CITY_DATA by default.
+    Returns:
+        List of {'name', 'rows', 'seconds', 'rows_per_sec'} results.
+    """
+    workdir = tempfile.mkdtemp()
+    results = []
+    try:
+        use_data_dir(workdir)
+        for seed, city in enumerate(cities or bike_investigation.CITY_DATA):
+            generate_bike_csv(workdir, city, rows, seed=seed)
+            bike_investigation.clear_city_session()
+            df = bike_investigation.read_city_csv(city)
+            measurements = {
+                "read_city_csv": lambda: bike_investigation.read_city_csv(city),
+                "load_data": lambda: bike_investigation.load_data(city, "all", "all"),
+                "time_stats": lambda: bike_investigation.time_stats(df),
+                "station_stats": lambda: bike_investigation.station_stats(df),
+                "trip_duration_stats": lambda: bike_investigation.trip_duration_stats(df),
+                "user_stats": lambda: bike_investigation.user_stats(df),
+                "compute_stats": lambda: stats_engine.compute_stats(df),
+            }
+            for name, func in measurements.items():
+                seconds = _best_of(repeat, func)
+                results.append({"name": f"{city}.{name}", "rows": rows, "seconds": seconds,
+                                "rows_per_sec": rows / seconds if seconds else None})
+                print(f"{city + '.' + name:<36} | {rows:>10} | {seconds:>8.4f} s")
+    finally:
+        bike_investigation.clear_city_session()
+        shutil.rmtree(workdir)
+    return results
+
+
+def save_results(results, path, **parameters):
+    """Write suite results to a JSON file together with the parameters and library versions of the run."""
+    document = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "numpy": np.__version__,
+        "parameters": parameters,
+        "results": results,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2)
+
+
+def benchmark_suite(rows, repeat, output):
+    results = run_suite(rows, repeat)
+    if output:
+        save_results(results, output, rows=rows, repeat=repeat)
+        print(f"Results saved to {output}.")
+
+
+BENCHMARKS = {
+    "cache": lambda args: benchmark_cache(args.rows, args.city),
+    "session": lambda args: benchmark_session(args.rows, args.city),
+    "stats": lambda args: benchmark_stats(args.rows, args.city),
+    "memory": lambda args: benchmark_memory(args.rows),
+    "grid": lambda args: benchmark_grid(args.rows, args.workers),
+    "cube": lambda args: benchmark_cube(args.rows, args.city),
+    "streaming": lambda args: benchmark_streaming(args.rows, args.city, workers=args.workers),
+    "sketch": lambda args: benchmark_sketch(args.rows),
+    "suite": lambda args: benchmark_suite(args.rows, args.repeat, args.output),
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the bikeshare investigation.")
+    parser.add_argument("benchmark", nargs="?", choices=BENCHMARKS, default="cache")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--city", choices=bike_investigation.CITY_DATA, default="chicago")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes of the grid benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs of each suite measurement, the fastest is kept")
+    parser.add_argument("--output", help="JSON file where the suite benchmark saves its results")
+    args = parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
@@ -1,5 +1,21 @@
+import glob
+import os
+from collections import OrderedDict
+import numpy as np
 import pandas as pd
-import time
+import sys
+
+from cube import build_cube, cube_stats, load_cube, save_cube
+from stats_engine import print_stats
+
+# instrumentation.py is shared with the Intermediate project and lives at the root of the repository
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+from instrumentation import instrumented, stage
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:  # The Parquet cache is optional, load_data falls back to the CSV files
+    pq = None
 
 CITY_DATA = {
     "chicago": "chicago.csv",
@@ -7,6 +23,38 @@ CITY_DATA = {
     "washington": "washington.csv",
 }
 
+DATA_DIR = "Bike_raw_data"
+CACHE_DIR = os.path.join(DATA_DIR, "cache")
+# Bumped whenever the layout of the cached frames changes, so older caches are rebuilt
+CACHE_VERSION = 4
+
+# Columns of each city read as categoricals; numeric columns are downcast after reading
+_TRIP_CATEGORIES = {"Start Station": "category", "End Station": "category", "User Type": "category"}
+CITY_SCHEMA = {
+    "chicago": {**_TRIP_CATEGORIES, "Gender": "category"},
+    "new york city": {**_TRIP_CATEGORIES, "Gender": "category"},
+    "washington": _TRIP_CATEGORIES,
+}
+# Numeric columns whose sums are statistics: float32 would round their totals, so their floats stay float64
+SUMMED_COLUMNS = ["Trip Duration"]
+
+MONTHS = ["january", "february", "march", "april", "may", "june"]
+DAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+# Number of parsed cities kept in memory for the session, least recently used first out
+MAX_CACHED_CITIES = 2
+_city_session = OrderedDict()
+# Cubes read during the session, keyed by their path; they are a few hundred KiB each
+_cube_session = {}
+
+# Columns read by each statistics function; 'month' and 'day_of_week' are always read for filtering
+STAT_COLUMNS = {
+    "time_stats": ["month", "day_of_week", "hour"],
+    "station_stats": ["Start Station", "End Station"],
+    "trip_duration_stats": ["Trip Duration"],
+    "user_stats": ["User Type", "Gender", "Birth Year"],
+}
+
 
 def get_filters():
     """
@@ -21,10 +69,8 @@ def get_filters():
 
     # List of valid cities, months, and days
     cities = ["chicago", "new york city", "washington"]
-    months = ["january", "february", "march", "april", "may", "june", "all"]
-    # days = list(calendar.day_name)
-    # days.append("all")
-    days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday", "all"]
+    months = MONTHS + ["all"]
+    days = DAYS + ["all"]
 
 
     # Get user input for city
@@ -56,38 +102,249 @@ def get_filters():
     return city, month, day
 
 
-def load_data(city, month, day):
+def downcast(series, floats=True):
+    """
+    Returns a numeric column in the smallest dtype that holds its values exactly: the smallest
+    (unsigned) integer type for integers, float32 for floats that float32 represents without loss.
+    Args:
+        series - numeric Pandas Series
+        (bool) floats - downcast floats too; False keeps them float64, e.g. for the SUMMED_COLUMNS
+    """
+    if pd.api.types.is_integer_dtype(series.dtype):
+        return pd.to_numeric(series, downcast='unsigned' if series.min() >= 0 else 'integer')
+    if floats and pd.api.types.is_float_dtype(series.dtype):
+        candidate = series.astype(np.float32)
+        if np.array_equal(candidate.to_numpy(np.float64), series.to_numpy(np.float64), equal_nan=True):
+            return candidate
+    return series
+
+
+@instrumented('bike.read_city_csv', rows_out=len)
+def read_city_csv(city, typed=True):
+    """
+    Reads the raw CSV file of a city and derives the month, day_of_week and hour columns.
+    Args:
+        (str) city - name of the city to read
+        (bool) typed - read the columns of CITY_SCHEMA as categoricals and downcast the numeric columns
+    Returns:
+        df - Pandas DataFrame containing all the trips of the city
+    """
+    df = pd.read_csv(os.path.join(DATA_DIR, CITY_DATA[city]), dtype=CITY_SCHEMA[city] if typed else None)
+
+    # Convert the 'Start Time' column to datetime
+    df['Start Time'] = pd.to_datetime(df['Start Time'])
+
+    # Extract month and day of week from 'Start Time' to create new columns
+    df['month'] = df['Start Time'].dt.month_name()
+    df['day_of_week'] = df['Start Time'].dt.day_name()
+    df['hour'] = df['Start Time'].dt.hour
+
+    if typed:
+        # The categories are sorted like the strings, so the most common values break ties the same way
+        df['month'] = df['month'].astype('category')
+        df['day_of_week'] = df['day_of_week'].astype('category')
+        for column in df.select_dtypes(include='number').columns:
+            df[column] = downcast(df[column], floats=column not in SUMMED_COLUMNS)
+    return df
+
+
+def memory_report(city):
+    """
+    Prints the memory used by each column of a city, read untyped and with CITY_SCHEMA.
+    Returns:
+        (tuple) total bytes untyped, total bytes typed
+    """
+    before = read_city_csv(city, typed=False).memory_usage(index=False, deep=True)
+    after = read_city_csv(city).memory_usage(index=False, deep=True)
+    print(f"{'column':<16} | {'untyped bytes':>14} | {'typed bytes':>14}")
+    print("-" * 50)
+    for column in before.index:
+        print(f"{column:<16} | {before[column]:>14,} | {after[column]:>14,}")
+    print("-" * 50)
+    print(f"{'total':<16} | {before.sum():>14,} | {after.sum():>14,}")
+    return before.sum(), after.sum()
+
+
+def cache_path(city):
+    """
+    Returns the path of the Parquet cache of a city. The mtime of the source CSV and CACHE_VERSION
+    are part of the name, so a cache built from an older CSV or by an older version is never used.
+    """
+    source = os.path.join(DATA_DIR, CITY_DATA[city])
+    stem = os.path.splitext(CITY_DATA[city])[0]
+    return os.path.join(CACHE_DIR, f"{stem}.{os.stat(source).st_mtime_ns}.v{CACHE_VERSION}.parquet")
+
+
+def build_cache(city):
+    """
+    Converts the CSV file of a city to a typed columnar Parquet file holding the derived
+    month, day_of_week and hour columns, and removes the caches of older versions of the CSV.
+    Returns:
+        (str) path of the Parquet file
+    """
+    path = cache_path(city)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    read_city_csv(city).to_parquet(path + ".tmp", engine="pyarrow", index=False)
+    os.replace(path + ".tmp", path)
+
+    stem = os.path.splitext(CITY_DATA[city])[0]
+    for stale in glob.glob(os.path.join(CACHE_DIR, f"{stem}.*.parquet")):
+        if stale != path:
+            os.remove(stale)
+    return path
+
+
+def stat_columns(stats):
+    """
+    Returns the columns read by the given statistics functions, after the 'month' and 'day_of_week'
+    filter columns.
+    Args:
+        (list) stats - names of the statistics functions (see STAT_COLUMNS)
+    """
+    return list(dict.fromkeys(["month", "day_of_week"] + [column for stat in stats for column in STAT_COLUMNS[stat]]))
+
+
+def read_city(city, stats=None, use_cache=True, columns=None):
+    """
+    Reads the trips of a city, from its Parquet cache when pyarrow is installed.
+    Args:
+        (str) city - name of the city to read
+        (list) stats - names of the statistics functions that will run (see STAT_COLUMNS),
+            or None to read every column
+        (bool) use_cache - read through the Parquet cache, building it if it is missing or stale
+        (list) columns - names of the columns to read instead of those of stats
+    Returns:
+        df - Pandas DataFrame containing the trips of the city
+    """
+    if not use_cache or pq is None:
+        return read_city_csv(city)
+
+    path = cache_path(city)
+    if not os.path.exists(path):
+        build_cache(city)
+    if columns is None and stats is not None:
+        columns = stat_columns(stats)
+    if columns is not None:
+        available = set(pq.read_schema(path).names)
+        columns = [column for column in columns if column in available]
+    return pd.read_parquet(path, engine="pyarrow", columns=columns)
+
+
+def _missing_columns(city, df, stats, use_cache):
+    """
+    Returns the columns of the Parquet cache of a city that the given statistics (all of them
+    for None) need and that df does not hold. Without the cache, df always holds every column.
+    """
+    if not use_cache or pq is None or not os.path.exists(cache_path(city)):
+        return []
+    names = pq.read_schema(cache_path(city)).names
+    wanted = names if stats is None else [column for column in stat_columns(stats) if column in names]
+    return [column for column in wanted if column not in df.columns]
+
+
+def get_city(city, use_cache=True, stats=None):
+    """
+    Returns the trips of a city with the integer month (1-12) and weekday (0 = Monday) of each trip.
+    The MAX_CACHED_CITIES most recently used cities stay in memory, so changing the filters
+    of a city does not parse it again. With stats, the first load of a city only reads the columns
+    of these statistics from the Parquet cache, and the columns a later call needs are added then.
+    Args:
+        (str) city - name of the city
+        (bool) use_cache - read the city through its Parquet cache
+        (list) stats - names of the statistics functions that will run, or None for every column
+    Returns:
+        (tuple) df, month codes, weekday codes
+    """
+    if city in _city_session:
+        _city_session.move_to_end(city)
+        df, month_codes, weekday_codes = _city_session[city]
+        missing = _missing_columns(city, df, stats, use_cache)
+        if not missing:
+            return _city_session[city]
+        df = pd.concat([df, read_city(city, columns=missing)], axis=1)
+        order = pq.read_schema(cache_path(city)).names
+        entry = (df[[column for column in order if column in df.columns]], month_codes, weekday_codes)
+    else:
+        # 'Start Time' is read with the columns of the statistics to compute the month and weekday codes
+        columns = None if stats is None else stat_columns(stats) + ["Start Time"]
+        df = read_city(city, use_cache=use_cache, columns=columns)
+        entry = (df, df['Start Time'].dt.month.to_numpy(np.int8), df['Start Time'].dt.dayofweek.to_numpy(np.int8))
+    _city_session[city] = entry
+    while len(_city_session) > MAX_CACHED_CITIES:
+        _city_session.popitem(last=False)
+    return entry
+
+
+def cube_path(city):
+    """
+    Returns the path of the aggregate cube of a city, named like its Parquet cache so that
+    a new CSV file or CACHE_VERSION invalidates it too.
+    """
+    return os.path.splitext(cache_path(city))[0] + ".cube.npz"
+
+
+def get_cube(city, use_cache=True):
+    """
+    Returns the aggregate cube of a city (see cube.py), building it from all the trips of the city
+    when it is missing or stale and removing the cubes of older versions of the CSV.
+    Args:
+        (str) city - name of the city
+        (bool) use_cache - read the trips through the Parquet cache to build the cube
+    Returns:
+        (dict) cube - NumPy arrays answering the statistics of any month and day filter
+    """
+    path = cube_path(city)
+    if path in _cube_session:
+        return _cube_session[path]
+    if not os.path.exists(path):
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        save_cube(build_cube(read_city(city, use_cache=use_cache)), path + ".tmp.npz")
+        os.replace(path + ".tmp.npz", path)
+        stem = os.path.splitext(CITY_DATA[city])[0]
+        for stale in glob.glob(os.path.join(CACHE_DIR, f"{stem}.*.cube.npz")):
+            if stale != path:
+                os.remove(stale)
+    _cube_session[path] = load_cube(path)
+    return _cube_session[path]
+
+
+def clear_city_session():
+    """Drops every city and cube kept in memory."""
+    _city_session.clear()
+    _cube_session.clear()
+
+
+@instrumented('bike.load_data', rows_out=len)
+def load_data(city, month, day, stats=None, use_cache=True):
     """
     Loads data for the specified city and filters by month and day if applicable.
     Args:
         (str) city - name of the city to analyze
         (str) month - name of the month to filter by, or "all" to apply no month filter
         (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (list) stats - names of the statistics functions that will run, to only read and return their columns
+        (bool) use_cache - read the city through its Parquet cache
     Returns:
         df - Pandas DataFrame containing city data filtered by month and day
     """
 
     try:
-        df = pd.read_csv("Bike_raw_data/" + CITY_DATA[city])
+        df, month_codes, weekday_codes = get_city(city, use_cache, stats)
     except FileNotFoundError:
         print(f"Data file for {city} not found.")
         return pd.DataFrame()  # Return an empty DataFrame
 
-    # Convert the 'Start Time' column to datetime
-    df['Start Time'] = pd.to_datetime(df['Start Time'])
+    if stats is not None:
+        df = df[[column for column in stat_columns(stats) if column in df.columns]]
 
-    # Extract month and day of week from 'Start Time' to create new columns
-    df['month'] = df['Start Time'].dt.month_name()
-    df['day_of_week'] = df['Start Time'].dt.day_name()
-    df['hour'] = df['Start Time'].dt.hour
-
-    # Filter by month if applicable
+    # Filter by month and day of week on the integer codes instead of comparing strings
+    mask = None
     if month != 'all':
-        df = df[df['month'] == month]
-
-    # Filter by day of week if applicable
+        mask = month_codes == MONTHS.index(month.lower()) + 1
     if day != 'all':
-        df = df[df['day_of_week'] == day]
+        day_mask = weekday_codes == DAYS.index(day.lower())
+        mask = day_mask if mask is None else mask & day_mask
+    df = df.copy(deep=False) if mask is None else df.iloc[np.flatnonzero(mask)]
 
     if df.empty:
         print("There is no data for the selected time period.")
@@ -95,6 +352,7 @@ def load_data(city, month, day):
     return df
 
 
+@instrumented('stat.time_stats', rows_in=len)
 def time_stats(df):
     """Displays and returns statistics on the most frequent times of travel if data is available.
     input: df
@@ -105,8 +363,6 @@ def time_stats(df):
         return {}
 
     print("\nCalculating The Most Frequent Times of Travel...\n")
-    start_time = time.time()
-
     # Display the most common month
     most_common_month = df['month'].mode()[0]
     print(f"The most common month is: {most_common_month}")
@@ -119,7 +375,6 @@ def time_stats(df):
     most_common_hour = df['hour'].mode()[0]
     print(f"The most common start hour is: {most_common_hour}")
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
     print("-" * 40)
     # Return the statistics as a dictionary
     return {
@@ -130,6 +385,7 @@ def time_stats(df):
 
 
 
+@instrumented('stat.station_stats', rows_in=len)
 def station_stats(df):
     """Displays and returns statistics on the most popular stations and trip.
     inpurt: df
@@ -139,8 +395,6 @@ def station_stats(df):
         return {}
 
     print("\nCalculating The Most Popular Stations and Trip...\n")
-    start_time = time.time()
-
     # TO DO: Display most commonly used start station
     most_common_start_station = df['Start Station'].mode()[0]
     print(f"The most commonly used start station is: {most_common_start_station}")
@@ -150,10 +404,10 @@ def station_stats(df):
     print(f"The most commonly used end station is: {most_common_end_station}")
 
     # TO DO: Display most frequent combination of start station and end station trip
-    most_common_trip = (df['Start Station'] + " to " + df['End Station']).mode()[0]
+    # Categorical station columns are combined as objects, which keeps the missing values missing
+    most_common_trip = (df['Start Station'].astype(object) + " to " + df['End Station'].astype(object)).mode()[0]
     print(f"The most frequent combination of start station and end station trip is: {most_common_trip}")
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
     print("-" * 40)
     # Return the statistics as a dictionary
     return {
@@ -163,12 +417,11 @@ def station_stats(df):
     }
 
 
+@instrumented('stat.trip_duration_stats', rows_in=len)
 def trip_duration_stats(df):
     """Displays and returns statistics on the total and average trip duration."""
 
     print("\nCalculating Trip Duration...\n")
-    start_time = time.time()
-
     # Check if 'Trip Duration' column exists in the DataFrame
     if 'Trip Duration' not in df.columns:
         print("Trip Duration data is not available for this dataset.")
@@ -182,7 +435,6 @@ def trip_duration_stats(df):
     mean_travel_time = df['Trip Duration'].mean()
     print(f"Mean travel time: {mean_travel_time} seconds")
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
     print("-" * 40)
 
     # Return the statistics as a dictionary
@@ -192,18 +444,18 @@ def trip_duration_stats(df):
     }
 
 
+@instrumented('stat.user_stats', rows_in=len)
 def user_stats(df):
     """Displays and returns statistics on bikeshare users."""
 
     print("\nCalculating User Stats...\n")
-    start_time = time.time()
-
     user_stats_data = {}  # Initialize a dictionary to store the results
 
     # Check if 'User Type' column exists in the DataFrame
     if 'User Type' in df.columns:
         # Display counts of user types
-        user_types_counts = df['User Type'].value_counts().to_dict()
+        # Categories absent from the filtered data have a zero count and are left out
+        user_types_counts = df['User Type'].value_counts().loc[lambda counts: counts > 0].to_dict()
         user_stats_data['User Types'] = user_types_counts
         print("Counts of user types:\n", user_types_counts)
     else:
@@ -212,7 +464,7 @@ def user_stats(df):
     # Check if 'Gender' column exists in the DataFrame
     if 'Gender' in df.columns:
         # Display counts of gender
-        gender_counts = df['Gender'].value_counts().to_dict()
+        gender_counts = df['Gender'].value_counts().loc[lambda counts: counts > 0].to_dict()
         user_stats_data['Gender'] = gender_counts
         print("\nCounts of gender:")
         print(gender_counts)
@@ -230,7 +482,6 @@ def user_stats(df):
     else:
         print("\nBirth year data is not available for this city.")
 
-    print("\nThis took %s seconds." % (time.time() - start_time))
     print("-" * 40)
 
     return user_stats_data  # Return the statistics as a dictionary
@@ -239,14 +490,18 @@ def user_stats(df):
 def main():
     while True:
         city, month, day = get_filters()
-        df = load_data(city, month, day)
-        if df.empty:
+        try:
+            cube = get_cube(city)
+        except FileNotFoundError:
+            print(f"Data file for {city} not found.")
+            continue
+        # The statistics come from the precomputed cube, without filtering or counting the trips again
+        with stage('stat.cube_stats'):
+            stats = cube_stats(cube, month, day)
+        if not stats['time_stats']:
             print("There is no data to display statistics.")
             continue
-        time_stats(df)
-        station_stats(df)
-        trip_duration_stats(df)
-        user_stats(df)
+        print_stats(stats)
 
         restart = input("\nWould you like to restart? Enter yes or no.\n")
         if restart.lower() != "yes":
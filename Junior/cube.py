@@ -0,0 +1,141 @@
+import numpy as np
+
+from stats_engine import encode, mode_from_counts, most_common_trip, value_counts_from_counts
+
+# Columns counted for every (month, weekday) cell of the cube, when the city has them
+CUBE_COLUMNS = ['hour', 'Start Station', 'End Station', 'User Type', 'Gender', 'Birth Year']
+
+
+def _values_array(values):
+    """Returns the distinct values of a column as an array that np.savez stores without pickling."""
+    values = np.asarray(values)
+    return values.astype(str) if values.dtype == object else values
+
+
+def build_cube(df):
+    """
+    Precomputes the counts and sums that time_stats, station_stats, trip_duration_stats and user_stats
+    need, for every (month, weekday) cell of the trips.
+
+    A joint cube over every column would have about one cell per trip, so each column is counted on its
+    own against (month, weekday): the cube stays a few thousand cells whatever the number of trips.
+    The most common trip is not additive over cells, so it is precomputed for each of the 7 x 8 filters.
+    Args:
+        df - Pandas DataFrame of all the trips of a city, as returned by read_city
+    Returns:
+        (dict) cube - NumPy arrays, see cube_stats
+    """
+    month_codes, months = encode(df['month'])
+    day_codes, days = encode(df['day_of_week'])
+    shape = (len(months), len(days))
+    cells = month_codes.astype(np.int64) * len(days) + day_codes
+    cube = {'months': _values_array(months), 'days': _values_array(days),
+            'trips': np.bincount(cells, minlength=shape[0] * shape[1]).reshape(shape)}
+
+    if 'Trip Duration' in df.columns:
+        durations = df['Trip Duration'].to_numpy()
+        weights = durations.astype(np.float64)
+        present = ~np.isnan(weights)
+        # Missing durations are skipped like Series.sum() and Series.mean() skip them
+        sums = np.bincount(cells, weights=np.nan_to_num(weights), minlength=shape[0] * shape[1])
+        # Integer durations are summed exactly in float64, so they are stored back as integers
+        cube['duration'] = (sums.astype(np.int64) if np.issubdtype(durations.dtype, np.integer) else sums).reshape(shape)
+        cube['duration.count'] = np.bincount(cells[present], minlength=shape[0] * shape[1]).reshape(shape)
+
+    for column in CUBE_COLUMNS:
+        if column not in df.columns:
+            continue
+        codes, values = encode(df[column])
+        valid = codes >= 0
+        counts = np.bincount(cells[valid] * len(values) + codes[valid], minlength=shape[0] * shape[1] * len(values))
+        cube[f'{column}.values'] = _values_array(values)
+        cube[f'{column}.counts'] = counts.reshape(shape + (len(values),))
+
+    # Index -1 of each axis stands for the "all" filter
+    start_codes, start_values = encode(df['Start Station'])
+    end_codes, end_values = encode(df['End Station'])
+    top_trips = np.full((shape[0] + 1, shape[1] + 1), '', dtype=object)
+    for month in range(-1, shape[0]):
+        for day in range(-1, shape[1]):
+            mask = np.ones(len(df), dtype=bool) if month < 0 else month_codes == month
+            if day >= 0:
+                mask &= day_codes == day
+            if mask.any() and ((start_codes[mask] >= 0) & (end_codes[mask] >= 0)).any():
+                top_trips[month, day] = most_common_trip(start_codes[mask], end_codes[mask], start_values, end_values)
+    cube['top_trips'] = top_trips.astype(str)
+    return cube
+
+
+def save_cube(cube, path):
+    """Writes a cube to an .npz file."""
+    np.savez(path, **cube)
+
+
+def load_cube(path):
+    """Reads a cube written by save_cube."""
+    with np.load(path, allow_pickle=False) as data:
+        return {name: data[name] for name in data.files}
+
+
+def _filter_index(values, value):
+    """Returns the index of a month or day filter along its axis, -1 for "all" and None when no trip has it."""
+    if value.lower() == 'all':
+        return -1
+    matches = np.flatnonzero(np.char.lower(values.astype(str)) == value.lower())
+    return int(matches[0]) if len(matches) else None
+
+
+def cube_stats(cube, month, day):
+    """
+    Answers time_stats, station_stats, trip_duration_stats and user_stats for a month and day filter from
+    a cube, with the same results as compute_stats(load_data(city, month, day)). Only the cells of the
+    cube are read, so the time does not depend on the number of trips.
+    Args:
+        (dict) cube - cube of a city, as returned by build_cube
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        (dict) the dictionary of each statistics function, keyed by the function name; a filter without
+            trips gives empty statistics
+    """
+    stats = {'time_stats': {}, 'station_stats': {}, 'trip_duration_stats': {}, 'user_stats': {}}
+    month_index, day_index = _filter_index(cube['months'], month), _filter_index(cube['days'], day)
+    selected = np.zeros(cube['trips'].shape, dtype=bool)
+    if month_index is not None and day_index is not None:
+        selected[slice(None) if month_index < 0 else month_index, slice(None) if day_index < 0 else day_index] = True
+    trips = np.where(selected, cube['trips'], 0)
+    if not trips.any():
+        return stats
+
+    def counts(column):
+        return (cube[f'{column}.counts'] * selected[:, :, None]).sum(axis=(0, 1))
+
+    stats['time_stats'] = {
+        'mostCommonMonth': mode_from_counts(cube['months'], trips.sum(axis=1)),
+        'mostCommonDay': mode_from_counts(cube['days'], trips.sum(axis=0)),
+        'mostCommonHour': mode_from_counts(cube['hour.values'], counts('hour')),
+    }
+    stats['station_stats'] = {
+        'mostCommonStartStation': mode_from_counts(cube['Start Station.values'], counts('Start Station')),
+        'mostCommonEndStation': mode_from_counts(cube['End Station.values'], counts('End Station')),
+        'mostCommonTrip': str(cube['top_trips'][month_index, day_index]),
+    }
+
+    if 'duration' in cube:
+        total, count = cube['duration'][selected].sum(), cube['duration.count'][selected].sum()
+        stats['trip_duration_stats'] = {'totalTravelTime': total,
+                                        'meanTravelTime': total / count if count else float('nan')}
+
+    user_stats = stats['user_stats']
+    if 'User Type.counts' in cube:
+        user_stats['User Types'] = value_counts_from_counts(cube['User Type.values'], counts('User Type'))
+    if 'Gender.counts' in cube:
+        user_stats['Gender'] = value_counts_from_counts(cube['Gender.values'], counts('Gender'))
+    if 'Birth Year.counts' in cube:
+        years, year_counts = cube['Birth Year.values'], counts('Birth Year')
+        present_years = years[year_counts > 0]
+        if len(present_years):
+            user_stats['Earliest Year of Birth'] = int(present_years.min())
+            user_stats['Most Recent Year of Birth'] = int(present_years.max())
+            user_stats['Most Common Year of Birth'] = int(mode_from_counts(years, year_counts))
+    return stats
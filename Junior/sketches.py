@@ -0,0 +1,126 @@
+import argparse
+
+import pandas as pd
+
+from bike_investigation import CITY_DATA, DAYS, MONTHS
+from streaming_stats import CHUNK_SIZE, filter_chunk, read_chunks
+
+# Counters kept by each sketch; the error of every count is at most (number of trips) / (SKETCH_SIZE + 1)
+SKETCH_SIZE = 1000
+TOP_N = 10
+
+
+def new_sketch():
+    """
+    Returns an empty frequent-items sketch (Misra-Gries, the counterpart of Space-Saving that underestimates).
+    Returns:
+        (dict) 'counts' - Series of the estimated count of each kept value, 'decrement' - the most
+            that any estimate is below its true count, 'total' - the number of values seen
+    """
+    return {'counts': None, 'decrement': 0, 'total': 0}
+
+
+def update_sketch(sketch, counts, size=SKETCH_SIZE):
+    """
+    Adds the exact counts of a chunk to a sketch and keeps at most `size` values. When more values are
+    kept, the (size + 1)-th largest count is subtracted from every count and the values that fall to zero
+    are dropped. The sketch is mergeable, so chunks can be added in any order with the same error bound.
+    Args:
+        (dict) sketch - sketch returned by new_sketch, updated in place
+        counts - Series of the counts of the values of a chunk, indexed by value
+        (int) size - maximum number of values kept
+    """
+    counts = counts[counts > 0]
+    sketch['total'] += int(counts.sum())
+    merged = counts if sketch['counts'] is None else sketch['counts'].add(counts, fill_value=0)
+    if len(merged) > size:
+        threshold = merged.nlargest(size + 1).iloc[-1]
+        merged = merged[merged > threshold] - threshold
+        sketch['decrement'] += int(threshold)
+    sketch['counts'] = merged.astype('int64')
+
+
+def top_items(sketch, n=TOP_N):
+    """
+    Returns the `n` values with the largest estimated counts, largest first and ties in value order.
+    The true count of each value is between its estimate and its estimate plus sketch['decrement'], and a
+    value that is not kept occurs at most sketch['decrement'] times.
+    Returns:
+        (list) (value, estimated count) tuples
+    """
+    if sketch['counts'] is None:
+        return []
+    items = sorted(sketch['counts'].items(), key=lambda item: (-item[1], item[0]))
+    return [(value, int(count)) for value, count in items[:n]]
+
+
+def _plain_index(counts):
+    """Returns counts indexed by plain values, so that the counts of chunks with other categories align."""
+    if isinstance(counts.index, pd.MultiIndex):
+        counts.index = pd.MultiIndex.from_arrays([counts.index.get_level_values(level).astype(object)
+                                                  for level in range(counts.index.nlevels)])
+    else:
+        counts.index = counts.index.astype(object)
+    return counts
+
+
+def sketch_station_stats(city, month="all", day="all", top_n=TOP_N, size=SKETCH_SIZE, chunksize=CHUNK_SIZE):
+    """
+    Approximates station_stats in one streaming pass over the file of a city, with memory bounded by the
+    chunk size and `size`, however many distinct stations and trips there are.
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) top_n - length of the top lists
+        (int) size - counters of each sketch
+        (int) chunksize - number of trips read at a time
+    Returns:
+        (dict) 'mostCommonStartStation', 'mostCommonEndStation' and 'mostCommonTrip' like station_stats,
+            the 'topStartStations', 'topEndStations' and 'topTrips' lists of (value, estimated count), and
+            the 'errorBounds' of each list: a true count is at most this much above its estimate. When the
+            first estimate of a list exceeds the second by more than its bound, the most common value is exact.
+    """
+    sketches = {'Start Station': new_sketch(), 'End Station': new_sketch(), 'trip': new_sketch()}
+    for chunk in read_chunks(city, chunksize):
+        if month != 'all' or day != 'all':
+            chunk, _ = filter_chunk(chunk, month, day)
+        for column in ('Start Station', 'End Station'):
+            update_sketch(sketches[column], _plain_index(chunk[column].value_counts()), size)
+        update_sketch(sketches['trip'], _plain_index(chunk.groupby(['Start Station', 'End Station'],
+                                                                   observed=True).size()), size)
+
+    tops = {name: top_items(sketch, top_n) for name, sketch in sketches.items()}
+    tops['trip'] = [(f"{start} to {end}", count) for (start, end), count in tops['trip']]
+    if not tops['trip']:
+        return {}
+    return {
+        'mostCommonStartStation': tops['Start Station'][0][0],
+        'mostCommonEndStation': tops['End Station'][0][0],
+        'mostCommonTrip': tops['trip'][0][0],
+        'topStartStations': tops['Start Station'],
+        'topEndStations': tops['End Station'],
+        'topTrips': tops['trip'],
+        'errorBounds': {'topStartStations': sketches['Start Station']['decrement'],
+                        'topEndStations': sketches['End Station']['decrement'],
+                        'topTrips': sketches['trip']['decrement']},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Approximate most common stations and trips in bounded memory.")
+    parser.add_argument("city", choices=CITY_DATA)
+    parser.add_argument("--month", choices=["all"] + MONTHS, default="all")
+    parser.add_argument("--day", choices=["all"] + DAYS, default="all")
+    parser.add_argument("--top", type=int, default=TOP_N, help="Length of the top lists")
+    parser.add_argument("--size", type=int, default=SKETCH_SIZE, help="Counters of each sketch")
+    args = parser.parse_args()
+
+    stats = sketch_station_stats(args.city, args.month, args.day, args.top, args.size)
+    if not stats:
+        print("There is no data for the selected time period.")
+    else:
+        for key in ('topStartStations', 'topEndStations', 'topTrips'):
+            print(f"\n{key} (true counts are at most {stats['errorBounds'][key]} above the estimates):")
+            for value, count in stats[key]:
+                print(f"{count:>10}  {value}")
@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+
+# Above this number of (start, end) station combinations, trips are counted with np.unique
+# instead of a dense np.bincount over every combination
+MAX_DENSE_PAIRS = 1 << 24
+
+
+def encode(series):
+    """
+    Returns the integer codes of a column and its distinct values, sorted like Series.mode() sorts them.
+    Missing values get the code -1. Categorical columns already hold their codes, so nothing is hashed.
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        # Series.mode() of a categorical column follows the order of its categories
+        return series.cat.codes.to_numpy(), series.cat.categories
+    return pd.factorize(series, sort=True)
+
+
+def count_codes(codes, size):
+    """Returns the number of occurrences of each code in 0..size-1, ignoring the missing values (-1)."""
+    return np.bincount(codes[codes >= 0], minlength=size)
+
+
+def mode_from_counts(values, counts):
+    """
+    Returns the most common value given the occurrences of each value. Ties go to the first value
+    in `values` order, which is what Series.mode()[0] returns when `values` is sorted.
+    """
+    return values[int(np.argmax(counts))]
+
+
+def value_counts_from_counts(values, counts):
+    """Returns a {value: count} dictionary of the non-zero counts, most common first, like value_counts()."""
+    order = np.argsort(-counts, kind='stable')
+    return {values[i]: int(counts[i]) for i in order if counts[i] > 0}
+
+
+def most_common_trip(start_codes, end_codes, start_values, end_values):
+    """
+    Returns the most common "<start> to <end>" trip by counting integer pairs of station codes,
+    without building a string per trip.
+    """
+    valid = (start_codes >= 0) & (end_codes >= 0)
+    n_end = len(end_values)
+    pairs = start_codes[valid].astype(np.int64) * n_end + end_codes[valid]
+    if len(start_values) * n_end <= MAX_DENSE_PAIRS:
+        counts = np.bincount(pairs, minlength=len(start_values) * n_end)
+        candidates = np.flatnonzero(counts == counts.max())
+    else:
+        unique_pairs, counts = np.unique(pairs, return_counts=True)
+        candidates = unique_pairs[counts == counts.max()]
+    # Series.mode() breaks ties on the trip string, so compare the strings of the tied pairs only
+    return min(f"{start_values[pair // n_end]} to {end_values[pair % n_end]}" for pair in candidates)
+
+
+def compute_stats(df):
+    """
+    Computes the results of time_stats, station_stats, trip_duration_stats and user_stats in one call.
+    Each column is encoded once and every "most common" value comes from integer counts instead of
+    Series.mode().
+    Args:
+        df - Pandas DataFrame returned by load_data
+    Returns:
+        (dict) the dictionary returned by each statistics function, keyed by the function name
+    """
+    stats = {'time_stats': {}, 'station_stats': {}, 'trip_duration_stats': {}, 'user_stats': {}}
+    encoded = {column: encode(df[column]) for column in df.columns
+               if column in ('month', 'day_of_week', 'hour', 'Start Station', 'End Station',
+                             'User Type', 'Gender', 'Birth Year')}
+    counts = {column: count_codes(codes, len(values)) for column, (codes, values) in encoded.items()}
+
+    if not df.empty:
+        for key, column in (('mostCommonMonth', 'month'), ('mostCommonDay', 'day_of_week'),
+                            ('mostCommonHour', 'hour')):
+            stats['time_stats'][key] = mode_from_counts(encoded[column][1], counts[column])
+
+        start_codes, start_values = encoded['Start Station']
+        end_codes, end_values = encoded['End Station']
+        stats['station_stats'] = {
+            'mostCommonStartStation': mode_from_counts(start_values, counts['Start Station']),
+            'mostCommonEndStation': mode_from_counts(end_values, counts['End Station']),
+            'mostCommonTrip': most_common_trip(start_codes, end_codes, start_values, end_values),
+        }
+
+    if 'Trip Duration' in df.columns:
+        stats['trip_duration_stats'] = {
+            'totalTravelTime': df['Trip Duration'].sum(),
+            'meanTravelTime': df['Trip Duration'].mean(),
+        }
+
+    user_stats = stats['user_stats']
+    if 'User Type' in encoded:
+        user_stats['User Types'] = value_counts_from_counts(encoded['User Type'][1], counts['User Type'])
+    if 'Gender' in encoded:
+        user_stats['Gender'] = value_counts_from_counts(encoded['Gender'][1], counts['Gender'])
+    if 'Birth Year' in encoded:
+        years, year_counts = encoded['Birth Year'][1], counts['Birth Year']
+        present_years = years[year_counts > 0]
+        # No birth year in the filter, e.g. a month and day without trips, like cube_stats
+        if len(present_years):
+            user_stats['Earliest Year of Birth'] = int(present_years.min())
+            user_stats['Most Recent Year of Birth'] = int(present_years.max())
+            user_stats['Most Common Year of Birth'] = int(mode_from_counts(years, year_counts))
+    return stats
+
+
+def print_stats(stats):
+    """Displays the results of compute_stats."""
+    titles = {
+        'time_stats': "The Most Frequent Times of Travel",
+        'station_stats': "The Most Popular Stations and Trip",
+        'trip_duration_stats': "Trip Duration",
+        'user_stats': "User Stats",
+    }
+    for name, results in stats.items():
+        print(f"\n{titles[name]}:\n")
+        if not results:
+            print("This data is not available for the selected city and period.")
+        for key, value in results.items():
+            print(f"{key}: {value}")
+        print("-" * 40)
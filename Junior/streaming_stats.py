@@ -0,0 +1,190 @@
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import pandas as pd
+
+import bike_investigation
+from bike_investigation import CITY_DATA, CITY_SCHEMA, DAYS, MONTHS
+from stats_engine import print_stats
+
+CHUNK_SIZE = 200_000
+# Columns read from the raw files; 'End Time' is never used by the statistics
+STREAM_COLUMNS = ["Start Time", "Trip Duration", "Start Station", "End Station", "User Type", "Gender", "Birth Year"]
+# Columns whose values are counted for the mode and value_counts calculations
+COUNTED_COLUMNS = ["month", "day_of_week", "hour", "Start Station", "End Station", "User Type", "Gender", "Birth Year"]
+
+
+def empty_partial(columns=()):
+    """
+    Returns the partial state of no trips.
+    Args:
+        (iterable) columns - columns of the raw file, which decide the statistics that are available
+    Returns:
+        (dict) 'rows', 'columns', 'counts' ({column: Counter of its values}), 'trips' (Counter of
+            (start, end) station pairs), 'duration_sum' and 'duration_count'
+    """
+    return {'rows': 0, 'columns': set(columns), 'counts': {}, 'trips': Counter(),
+            'duration_sum': 0, 'duration_count': 0}
+
+
+def filter_chunk(chunk, month="all", day="all"):
+    """
+    Filters a chunk of raw trips by month and day, like load_data.
+    Returns:
+        (tuple) the trips of the chunk that pass the filters, their parsed 'Start Time'
+    """
+    start_time = pd.to_datetime(chunk['Start Time'])
+    mask = pd.Series(True, index=chunk.index)
+    if month != 'all':
+        mask &= start_time.dt.month == MONTHS.index(month.lower()) + 1
+    if day != 'all':
+        mask &= start_time.dt.dayofweek == DAYS.index(day.lower())
+    return chunk[mask], start_time[mask]
+
+
+def partial_stats(chunk, month="all", day="all"):
+    """
+    Filters a chunk of raw trips by month and day and returns its mergeable partial state: the counts of
+    every value needed for the modes, the counts of each trip, the sum and count of the trip durations.
+    The state grows with the number of distinct values, not with the number of trips.
+    Args:
+        chunk - Pandas DataFrame of raw trips, as read from the CSV file of a city
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+    Returns:
+        (dict) partial state, see empty_partial
+    """
+    partial = empty_partial(chunk.columns)
+    chunk, start_time = filter_chunk(chunk, month, day)
+    columns = {'month': start_time.dt.month_name(), 'day_of_week': start_time.dt.day_name(),
+               'hour': start_time.dt.hour}
+    columns.update({column: chunk[column] for column in COUNTED_COLUMNS if column in chunk.columns})
+
+    partial['rows'] = len(chunk)
+    for column, values in columns.items():
+        counts = values.value_counts()
+        partial['counts'][column] = Counter({value: int(count) for value, count in counts.items() if count > 0})
+    trips = chunk.groupby(['Start Station', 'End Station'], observed=True).size()
+    partial['trips'] = Counter({pair: int(count) for pair, count in trips.items() if count > 0})
+    if 'Trip Duration' in chunk.columns:
+        partial['duration_sum'] = chunk['Trip Duration'].sum()
+        partial['duration_count'] = int(chunk['Trip Duration'].count())
+    return partial
+
+
+def merge_partials(left, right):
+    """Returns the partial state of the trips of two partial states; the order of the merges does not matter."""
+    merged = empty_partial(left['columns'] | right['columns'])
+    merged['rows'] = left['rows'] + right['rows']
+    for column in left['counts'].keys() | right['counts'].keys():
+        merged['counts'][column] = left['counts'].get(column, Counter()) + right['counts'].get(column, Counter())
+    merged['trips'] = left['trips'] + right['trips']
+    merged['duration_sum'] = left['duration_sum'] + right['duration_sum']
+    merged['duration_count'] = left['duration_count'] + right['duration_count']
+    return merged
+
+
+def _mode(counts):
+    """Returns the most common value of a Counter; ties go to the smallest value, like Series.mode()[0]."""
+    top = max(counts.values())
+    return min(value for value, count in counts.items() if count == top)
+
+
+def finalize(partial):
+    """
+    Turns a partial state into the results of time_stats, station_stats, trip_duration_stats and user_stats.
+    Returns:
+        (dict) the dictionary of each statistics function, keyed by the function name; a filter without
+            trips gives empty statistics
+    """
+    stats = {'time_stats': {}, 'station_stats': {}, 'trip_duration_stats': {}, 'user_stats': {}}
+    counts = partial['counts']
+    if partial['rows']:
+        stats['time_stats'] = {
+            'mostCommonMonth': _mode(counts['month']),
+            'mostCommonDay': _mode(counts['day_of_week']),
+            'mostCommonHour': _mode(counts['hour']),
+        }
+        top = max(partial['trips'].values())
+        stats['station_stats'] = {
+            'mostCommonStartStation': _mode(counts['Start Station']),
+            'mostCommonEndStation': _mode(counts['End Station']),
+            # Series.mode() breaks ties on the trip string
+            'mostCommonTrip': min(f"{start} to {end}" for (start, end), count in partial['trips'].items()
+                                  if count == top),
+        }
+
+    if 'Trip Duration' in partial['columns']:
+        total, count = partial['duration_sum'], partial['duration_count']
+        stats['trip_duration_stats'] = {'totalTravelTime': total,
+                                        'meanTravelTime': total / count if count else float('nan')}
+
+    user_stats = stats['user_stats']
+    if 'User Type' in partial['columns']:
+        user_stats['User Types'] = dict(counts.get('User Type', Counter()).most_common())
+    if 'Gender' in partial['columns']:
+        user_stats['Gender'] = dict(counts.get('Gender', Counter()).most_common())
+    if counts.get('Birth Year'):
+        user_stats['Earliest Year of Birth'] = int(min(counts['Birth Year']))
+        user_stats['Most Recent Year of Birth'] = int(max(counts['Birth Year']))
+        user_stats['Most Common Year of Birth'] = int(_mode(counts['Birth Year']))
+    return stats
+
+
+def read_chunks(city, chunksize=CHUNK_SIZE):
+    """
+    Reads the raw CSV file of a city in chunks of at most `chunksize` trips, with the columns of
+    CITY_SCHEMA as categoricals. Only the columns used by the statistics are read.
+    """
+    path = os.path.join(bike_investigation.DATA_DIR, CITY_DATA[city])
+    header = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, usecols=[column for column in STREAM_COLUMNS if column in header],
+                       dtype=CITY_SCHEMA[city], chunksize=chunksize)
+
+
+def stream_stats(city, month="all", day="all", chunksize=CHUNK_SIZE, workers=1):
+    """
+    Computes the statistics of a city without holding its file in memory, with the same results as the
+    four statistics functions on load_data(city, month, day).
+    Args:
+        (str) city - name of the city to analyze
+        (str) month - name of the month to filter by, or "all" to apply no month filter
+        (str) day - name of the day of week to filter by, or "all" to apply no day filter
+        (int) chunksize - number of trips read at a time
+        (int) workers - number of worker processes computing the partial states; with 1 the chunks are
+            processed in this process. At most two chunks per worker are in flight, so memory stays
+            bounded whatever the size of the file.
+    Returns:
+        (dict) the dictionary of each statistics function, keyed by the function name
+    """
+    chunks = read_chunks(city, chunksize)
+    partial = empty_partial()
+    if workers == 1:
+        for chunk in chunks:
+            partial = merge_partials(partial, partial_stats(chunk, month, day))
+        return finalize(partial)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        running = set()
+        for chunk in chunks:
+            if len(running) >= 2 * workers:
+                done, running = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    partial = merge_partials(partial, future.result())
+            running.add(pool.submit(partial_stats, chunk, month, day))
+        for future in running:
+            partial = merge_partials(partial, future.result())
+    return finalize(partial)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bikeshare statistics of a city file of any size, read in chunks.")
+    parser.add_argument("city", choices=CITY_DATA)
+    parser.add_argument("--month", choices=["all"] + MONTHS, default="all")
+    parser.add_argument("--day", choices=["all"] + DAYS, default="all")
+    parser.add_argument("--chunksize", type=int, default=CHUNK_SIZE, help="Trips read at a time")
+    parser.add_argument("--workers", type=int, default=1, help="Worker processes computing the partial states")
+    args = parser.parse_args()
+    print_stats(stream_stats(args.city, args.month, args.day, args.chunksize, args.workers))
@@ -0,0 +1,53 @@
+import unittest
+import bike_investigation
+from batch_report import *
+from benchmark import generate_bike_csv
+from test_bike_investigation import CityDataTestCase
+
+
+class TestBatchReport(CityDataTestCase):
+
+    def write_city_files(self):
+        """Write small synthetic files of two cities."""
+        generate_bike_csv(self.data_dir, 'chicago', 2000, seed=1)
+        generate_bike_csv(self.data_dir, 'washington', 2000, seed=2)
+
+    def test_matches_one_city_at_a_time(self):
+        """Test that the parallel report holds the statistics of each city and filter computed on its own."""
+        cities, months, days = ['chicago', 'washington'], ['all', 'february'], ['all', 'monday']
+        report, seconds = batch_report(cities, months, days, workers=2, data_dir=self.data_dir)
+
+        self.assertEqual(list(report), cities)
+        self.assertEqual(set(seconds), set(cities))
+        for city in cities:
+            for month in months:
+                for day in days:
+                    with self.subTest(city=city, month=month, day=day):
+                        expected = compute_stats(bike_investigation.load_data(city, month, day))
+                        self.assertEqual(report[city][month][day], expected)
+        self.assertNotIn('Gender', report['washington']['all']['all']['user_stats'])
+
+    def test_cells_without_trips(self):
+        """Test that the month and day cells without trips of a small city give empty user statistics."""
+        generate_bike_csv(self.data_dir, 'chicago', 30, seed=3)
+        bike_investigation.clear_city_session()
+        report, _ = batch_report(['chicago'], data_dir=self.data_dir)
+        empty_cells = 0
+        for month, days in report['chicago'].items():
+            for day, stats in days.items():
+                with self.subTest(month=month, day=day):
+                    if stats['time_stats']:
+                        self.assertEqual(stats, compute_stats(bike_investigation.load_data('chicago', month, day)))
+                    else:
+                        empty_cells += 1
+                        self.assertEqual(stats['user_stats'], {'User Types': {}, 'Gender': {}})
+        self.assertGreater(empty_cells, 0)
+
+    def test_invalid_filter(self):
+        """Test that an unknown city is rejected before any worker starts."""
+        with self.assertRaises(ValueError):
+            batch_report(['paris'], data_dir=self.data_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
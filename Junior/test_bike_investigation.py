@@ -1,5 +1,9 @@
 import unittest
+import os
+import shutil
+import tempfile
 import pandas as pd
+import bike_investigation
 from bike_investigation import time_stats, station_stats, trip_duration_stats, user_stats
 
 
@@ -126,5 +130,138 @@ class TestBikeShareData(unittest.TestCase):
         self.assertEqual(result, {})
 
 
+class CityDataTestCase(unittest.TestCase):
+    """Base class of the tests that read city files from a temporary data directory."""
+
+    def setUp(self):
+        """Point the module at a temporary data directory holding the city files of write_city_files."""
+        self.data_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.data_dir)
+        for name in ('DATA_DIR', 'CACHE_DIR'):
+            self.addCleanup(setattr, bike_investigation, name, getattr(bike_investigation, name))
+        bike_investigation.DATA_DIR = self.data_dir
+        bike_investigation.CACHE_DIR = os.path.join(self.data_dir, 'cache')
+        self.write_city_files()
+        bike_investigation.clear_city_session()
+        self.addCleanup(bike_investigation.clear_city_session)
+
+    def write_city_files(self):
+        """Write a small chicago file of three trips."""
+        self.csv_path = os.path.join(self.data_dir, 'chicago.csv')
+        pd.DataFrame({
+            'Start Time': ['2017-01-01 09:07:57', '2017-01-02 09:07:57', '2017-01-03 00:07:57'],
+            'End Time': ['2017-01-01 09:20:53', '2017-01-02 09:20:53', '2017-01-03 00:20:53'],
+            'Trip Duration': [776, 776, 776],
+            'Start Station': ['Station A', 'Station B', 'Station A'],
+            'End Station': ['Station B', 'Station A', 'Station B'],
+            'User Type': ['Subscriber', 'Customer', 'Subscriber'],
+            'Gender': ['Male', 'Female', 'Female'],
+            'Birth Year': [1980, 1992, 1985],
+        }).to_csv(self.csv_path)
+
+
+class TestParquetCache(CityDataTestCase):
+
+    def test_cache_matches_csv(self):
+        """Test that the cached city holds the same data as the CSV file."""
+        from_csv = bike_investigation.read_city('chicago', use_cache=False)
+        from_cache = bike_investigation.read_city('chicago')
+        self.assertTrue(os.path.exists(bike_investigation.cache_path('chicago')))
+        pd.testing.assert_frame_equal(from_cache, from_csv, check_dtype=False)
+
+    def test_cache_reads_only_needed_columns(self):
+        """Test that only the filter columns and the columns of the requested stats are read."""
+        df = bike_investigation.read_city('chicago', stats=['station_stats'])
+        self.assertEqual(list(df.columns), ['month', 'day_of_week', 'Start Station', 'End Station'])
+
+    def test_cache_is_rebuilt_when_csv_changes(self):
+        """Test that a new mtime of the CSV file invalidates the cache."""
+        old_cache = bike_investigation.build_cache('chicago')
+        stat = os.stat(self.csv_path)
+        os.utime(self.csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+        bike_investigation.read_city('chicago')
+        self.assertFalse(os.path.exists(old_cache))
+        self.assertTrue(os.path.exists(bike_investigation.cache_path('chicago')))
+
+
+class TestSessionCache(CityDataTestCase):
+
+    def test_filters_by_month_and_day(self):
+        """Test the month and day filters, whatever the case of the user input."""
+        self.assertEqual(len(bike_investigation.load_data('chicago', 'all', 'all')), 3)
+        self.assertEqual(len(bike_investigation.load_data('chicago', 'january', 'all')), 3)
+        self.assertEqual(len(bike_investigation.load_data('chicago', 'January', 'monday')), 1)
+        self.assertTrue(bike_investigation.load_data('chicago', 'march', 'all').empty)
+
+    def test_city_is_parsed_once_per_session(self):
+        """Test that changing the filters of a city does not read it again."""
+        reads = []
+        read_city = bike_investigation.read_city
+        self.addCleanup(setattr, bike_investigation, 'read_city', read_city)
+        bike_investigation.read_city = lambda *args, **kwargs: reads.append(args) or read_city(*args, **kwargs)
+
+        bike_investigation.load_data('chicago', 'june', 'friday')
+        bike_investigation.load_data('chicago', 'march', 'all')
+        self.assertEqual(len(reads), 1)
+
+    def test_first_load_reads_only_needed_columns(self):
+        """Test that the first load of a city prunes its columns and that a later load adds the others."""
+        df = bike_investigation.load_data('chicago', 'all', 'all', stats=['station_stats'])
+        self.assertEqual(list(df.columns), ['month', 'day_of_week', 'Start Station', 'End Station'])
+        self.assertEqual(set(bike_investigation._city_session['chicago'][0].columns),
+                         {'Start Time', 'Start Station', 'End Station', 'month', 'day_of_week'})
+
+        df = bike_investigation.load_data('chicago', 'january', 'monday')
+        expected = bike_investigation.read_city('chicago')
+        pd.testing.assert_frame_equal(df, expected.iloc[[1]])
+
+    def test_least_recently_used_city_is_evicted(self):
+        """Test that no more than MAX_CACHED_CITIES cities stay in memory."""
+        shutil.copy(self.csv_path, os.path.join(self.data_dir, 'washington.csv'))
+        self.addCleanup(setattr, bike_investigation, 'MAX_CACHED_CITIES', bike_investigation.MAX_CACHED_CITIES)
+        bike_investigation.MAX_CACHED_CITIES = 1
+
+        bike_investigation.load_data('chicago', 'all', 'all')
+        bike_investigation.load_data('washington', 'all', 'all')
+        self.assertEqual(list(bike_investigation._city_session), ['washington'])
+
+
+class TestTypedSchema(CityDataTestCase):
+
+    def test_columns_are_compact(self):
+        """Test that strings are read as categoricals and numbers in the smallest dtype."""
+        df = bike_investigation.read_city_csv('chicago')
+        for column in ['Start Station', 'End Station', 'User Type', 'Gender', 'month', 'day_of_week']:
+            self.assertIsInstance(df[column].dtype, pd.CategoricalDtype, column)
+        self.assertEqual(df['Trip Duration'].dtype, 'uint16')
+        self.assertEqual(df['Birth Year'].dtype, 'uint16')
+        self.assertEqual(df['hour'].dtype, 'uint8')
+
+    def test_typed_data_gives_the_same_stats(self):
+        """Test that the statistics do not depend on the dtypes."""
+        typed = bike_investigation.read_city_csv('chicago')
+        untyped = bike_investigation.read_city_csv('chicago', typed=False)
+        self.assertEqual(time_stats(typed), time_stats(untyped))
+        self.assertEqual(station_stats(typed), station_stats(untyped))
+        self.assertEqual(trip_duration_stats(typed), trip_duration_stats(untyped))
+        self.assertEqual(user_stats(typed), user_stats(untyped))
+
+    def test_downcast_keeps_float_precision(self):
+        """Test that floats that float32 cannot hold exactly stay float64."""
+        self.assertEqual(bike_investigation.downcast(pd.Series([1103.198, 321.0])).dtype, 'float64')
+        self.assertEqual(bike_investigation.downcast(pd.Series([1980.0, None])).dtype, 'float32')
+
+    def test_summed_floats_stay_float64(self):
+        """Test that a trip duration column with missing values keeps its exact total."""
+        df = pd.read_csv(self.csv_path, index_col=0)
+        df['Trip Duration'] = [2295847000.0, 924.0, None]
+        df.to_csv(self.csv_path)
+        typed = bike_investigation.read_city_csv('chicago')
+        self.assertEqual(typed['Trip Duration'].dtype, 'float64')
+        self.assertEqual(trip_duration_stats(typed)['totalTravelTime'], 2295847924)
+        self.assertEqual(typed['Birth Year'].dtype, 'uint16')
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
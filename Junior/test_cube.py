@@ -0,0 +1,69 @@
+import unittest
+import os
+import numpy as np
+import bike_investigation
+from benchmark import generate_bike_frame
+from cube import *
+from stats_engine import compute_stats
+from test_bike_investigation import CityDataTestCase
+
+
+class TestCube(CityDataTestCase):
+
+    def write_city_files(self):
+        """Write synthetic files of two cities."""
+        # Few stations, so that the most common stations and trips are often tied
+        for seed, city in enumerate(['chicago', 'washington']):
+            generate_bike_frame(city, 3000, stations=40, seed=seed).to_csv(
+                os.path.join(self.data_dir, bike_investigation.CITY_DATA[city]))
+
+    def test_matches_raw_path(self):
+        """Test that every month and day filter gives the statistics of the raw trips."""
+        for city in ['chicago', 'washington']:
+            cube = bike_investigation.get_cube(city)
+            for month in ['all'] + bike_investigation.MONTHS:
+                for day in ['all'] + bike_investigation.DAYS:
+                    with self.subTest(city=city, month=month, day=day):
+                        expected = compute_stats(bike_investigation.load_data(city, month, day))
+                        self.assertEqual(cube_stats(cube, month, day), expected)
+
+    def test_filter_without_trips(self):
+        """Test that a month without trips gives empty statistics."""
+        df = bike_investigation.read_city('chicago')
+        cube = build_cube(df[df['month'] != 'June'])
+        self.assertEqual(cube_stats(cube, 'june', 'all'),
+                         {'time_stats': {}, 'station_stats': {}, 'trip_duration_stats': {}, 'user_stats': {}})
+        self.assertEqual(cube_stats(cube, 'June', 'all'), cube_stats(cube, 'june', 'all'))
+
+    def test_missing_durations(self):
+        """Test that missing trip durations are left out of the total and the mean, like trip_duration_stats."""
+        df = generate_bike_frame('chicago', 3000, stations=40, seed=5)
+        df.loc[df.index[::7], 'Trip Duration'] = np.nan
+        df.to_csv(os.path.join(self.data_dir, 'chicago.csv'))
+        bike_investigation.clear_city_session()
+        cube = bike_investigation.get_cube('chicago')
+        for month, day in [('all', 'all'), ('march', 'all'), ('all', 'sunday')]:
+            with self.subTest(month=month, day=day):
+                expected = compute_stats(bike_investigation.load_data('chicago', month, day))['trip_duration_stats']
+                self.assertEqual(cube_stats(cube, month, day)['trip_duration_stats'], expected)
+                self.assertFalse(np.isnan(expected['meanTravelTime']))
+
+    def test_cube_is_saved_and_rebuilt_when_csv_changes(self):
+        """Test that the cube is written once and rebuilt from a newer CSV file."""
+        cube = bike_investigation.get_cube('chicago')
+        old_path = bike_investigation.cube_path('chicago')
+        self.assertTrue(os.path.exists(old_path))
+        bike_investigation.clear_city_session()
+        for name, array in bike_investigation.get_cube('chicago').items():
+            np.testing.assert_array_equal(array, cube[name], name)
+
+        csv_path = os.path.join(self.data_dir, 'chicago.csv')
+        stat = os.stat(csv_path)
+        os.utime(csv_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        bike_investigation.get_cube('chicago')
+        self.assertFalse(os.path.exists(old_path))
+        self.assertTrue(os.path.exists(bike_investigation.cube_path('chicago')))
+
+
+if __name__ == '__main__':
+    unittest.main()
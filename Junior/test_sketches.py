@@ -0,0 +1,54 @@
+import unittest
+import os
+import bike_investigation
+from bike_investigation import station_stats
+from benchmark import generate_bike_frame
+from sketches import *
+from test_bike_investigation import CityDataTestCase
+
+
+class TestSketches(CityDataTestCase):
+
+    def setUp(self):
+        """Read the whole chicago file once for the exact statistics."""
+        super().setUp()
+        self.df = bike_investigation.load_data('chicago', 'all', 'all')
+
+    def write_city_files(self):
+        """Write a synthetic chicago file with more distinct trips than the small sketches keep."""
+        generate_bike_frame('chicago', 20000, stations=100, seed=3).to_csv(os.path.join(self.data_dir, 'chicago.csv'))
+
+    def test_exact_when_every_value_fits(self):
+        """Test that a sketch larger than the number of distinct values gives the exact station_stats."""
+        stats = sketch_station_stats('chicago', size=20000, chunksize=3000)
+        self.assertEqual(stats['errorBounds'], {'topStartStations': 0, 'topEndStations': 0, 'topTrips': 0})
+        expected = station_stats(self.df)
+        self.assertEqual({key: stats[key] for key in expected}, expected)
+        exact_trips = (self.df['Start Station'].astype(object) + " to " + self.df['End Station'].astype(object))
+        self.assertEqual([count for _, count in stats['topTrips']], exact_trips.value_counts().head(10).tolist())
+
+    def test_error_bounds(self):
+        """Test that with few counters every estimate is within its bound of the true count."""
+        size = 50
+        stats = sketch_station_stats('chicago', size=size, chunksize=3000)
+        trips = (self.df['Start Station'].astype(object) + " to " + self.df['End Station'].astype(object)).value_counts()
+        bound = stats['errorBounds']['topTrips']
+        self.assertGreater(bound, 0)
+        self.assertLessEqual(bound, len(self.df) / (size + 1))
+        for trip, estimate in stats['topTrips']:
+            self.assertLessEqual(estimate, trips[trip])
+            self.assertLessEqual(trips[trip], estimate + bound)
+        starts = self.df['Start Station'].value_counts()
+        for station, estimate in stats['topStartStations']:
+            self.assertLessEqual(estimate, starts[station])
+            self.assertLessEqual(starts[station], estimate + stats['errorBounds']['topStartStations'])
+
+    def test_filters(self):
+        """Test that the month and day filters apply before counting."""
+        stats = sketch_station_stats('chicago', 'march', 'sunday', size=20000)
+        self.assertEqual(stats['mostCommonTrip'],
+                         station_stats(bike_investigation.load_data('chicago', 'march', 'sunday'))['mostCommonTrip'])
+
+
+if __name__ == '__main__':
+    unittest.main()
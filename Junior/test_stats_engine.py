@@ -0,0 +1,63 @@
+import unittest
+import numpy as np
+import pandas as pd
+from bike_investigation import time_stats, station_stats, trip_duration_stats, user_stats
+from stats_engine import compute_stats
+
+
+def random_trips(rows, seed):
+    """Build trips with few distinct values, so that the most common values are often tied."""
+    rng = np.random.default_rng(seed)
+    start = pd.Timestamp('2017-01-01') + pd.to_timedelta(rng.integers(0, 181 * 86400, rows), unit='s')
+    stations = np.array(['A', 'A B', 'B', 'Clark St', None], dtype=object)
+    df = pd.DataFrame({
+        'Start Time': start,
+        'Trip Duration': rng.integers(60, 3600, rows),
+        'Start Station': rng.choice(stations, rows),
+        'End Station': rng.choice(stations, rows),
+        'User Type': rng.choice(np.array(['Subscriber', 'Customer'], dtype=object), rows),
+        'Gender': rng.choice(np.array(['Male', 'Female', None], dtype=object), rows),
+        'Birth Year': np.where(rng.random(rows) < 0.2, np.nan, rng.integers(1950, 1955, rows)),
+    })
+    df['month'] = df['Start Time'].dt.month_name()
+    df['day_of_week'] = df['Start Time'].dt.day_name()
+    df['hour'] = df['Start Time'].dt.hour
+    return df
+
+
+class TestStatsEngine(unittest.TestCase):
+
+    def assertSameAsStatsFunctions(self, df):
+        expected = {
+            'time_stats': time_stats(df),
+            'station_stats': station_stats(df),
+            'trip_duration_stats': trip_duration_stats(df),
+            'user_stats': user_stats(df),
+        }
+        self.assertEqual(compute_stats(df), expected)
+
+    def test_matches_stats_functions(self):
+        """Test that the engine returns the dictionaries of the four statistics functions."""
+        for rows, seed in [(7, 1), (40, 2), (5000, 3)]:
+            with self.subTest(rows=rows, seed=seed):
+                self.assertSameAsStatsFunctions(random_trips(rows, seed))
+
+    def test_categorical_columns(self):
+        """Test that categorical columns give the same results as string columns."""
+        df = random_trips(500, 5)
+        expected = compute_stats(df)
+        categorical = df.astype({column: 'category' for column in ['month', 'Start Station', 'End Station', 'Gender']})
+        self.assertEqual(compute_stats(categorical), expected)
+
+    def test_missing_columns(self):
+        """Test a city without user details, like washington."""
+        df = random_trips(100, 4).drop(columns=['Gender', 'Birth Year'])
+        self.assertSameAsStatsFunctions(df)
+
+    def test_empty_data(self):
+        """Test that an empty DataFrame gives empty results."""
+        self.assertSameAsStatsFunctions(pd.DataFrame())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import os
+import bike_investigation
+from benchmark import generate_bike_frame
+from stats_engine import compute_stats
+from streaming_stats import *
+from test_bike_investigation import CityDataTestCase
+
+
+class TestStreamingStats(CityDataTestCase):
+
+    def write_city_files(self):
+        """Write synthetic files of two cities."""
+        # Few stations, so that the most common stations and trips are often tied
+        for seed, city in enumerate(['chicago', 'washington']):
+            generate_bike_frame(city, 5000, stations=40, seed=seed).to_csv(
+                os.path.join(self.data_dir, bike_investigation.CITY_DATA[city]))
+
+    def test_matches_stats_functions(self):
+        """Test that the merged chunks give the results of the statistics functions on the whole file."""
+        for city in ['chicago', 'washington']:
+            for month, day in [('all', 'all'), ('march', 'all'), ('all', 'sunday'), ('june', 'friday')]:
+                with self.subTest(city=city, month=month, day=day):
+                    expected = compute_stats(bike_investigation.load_data(city, month, day))
+                    self.assertEqual(stream_stats(city, month, day, chunksize=700), expected)
+
+    def test_parallel_workers(self):
+        """Test that chunks processed in worker processes and merged in any order give the same results."""
+        expected = stream_stats('chicago', chunksize=700)
+        self.assertEqual(stream_stats('chicago', chunksize=700, workers=2), expected)
+
+    def test_merge_is_order_independent(self):
+        """Test that merging the partial states in another order gives the same state."""
+        partials = [partial_stats(chunk) for chunk in read_chunks('chicago', chunksize=1000)]
+        forward, backward = empty_partial(), empty_partial()
+        for partial in partials:
+            forward = merge_partials(forward, partial)
+        for partial in reversed(partials):
+            backward = merge_partials(partial, backward)
+        self.assertEqual(forward, backward)
+        self.assertEqual(forward['rows'], 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,141 @@
+"""Per-stage timing and metrics shared by the Intermediate ETL and the Junior bikeshare analysis.
+
+Every instrumented stage emits one structured record with its wall time, CPU time, rows in and out,
+the peak RSS of the process so far (`peak_rss_mb`) and how much the stage raised it (`rss_growth_mb`).
+The peak RSS only ever grows, so a stage that stays below the peak of an earlier stage has no growth;
+its own peak is measured with tracemalloc. Records are kept by `collector` and, when a log path is configured
+(or the METRICS_LOG environment variable is set), appended to a JSON lines file. Chosen stages can
+also run under cProfile (METRICS_PROFILE) or tracemalloc (METRICS_TRACEMALLOC), both given as
+comma-separated stage names.
+"""
+import cProfile
+import functools
+import json
+import os
+import resource
+import time
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+# Long-running processes such as the query service emit records forever, so only the latest are kept in memory
+MAX_RECORDS = 10_000
+
+
+class MetricsCollector:
+    """Keeps the latest emitted records in memory and optionally appends them all to a JSON lines file."""
+
+    def __init__(self, path=None, max_records=MAX_RECORDS):
+        self.path = path
+        self.records = deque(maxlen=max_records)
+
+    def emit(self, record):
+        self.records.append(record)
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def clear(self):
+        self.records.clear()
+
+
+def _stage_names(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+
+collector = MetricsCollector(os.environ.get('METRICS_LOG'))
+_profiled_stages = _stage_names(os.environ.get('METRICS_PROFILE'))
+_traced_stages = _stage_names(os.environ.get('METRICS_TRACEMALLOC'))
+_profile_dir = os.environ.get('METRICS_PROFILE_DIR', '.')
+
+
+def configure(log_path=None, profile=(), trace_memory=(), profile_dir=None):
+    """Configure the instrumentation from code instead of environment variables.
+
+    Args:
+        log_path: JSON lines file the records are appended to, None to only keep them in memory.
+        profile: Names of the stages to run under cProfile; their stats are dumped to <profile_dir>/<stage>.prof.
+        trace_memory: Names of the stages whose peak Python allocations, above those alive when the stage
+            starts, are measured with tracemalloc.
+        profile_dir: Directory of the cProfile dumps.
+    """
+    global _profile_dir
+    collector.path = log_path
+    _profiled_stages.clear()
+    _profiled_stages.update(profile)
+    _traced_stages.clear()
+    _traced_stages.update(trace_memory)
+    if profile_dir is not None:
+        _profile_dir = profile_dir
+
+
+def _peak_rss_mb():
+    """Return the peak resident set size of the process in MiB (ru_maxrss is in KiB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+@contextmanager
+def stage(name, rows_in=None, **fields):
+    """Measure the block of a stage and emit its record when the block exits.
+
+    The record is yielded so that the block can fill in 'rows_out' or extra fields.
+
+    Args:
+        name: Name of the stage, e.g. 'extract' or 'stat.time_stats'.
+        rows_in: Number of rows the stage receives, if known.
+        fields: Extra fields added to the record.
+    """
+    record = {'stage': name, 'rows_in': rows_in, 'rows_out': None, **fields}
+    tracing = name in _traced_stages
+    started_tracing = tracing and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    if tracing:
+        # Already tracing, e.g. in an enclosing traced stage: the peak is measured from here
+        tracemalloc.reset_peak()
+        traced_start = tracemalloc.get_traced_memory()[0]
+    start_peak_rss = _peak_rss_mb()
+    profiler = cProfile.Profile() if name in _profiled_stages else None
+    if profiler:
+        profiler.enable()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        record['wall_seconds'] = time.perf_counter() - start_wall
+        record['cpu_seconds'] = time.process_time() - start_cpu
+        if profiler:
+            profiler.disable()
+            record['profile'] = os.path.join(_profile_dir, f"{name}.prof")
+            profiler.dump_stats(record['profile'])
+        if tracing:
+            record['traced_peak_mb'] = (tracemalloc.get_traced_memory()[1] - traced_start) / 2**20
+        if started_tracing:
+            tracemalloc.stop()
+        record['peak_rss_mb'] = _peak_rss_mb()
+        record['rss_growth_mb'] = record['peak_rss_mb'] - start_peak_rss
+        record['timestamp'] = time.time()
+        collector.emit(record)
+
+
+def instrumented(name, rows_in=None, rows_out=None):
+    """Decorator running a function as a stage.
+
+    Args:
+        name: Name of the stage.
+        rows_in: Function of the call arguments returning the number of rows in.
+        rows_out: Function of the return value returning the number of rows out.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name, rows_in(*args, **kwargs) if rows_in else None) as record:
+                result = func(*args, **kwargs)
+                if rows_out:
+                    record['rows_out'] = rows_out(result)
+                return result
+        return wrapper
+    return decorator
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Each project runs its own benchmark suite from its directory, with the arguments of its scale
+SUITES = {
+    'Intermediate': lambda args: ['--sizes', str(args.retail_rows), '--history', str(args.history_rows)],
+    'Junior': lambda args: ['--rows', str(args.bike_rows)],
+}
+
+
+def run_suites(args):
+    """Run the benchmark suite of every project in its own process and merge their JSON results."""
+    merged = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for project, suite_args in SUITES.items():
+            output = os.path.join(workdir, f'{project}.json')
+            subprocess.run([sys.executable, 'benchmark.py', 'suite', '--repeat', str(args.repeat),
+                            '--output', output, *suite_args(args)],
+                           cwd=os.path.join(ROOT, project), check=True)
+            with open(output) as f:
+                merged[project] = json.load(f)
+    return merged
+
+
+def compare(current, baseline, tolerance):
+    """Print the change of every measurement against a baseline run.
+
+    Returns:
+        List of the names of the measurements that are slower than the baseline by more than `tolerance`.
+    """
+    regressions = []
+    print(f"\n{'measurement':<58} | {'baseline (s)':>12} | {'current (s)':>11} | {'change':>8}")
+    print("-" * 99)
+    for project, document in current.items():
+        previous = {result['name']: result for result in baseline.get(project, {}).get('results', [])}
+        for result in document['results']:
+            name = f"{project}/{result['name']}"
+            before = previous.get(result['name'])
+            if before is None or not before['seconds']:
+                print(f"{name:<58} | {'-':>12} | {result['seconds']:>11.4f} | {'new':>8}")
+                continue
+            change = result['seconds'] / before['seconds'] - 1
+            flag = ''
+            if change > tolerance:
+                regressions.append(name)
+                flag = '  REGRESSION'
+            print(f"{name:<58} | {before['seconds']:>12.4f} | {result['seconds']:>11.4f} | {change:>+8.1%}{flag}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the benchmark suites of both projects and save them as JSON.")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file of the merged results")
+    parser.add_argument('--baseline', help="JSON file of a previous run to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Slowdown against the baseline reported as a regression (0.2 = 20%%)")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--retail-rows', type=int, default=100_000, help="Rows of the synthetic retail file")
+    parser.add_argument('--history-rows', type=int, default=1_000_000, help="Rows of the queried transactions table")
+    parser.add_argument('--bike-rows', type=int, default=300_000, help="Trips of each synthetic city file")
+    args = parser.parse_args()
+
+    results = run_suites(args)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}.")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} measurements regressed by more than {args.tolerance:.0%}.")
+            sys.exit(1)
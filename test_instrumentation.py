@@ -0,0 +1,98 @@
+import unittest
+import json
+import os
+import shutil
+import tempfile
+import instrumentation
+from instrumentation import collector, configure, instrumented, stage
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        """Start every test with an empty collector and no log file, profiling or tracing."""
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        configure(profile_dir=self.workdir)
+        collector.clear()
+        self.addCleanup(configure, profile_dir='.')
+        self.addCleanup(collector.clear)
+
+    def test_decorated_stage_records_rows(self):
+        """Test that a decorated function emits one record with its rows in and out."""
+        @instrumented('double', rows_in=len, rows_out=len)
+        def double(values):
+            return values + values
+
+        self.assertEqual(double([1, 2, 3]), [1, 2, 3, 1, 2, 3])
+        record, = collector.records
+        self.assertEqual((record['stage'], record['rows_in'], record['rows_out']), ('double', 3, 6))
+        for key in ('wall_seconds', 'cpu_seconds', 'peak_rss_mb', 'rss_growth_mb', 'timestamp'):
+            self.assertGreaterEqual(record[key], 0)
+
+    def test_failed_stage_records_error(self):
+        """Test that a stage raising an exception is still recorded, with the error."""
+        with self.assertRaises(ValueError):
+            with stage('failing'):
+                raise ValueError("bad row")
+        self.assertEqual(collector.records[0]['error'], "ValueError: bad row")
+
+    def test_records_are_appended_to_log(self):
+        """Test that the records are appended to the JSON lines log."""
+        log_path = os.path.join(self.workdir, 'metrics.jsonl')
+        configure(log_path=log_path)
+        for name in ('extract', 'load'):
+            with stage(name, rows_in=10) as record:
+                record['rows_out'] = 8
+        with open(log_path) as f:
+            records = [json.loads(line) for line in f]
+        self.assertEqual([(r['stage'], r['rows_in'], r['rows_out']) for r in records],
+                         [('extract', 10, 8), ('load', 10, 8)])
+
+    def test_profile_and_memory_trace(self):
+        """Test that the selected stages are profiled and traced, and the others are not."""
+        configure(profile=['build'], trace_memory=['build'], profile_dir=self.workdir)
+        with stage('build'):
+            [0] * 100_000
+        with stage('other'):
+            pass
+        build, other = collector.records
+        self.assertTrue(os.path.isfile(os.path.join(self.workdir, 'build.prof')))
+        self.assertEqual(build['profile'], os.path.join(self.workdir, 'build.prof'))
+        self.assertGreater(build['traced_peak_mb'], 0.5)
+        self.assertNotIn('profile', other)
+        self.assertNotIn('traced_peak_mb', other)
+        self.assertFalse(instrumentation.tracemalloc.is_tracing())
+
+    def test_memory_is_measured_per_stage(self):
+        """Test that a small stage after a large one reports its own memory, not the peak of the large one."""
+        configure(trace_memory=['large', 'small'])
+        with stage('large'):
+            block = bytearray(64 * 2**20)
+            block[::4096] = b'x' * len(block[::4096])
+            del block
+        with stage('small'):
+            [0] * 1000
+        large, small = collector.records
+        self.assertGreater(large['traced_peak_mb'], 60)
+        self.assertLess(small['traced_peak_mb'], 1)
+        self.assertGreaterEqual(large['rss_growth_mb'], 0)
+        self.assertLess(small['rss_growth_mb'], 1)
+        self.assertGreaterEqual(small['peak_rss_mb'], large['peak_rss_mb'])
+
+    def test_nested_traced_stages(self):
+        """Test that a traced stage inside another traced stage measures its peak from its own start."""
+        configure(trace_memory=['outer', 'inner'])
+        with stage('outer'):
+            kept = bytearray(16 * 2**20)
+            with stage('inner'):
+                [0] * 1000
+        del kept
+        inner, outer = collector.records
+        self.assertLess(inner['traced_peak_mb'], 1)
+        self.assertGreater(outer['traced_peak_mb'], 15)
+        self.assertFalse(instrumentation.tracemalloc.is_tracing())
+
+
+if __name__ == '__main__':
+    unittest.main()